@@ -1,4 +1,18 @@
+AUTOCOMPLETE_MAX_SIZE = 500000
+BASE64_CHUNK_SIZE = 4 * 64 * 1024
+BULK_RECIPES_LIMIT = 100
+COVERAGE_JOURNAL_SIZE = 1000
 EMAIL_LENGTH = 254
+FEED_FANOUT_BATCH = 1000
+FEED_FANOUT_LIMIT = 1000
+FEED_LENGTH = 500
+IMAGE_VARIANT_QUALITY = 80
+IMAGE_VARIANT_SIZES = {
+    'list': (400, 400),
+    'card': (960, 960),
+}
+IMPORT_BATCH_SIZE = 5000
+IMPORT_REJECTS_SHOWN = 20
 INGREDIENT_LENGTH = 128
 MEASURMENT_LENGTH = 64
 MAX_LENGTH = 200
@@ -10,8 +24,21 @@ MIN_COOKING_TIME = 1
 MIN_INGREDIENTS = 1
 NAME_LENGTH = 150
 PAGE_SIZE = 6
+QUERY_REPEAT_LIMIT = 10
+# Поля пользователя, которые выводятся в рецептах как данные автора.
+RECIPE_AUTHOR_FIELDS = ('avatar', 'email', 'first_name', 'last_name',
+                        'username')
+RECIPE_CACHE_TIMEOUT = 60 * 10
 RECIPE_LENGTH = 256
+RECIPE_MAX_AGE = 10
+RECIPE_REVALIDATE_TIMEOUT = 10
+REFERENCE_CACHE_SIZE = 512
+REFERENCE_CACHE_TIMEOUT = 60 * 60 * 24
+REFERENCE_MAX_AGE = 60
+REFERENCE_VERSION_TTL = 5
 ROLE_LENGTH = 10
+SEARCH_CONFIG = 'russian'
+SHOP_LIST_CHUNK_SIZE = 2000
 SLUG_LENGTH = 32
 TAG_LENGTH = 32
 IMAGE_LENGTH = 7000
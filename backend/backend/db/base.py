@@ -0,0 +1,77 @@
+from functools import partial
+
+from django.db.backends.postgresql import base
+from psycopg2 import extensions
+
+from .pool import get_pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL с пулом соединений процесса.
+
+    Параметры пула берутся из OPTIONS['pool'] (как во встроенном пуле
+    Django 5.1). Закрытое Django соединение не разрывается, а
+    возвращается в пул, поэтому CONN_MAX_AGE должен быть 0: тогда каждый
+    запрос отдаёт соединение в конце и лимит пула общий для всех потоков
+    процесса, в том числе потоков запросов под ASGI.
+    """
+
+    @property
+    def pool(self):
+        options = self.settings_dict['OPTIONS'].get('pool')
+        if not options:
+            return None
+        return get_pool(self.alias, check_connection, reset_connection,
+                        options)
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('pool', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        try:
+            return pool.getconn(
+                partial(super().get_new_connection, conn_params))
+        except TimeoutError as error:
+            raise self.Database.OperationalError(str(error)) from error
+
+    def _close(self):
+        pool = self.pool
+        if pool is None or self.connection is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            if self.in_atomic_block:
+                # Обёртка продолжит ссылаться на соединение до отката,
+                # отдавать его другим потокам нельзя.
+                pool.discard(self.connection)
+            else:
+                pool.putconn(self.connection)
+
+
+def check_connection(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except base.Database.Error:
+        return False
+    return True
+
+
+def reset_connection(connection):
+    """Откатить незавершённую транзакцию; False — соединение непригодно."""
+    if connection.closed:
+        return False
+    status = connection.info.transaction_status
+    if status == extensions.TRANSACTION_STATUS_IDLE:
+        return True
+    if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    try:
+        connection.rollback()
+    except base.Database.Error:
+        return False
+    return True
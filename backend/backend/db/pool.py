@@ -0,0 +1,194 @@
+import threading
+import time
+from collections import Counter
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """Пул соединений с БД одного процесса.
+
+    Одновременно открыто не больше max_size соединений; когда все заняты,
+    запрос ждёт освобождения до timeout секунд. Свободные соединения
+    выдаются в порядке LIFO. Соединения старше max_lifetime и
+    простаивавшие дольше max_idle закрываются, простаивавшие дольше
+    check_idle перед выдачей проверяются функцией check (None — без
+    проверки). Функция reset возвращает соединение в исходное состояние
+    перед возвратом в пул и сообщает, можно ли им пользоваться дальше.
+    """
+
+    def __init__(self, check, reset, max_size, timeout, max_lifetime,
+                 max_idle, check_idle):
+        self.check = check
+        self.reset = reset
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check_idle = check_idle
+        self.condition = threading.Condition()
+        self.idle = []
+        self.created = {}
+        self.size = 0
+        self.waiting = 0
+        self.counters = Counter()
+        self.wait_max = 0.0
+
+    def getconn(self, connect):
+        """Взять соединение из пула или открыть новое функцией connect."""
+        started = time.monotonic()
+        while True:
+            connection, released = self.acquire(started)
+            if connection is None:
+                return self.open(connect)
+            if (self.check_idle is None
+                    or time.monotonic() - released < self.check_idle
+                    or self.check(connection)):
+                return connection
+            self.discard(connection, failed_check=True)
+
+    def putconn(self, connection):
+        """Вернуть соединение в пул (или закрыть, если оно непригодно)."""
+        created = self.created.get(connection)
+        if (created is None
+                or time.monotonic() - created >= self.max_lifetime
+                or not self.reset(connection)):
+            self.discard(connection)
+            return
+        with self.condition:
+            self.idle.append((connection, time.monotonic()))
+            self.condition.notify()
+
+    def discard(self, connection, failed_check=False):
+        """Закрыть соединение и освободить его место в пуле."""
+        with self.condition:
+            self.forget(connection)
+            if failed_check:
+                self.counters['failed_checks'] += 1
+            self.condition.notify()
+        self.close(connection)
+
+    def acquire(self, started):
+        """Свободное соединение и время его возврата или (None, None).
+
+        (None, None) означает, что место под новое соединение уже занято
+        за вызывающим.
+        """
+        expired = []
+        try:
+            with self.condition:
+                deadline = started + self.timeout
+                waited = False
+                while True:
+                    now = time.monotonic()
+                    # Новые запросы не обгоняют уже ждущих.
+                    if waited or not self.waiting:
+                        connection, released = self.take(now, expired)
+                        if connection is not None or released is None:
+                            self.record_wait(now - started, waited)
+                            if waited and (self.idle
+                                           or self.size < self.max_size):
+                                self.condition.notify()
+                            return connection, released
+                    if now >= deadline:
+                        self.counters['timeouts'] += 1
+                        raise TimeoutError(
+                            f'Нет свободного соединения с БД за '
+                            f'{self.timeout} с (занято {self.size}).')
+                    waited = True
+                    self.waiting += 1
+                    try:
+                        self.condition.wait(deadline - now)
+                    finally:
+                        self.waiting -= 1
+        finally:
+            for connection in expired:
+                self.close(connection)
+
+    def take(self, now, expired):
+        """Свободное соединение, место под новое (None, None) или отказ.
+
+        Отказ — (None, now), когда пул заполнен; просроченные соединения
+        складываются в expired для закрытия вне блокировки.
+        """
+        while self.idle:
+            connection, released = self.idle.pop()
+            if (now - self.created[connection] < self.max_lifetime
+                    and now - released < self.max_idle):
+                return connection, released
+            self.forget(connection)
+            expired.append(connection)
+        if self.size < self.max_size:
+            self.size += 1
+            return None, None
+        return None, now
+
+    def open(self, connect):
+        try:
+            connection = connect()
+        except BaseException:
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.created[connection] = time.monotonic()
+            self.counters['opened'] += 1
+        return connection
+
+    def forget(self, connection):
+        if self.created.pop(connection, None) is not None:
+            self.size -= 1
+            self.counters['closed'] += 1
+
+    def close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def record_wait(self, wait, waited):
+        self.counters['requests'] += 1
+        if waited:
+            self.counters['waits'] += 1
+            self.counters['wait_ms_total'] += wait * 1000
+            self.wait_max = max(self.wait_max, wait)
+
+    def stats(self):
+        """Размер пула, ожидания свободного соединения и пересоздания."""
+        with self.condition:
+            return {
+                'size': self.size,
+                'idle': len(self.idle),
+                'in_use': self.size - len(self.idle),
+                'max_size': self.max_size,
+                'requests': self.counters['requests'],
+                'waits': self.counters['waits'],
+                'wait_ms_total': round(self.counters['wait_ms_total'], 2),
+                'wait_ms_max': round(self.wait_max * 1000, 2),
+                'timeouts': self.counters['timeouts'],
+                'opened': self.counters['opened'],
+                'closed': self.counters['closed'],
+                'failed_checks': self.counters['failed_checks'],
+            }
+
+
+def get_pool(alias, check, reset, options):
+    """Пул процесса для подключения alias, создаётся при первом обращении.
+
+    Пул создаётся лениво, уже в воркере, поэтому соединения не
+    разделяются между процессами после fork.
+    """
+    pool = pools.get(alias)
+    if pool is None:
+        with pools_lock:
+            pool = pools.get(alias)
+            if pool is None:
+                pool = pools[alias] = ConnectionPool(check, reset, **options)
+    return pool
+
+
+def pool_stats():
+    """Статистика всех пулов процесса по подключениям."""
+    return {alias: pool.stats() for alias, pool in list(pools.items())}
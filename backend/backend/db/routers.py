@@ -0,0 +1,28 @@
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# Реплика, выбранная для чтения в текущем запросе, или None.
+read_replica = ContextVar('read_replica', default=None)
+
+
+class ReplicaRouter:
+    """Чтение с реплики, выбранной для запроса, запись — в основную БД.
+
+    Реплику выбирает представление (recipes.replicas.ReplicaReadMixin)
+    только для безопасных запросов; вне таких запросов всё идёт в
+    основную БД.
+    """
+
+    def db_for_read(self, model, **hints):
+        return read_replica.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.REPLICA_DATABASES}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
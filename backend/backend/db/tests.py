@@ -0,0 +1,185 @@
+import threading
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from recipes.models import User
+
+from . import pool
+from .pool import ConnectionPool
+from .routers import ReplicaRouter, read_replica
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class Clock:
+    """Часы пула, которые двигает тест."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    """Пул на поддельных соединениях: лимиты, сроки жизни, проверки."""
+
+    def setUp(self):
+        self.check = mock.Mock(return_value=True)
+        self.reset = mock.Mock(return_value=True)
+        self.clock = Clock()
+        patcher = mock.patch.object(pool, 'time',
+                                    mock.Mock(monotonic=self.clock))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_pool(self, **options):
+        return ConnectionPool(self.check, self.reset, **{
+            'max_size': 2, 'timeout': 0.05, 'max_lifetime': 600,
+            'max_idle': 60, 'check_idle': 5, **options})
+
+    def test_reuses_last_returned(self):
+        connections = self.make_pool()
+        first = connections.getconn(FakeConnection)
+        second = connections.getconn(FakeConnection)
+        connections.putconn(first)
+        connections.putconn(second)
+        self.assertIs(connections.getconn(FakeConnection), second)
+        stats = connections.stats()
+        self.assertEqual((stats['opened'], stats['size'], stats['idle']),
+                         (2, 2, 1))
+
+    @mock.patch.object(pool, 'time', time)
+    def test_timeout_when_full(self):
+        connections = self.make_pool(max_size=1)
+        connections.getconn(FakeConnection)
+        with self.assertRaises(TimeoutError):
+            connections.getconn(FakeConnection)
+        self.assertEqual(connections.stats()['timeouts'], 1)
+
+    def test_discards_after_max_lifetime(self):
+        connections = self.make_pool()
+        connection = connections.getconn(FakeConnection)
+        self.clock.now += 600
+        connections.putconn(connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(connections.stats()['size'], 0)
+
+    def test_discards_after_max_idle(self):
+        connections = self.make_pool()
+        connection = connections.getconn(FakeConnection)
+        connections.putconn(connection)
+        self.clock.now += 60
+        self.assertIsNot(connections.getconn(FakeConnection), connection)
+        self.assertTrue(connection.closed)
+        self.check.assert_not_called()
+        self.assertEqual(connections.stats()['size'], 1)
+
+    def test_checks_idle_connection(self):
+        connections = self.make_pool()
+        connection = connections.getconn(FakeConnection)
+        connections.putconn(connection)
+        self.clock.now += 1
+        self.assertIs(connections.getconn(FakeConnection), connection)
+        self.check.assert_not_called()
+        connections.putconn(connection)
+        self.clock.now += 5
+        self.check.return_value = False
+        self.assertIsNot(connections.getconn(FakeConnection), connection)
+        self.check.assert_called_once_with(connection)
+        self.assertTrue(connection.closed)
+        stats = connections.stats()
+        self.assertEqual((stats['failed_checks'], stats['size']), (1, 1))
+
+    def test_discards_when_reset_fails(self):
+        connections = self.make_pool()
+        connection = connections.getconn(FakeConnection)
+        self.reset.return_value = False
+        connections.putconn(connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(connections.stats()['idle'], 0)
+
+    def test_connect_failure_releases_slot(self):
+        connections = self.make_pool(max_size=1)
+        with self.assertRaises(OSError):
+            connections.getconn(mock.Mock(side_effect=OSError))
+        self.assertEqual(connections.stats()['size'], 0)
+        self.assertIsInstance(connections.getconn(FakeConnection),
+                              FakeConnection)
+
+    @mock.patch.object(pool, 'time', time)
+    def test_waiting_request_served_first(self):
+        connections = self.make_pool(max_size=1, timeout=0.3)
+        connection = connections.getconn(FakeConnection)
+        received = []
+        waiter = threading.Thread(
+            target=lambda: received.append(
+                connections.getconn(FakeConnection)))
+        waiter.start()
+        while not connections.waiting:
+            time.sleep(0.001)
+        connections.putconn(connection)
+        # Новый запрос не обгоняет ждущий, а ждёт сам и не дожидается.
+        with self.assertRaises(TimeoutError):
+            connections.getconn(FakeConnection)
+        waiter.join()
+        self.assertEqual(received, [connection])
+        stats = connections.stats()
+        self.assertEqual((stats['waits'], stats['timeouts']), (1, 1))
+
+
+class PoolStatsViewTest(TestCase):
+    """Статистика пулов доступна администраторам без выборки запросов."""
+
+    def get(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.get('/api/db_pool/')
+
+    def test_staff_only(self):
+        connections = ConnectionPool(None, None, 1, 1, 1, 1, None)
+        user = User.objects.create(username='user', email='user@foodgram.io')
+        with mock.patch.dict(pool.pools, {'default': connections}):
+            self.assertEqual(self.get(user).status_code, 403)
+            user.is_staff = True
+            user.save()
+            response = self.get(user)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['pools'],
+                         {'default': connections.stats()})
+
+
+@override_settings(REPLICA_DATABASES=['replica'])
+class ReplicaRouterTest(SimpleTestCase):
+    """Чтение идёт на реплику, выбранную для запроса, запись — в default."""
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+
+    def test_read_and_write(self):
+        self.assertIsNone(self.router.db_for_read(User))
+        self.assertEqual(self.router.db_for_write(User), 'default')
+        token = read_replica.set('replica')
+        try:
+            self.assertEqual(self.router.db_for_read(User), 'replica')
+            self.assertEqual(self.router.db_for_write(User), 'default')
+        finally:
+            read_replica.reset(token)
+        self.assertIsNone(self.router.db_for_read(User))
+
+    def test_relations_between_primary_and_replicas(self):
+        primary, replica, other = User(), User(), User()
+        primary._state.db = 'default'
+        replica._state.db = 'replica'
+        other._state.db = 'other'
+        self.assertTrue(self.router.allow_relation(primary, replica))
+        self.assertIsNone(self.router.allow_relation(primary, other))
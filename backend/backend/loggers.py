@@ -1,5 +1,26 @@
+import json
 import logging
 
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись журнала — одна строка JSON.
+
+    Если сообщение передано словарём, его ключи попадают в запись как есть.
+    """
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record),
+            'name': record.name,
+            'level': record.levelname,
+        }
+        if isinstance(record.msg, dict):
+            data.update(record.msg)
+        else:
+            data['message'] = record.getMessage()
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
 logger = logging.getLogger('foodgram_logger')
 logger.setLevel(logging.INFO)
 
@@ -9,8 +30,7 @@ file_handler.setLevel(logging.INFO)
 console_handler = logging.StreamHandler()
 console_handler.setLevel(logging.INFO)
 
-formatter = logging.Formatter(
-    '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+formatter = JsonFormatter()
 file_handler.setFormatter(formatter)
 console_handler.setFormatter(formatter)
 
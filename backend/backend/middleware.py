@@ -0,0 +1,177 @@
+import random
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from backend.constants import QUERY_REPEAT_LIMIT
+from backend.db.pool import pool_stats
+from backend.loggers import logger
+
+current_metrics = ContextVar('current_metrics', default=None)
+PLACEHOLDER_LIST = re.compile(r'%s(?:\s*,\s*%s)+')
+
+
+class RequestMetrics:
+    """Счётчики одного запроса: SQL-запросы, время БД и сериализации."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = Counter()
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries[PLACEHOLDER_LIST.sub('%s, ...', sql)] += 1
+
+    def timed(self, to_representation):
+        def timed_representation(*args, **kwargs):
+            if self.serializer_depth:
+                return to_representation(*args, **kwargs)
+            self.serializer_depth += 1
+            started = time.perf_counter()
+            try:
+                return to_representation(*args, **kwargs)
+            finally:
+                self.serializer_time += time.perf_counter() - started
+                self.serializer_depth -= 1
+
+        return timed_representation
+
+    @property
+    def query_count(self):
+        return sum(self.queries.values())
+
+    def repeated_queries(self):
+        """Шаблоны SQL, повторённые больше QUERY_REPEAT_LIMIT раз (N+1)."""
+        return [{'sql': sql, 'count': count}
+                for sql, count in self.queries.most_common()
+                if count > QUERY_REPEAT_LIMIT]
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def instrument_connection(connection, **kwargs):
+    """Подключить к соединению запись SQL-запросов в метрики запроса.
+
+    Обёртка постоянная: асинхронный ORM выполняет запросы в других
+    потоках со своими соединениями, а метрики находит через contextvar,
+    который sync_to_async копирует в поток.
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class SerializerTimingMixin:
+    """Засекать время сериализации ответа в замеряемых запросах.
+
+    Сериализатору из get_serializer подменяется to_representation
+    экземпляра, классы DRF не меняются. Вложенные сериализаторы
+    вызываются внутри внешнего и повторно не учитываются.
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        metrics = current_metrics.get()
+        if metrics is not None:
+            serializer.to_representation = metrics.timed(
+                serializer.to_representation)
+        return serializer
+
+
+class InstrumentationMiddleware:
+    """Метрики запросов в заголовке Server-Timing и в foodgram_logger.
+
+    Замеряется доля запросов INSTRUMENTATION_SAMPLE_RATE, остальные
+    проходят без накладных расходов. Для потоковых ответов учитывается
+    работа до начала передачи тела. При включённом пуле соединений в
+    запись добавляется его статистика. Работает и под WSGI, и под ASGI.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.INSTRUMENTATION_SAMPLE_RATE
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        if self.sample_rate:
+            connection_created.connect(instrument_connection,
+                                       dispatch_uid='instrumentation')
+            for connection in connections.all(initialized_only=True):
+                instrument_connection(connection)
+
+    def sampled(self):
+        return self.sample_rate and random.random() < self.sample_rate
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.acall(request)
+        if not self.sampled():
+            return self.get_response(request)
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        self.report(request, response, metrics)
+        return response
+
+    async def acall(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        self.report(request, response, metrics)
+        return response
+
+    def report(self, request, response, metrics):
+        total = time.perf_counter() - metrics.started
+        match = request.resolver_match
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'queries': metrics.query_count,
+            'db_ms': round(metrics.db_time * 1000, 2),
+            'serializer_ms': round(metrics.serializer_time * 1000, 2),
+            'total_ms': round(total * 1000, 2),
+        }
+        repeated = metrics.repeated_queries()
+        if repeated:
+            record['n_plus_one'] = repeated
+        pools = pool_stats()
+        if pools:
+            record['db_pool'] = pools
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={record["db_ms"]};desc="{record["queries"]} queries"',
+            f'serializer;dur={record["serializer_ms"]}',
+            f'total;dur={record["total_ms"]}',
+        ))
+        if repeated:
+            logger.warning(record)
+        else:
+            logger.info(record)
@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 
 from django.core.management.utils import get_random_secret_key
@@ -14,6 +15,7 @@ SECRET_KEY = os.getenv('SECRET_KEY', get_random_secret_key())
 DEBUG = os.getenv('DEBUG', 'false').lower() == 'true'
 ALLOWED_HOSTS = os.getenv('ALLOWED_HOSTS',
                           default='127.0.0.1,localhost').split(',')
+TESTING = sys.argv[1:2] == ['test']
 
 INSTALLED_APPS = [
     'recipes.apps.RecipesConfig',
@@ -31,6 +33,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -70,16 +73,69 @@ if os.getenv('USE_SQLITE'):
         }
     }
 else:
+    # Под ASGI запросы выполняются в разных потоках, и постоянные
+    # соединения копились бы по одному на поток, поэтому там (и с пулом)
+    # соединение освобождается в конце каждого запроса.
+    DB_POOL = os.getenv('DB_POOL', 'false').lower() == 'true'
     DATABASES = {
         'default': {
-            'ENGINE': 'django.db.backends.postgresql',
+            'ENGINE': ('backend.db' if DB_POOL
+                       else 'django.db.backends.postgresql'),
             'NAME': os.getenv('POSTGRES_DB', 'django'),
             'USER': os.getenv('POSTGRES_USER', 'django'),
             'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
             'HOST': os.getenv('DB_HOST', ''),
-            'PORT': os.getenv('DB_PORT', 5432)
+            'PORT': os.getenv('DB_PORT', 5432),
+            'CONN_MAX_AGE': (
+                0 if DB_POOL
+                or os.getenv('DJANGO_ASGI', 'false').lower() == 'true'
+                else int(os.getenv('DB_CONN_MAX_AGE', 60))),
+            'CONN_HEALTH_CHECKS': os.getenv(
+                'DB_CONN_HEALTH_CHECKS', 'true').lower() == 'true',
         }
     }
+    if DB_POOL:
+        DATABASES['default']['OPTIONS'] = {'pool': {
+            'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+            'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+            'max_lifetime': int(os.getenv('DB_POOL_MAX_LIFETIME', 30 * 60)),
+            'max_idle': int(os.getenv('DB_POOL_MAX_IDLE', 5 * 60)),
+            'check_idle': (
+                float(os.getenv('DB_POOL_CHECK_IDLE', 5))
+                if DATABASES['default']['CONN_HEALTH_CHECKS'] else None),
+        }}
+
+# Реплики для чтения: пути к файлам SQLite или host[:port] PostgreSQL
+# через запятую. Получают псевдонимы replica1, replica2, ...
+REPLICA_DATABASES = []
+for number, location in enumerate(
+        filter(None, os.getenv('DB_REPLICAS', '').split(',')), 1):
+    replica = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+    if os.getenv('USE_SQLITE'):
+        replica['NAME'] = location
+    else:
+        host, _, port = location.partition(':')
+        replica.update(HOST=host, PORT=port or replica['PORT'])
+    DATABASES[f'replica{number}'] = replica
+    REPLICA_DATABASES.append(f'replica{number}')
+if TESTING and not REPLICA_DATABASES:
+    # Отдельная пустая БД вместо отстающей реплики для тестов маршрутизации;
+    # тесты включают её через override_settings(REPLICA_DATABASES=...).
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'TEST': {'NAME': None if os.getenv('USE_SQLITE')
+                 else f'test_{DATABASES["default"]["NAME"]}_replica'},
+    }
+DATABASE_ROUTERS = ['backend.db.routers.ReplicaRouter']
+REPLICA_STICKY_SECONDS = int(os.getenv('DB_REPLICA_STICKY_SECONDS', 10))
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND',
+                             'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+    }
+}
 
 AUTH_USER_MODEL = 'recipes.User'
 
@@ -116,6 +172,17 @@ STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / 'collected_static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# В тестах фоновая работа идёт синхронно в on_commit: поток писал бы в
+# БД, пока транзакция теста ещё открыта.
+IMAGE_WORKERS = 0 if TESTING else int(os.getenv('IMAGE_WORKERS', 2))
+FEED_WORKERS = 0 if TESTING else int(os.getenv('FEED_WORKERS', 1))
+COVERAGE_WORKERS = 0 if TESTING else int(os.getenv('COVERAGE_WORKERS', 1))
+INSTRUMENTATION_SAMPLE_RATE = float(
+    os.getenv('INSTRUMENTATION_SAMPLE_RATE', 0))
+# Асинхронные представления запускаются под ASGI с несколькими воркерами,
+# поэтому CACHE_BACKEND должен быть общим для процессов (FileBasedCache,
+# Redis): иначе воркер не увидит сброшенную другим версию кэша.
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', 'false').lower() == 'true'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -133,9 +200,13 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'recipes.authentication.TokenAuthentication',
     ],
     'DEFAULT_PAGINATION_CLASS':
         'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 6,
+    'DEFAULT_RENDERER_CLASSES': [
+        'recipes.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
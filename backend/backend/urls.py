@@ -3,8 +3,11 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path, re_path
 
+from backend.views import db_pool_stats
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/db_pool/', db_pool_stats, name='db-pool-stats'),
     path('api/', include('recipes.urls')),
     re_path(r"^api-auth/",
             include("rest_framework.urls",
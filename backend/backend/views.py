@@ -0,0 +1,18 @@
+import os
+
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+from backend.db.pool import pool_stats
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def db_pool_stats(request):
+    """Статистика пулов соединений процесса, обслужившего запрос.
+
+    Пул у каждого воркера свой, поэтому в ответе есть pid: чтобы увидеть
+    все воркеры, запрос повторяют, пока не встретятся все pid.
+    """
+    return Response({'pid': os.getpid(), 'pools': pool_stats()})
@@ -3,11 +3,23 @@ from django.contrib import admin
 from .models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
                      ShoppingList, Subscribe, Tag, User)
 
-admin.site.register(Recipe)
+
+@admin.register(Recipe)
+class RecipeAdmin(admin.ModelAdmin):
+    list_display = ('name', 'author', 'favorites_count',
+                    'shopping_cart_count')
+    readonly_fields = ('favorites_count', 'shopping_cart_count')
+
+
+@admin.register(User)
+class UserAdmin(admin.ModelAdmin):
+    list_display = ('username', 'email', 'recipes_count', 'subscribers_count')
+    readonly_fields = ('recipes_count', 'subscribers_count')
+
+
 admin.site.register(Tag)
 admin.site.register(Ingredient)
 admin.site.register(IngredientInRecipe)
-admin.site.register(User)
 admin.site.register(Subscribe)
 admin.site.register(Favorite)
 admin.site.register(ShoppingList)
@@ -0,0 +1,122 @@
+from functools import update_wrapper
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from django.utils.decorators import classonlymethod
+from rest_framework import exceptions
+from rest_framework.response import Response
+
+
+class AsyncReadMixin:
+    """Асинхронное чтение для вьюсетов DRF под ASGI.
+
+    Для действий из async_actions GET-запрос обрабатывает корутина
+    a<действие>: запросы к БД идут через асинхронный ORM, а queryset,
+    фильтры, права и сериализаторы те же, что в синхронном пути, поэтому
+    ответы совпадают байт в байт. Остальные методы, как и запросы не за
+    JSON (например, browsable API), передаются синхронному представлению.
+    Включается настройкой ASYNC_READ_VIEWS; под WSGI её держат выключенной.
+    """
+
+    async_actions = ()
+
+    @classonlymethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        if (not settings.ASYNC_READ_VIEWS
+                or view.actions.get('get') not in cls.async_actions):
+            return view
+
+        if 'head' not in view.actions:
+            view.actions['head'] = view.actions['get']
+
+        async def async_view(request, *args, **kwargs):
+            self = cls(**initkwargs)
+            self.action_map = view.actions
+            for method, action in view.actions.items():
+                setattr(self, method, getattr(self, action))
+            return await self.adispatch(view, request, *args, **kwargs)
+
+        return update_wrapper(async_view, view)
+
+    async def adispatch(self, sync_view, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        self.format_kwarg = self.get_format_suffix(**kwargs)
+        drf_request = self.initialize_request(request, *args, **kwargs)
+        try:
+            renderer, media_type = self.perform_content_negotiation(
+                drf_request)
+        except exceptions.NotAcceptable:
+            renderer = None
+        if request.method != 'GET' or getattr(renderer, 'format',
+                                              None) != 'json':
+            return await sync_to_async(sync_view)(request, *args, **kwargs)
+        request = self.request = drf_request
+        self.headers = self.default_response_headers
+        try:
+            await self.aperform_authentication(request)
+            self.initial(request, *args, **kwargs)
+            handler = getattr(self, f'a{self.action}')
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(
+            request, response, *args, **kwargs)
+        return self.response
+
+    async def aperform_authentication(self, request):
+        try:
+            for authenticator in request.authenticators:
+                if hasattr(authenticator, 'aauthenticate'):
+                    user_auth = await authenticator.aauthenticate(request)
+                else:
+                    user_auth = await sync_to_async(
+                        authenticator.authenticate)(request)
+                if user_auth is not None:
+                    request._authenticator = authenticator
+                    request.user, request.auth = user_auth
+                    return
+        except exceptions.APIException:
+            request._not_authenticated()
+            raise
+        request._not_authenticated()
+
+    async def apaginate_queryset(self, queryset):
+        if self.paginator is None:
+            return None
+        if hasattr(self.paginator, 'apaginate_queryset'):
+            return await self.paginator.apaginate_queryset(
+                queryset, self.request, view=self)
+        return await sync_to_async(self.paginator.paginate_queryset)(
+            queryset, self.request, view=self)
+
+    async def aget_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        filter_kwargs = {self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        try:
+            obj = await queryset.aget(**filter_kwargs)
+        except queryset.model.DoesNotExist:
+            raise Http404(f'No {queryset.model._meta.object_name} '
+                          'matches the given query.')
+        except (TypeError, ValueError, ValidationError):
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = await self.apaginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer(
+            [item async for item in queryset], many=True)
+        return Response(serializer.data)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        return Response(self.get_serializer(instance).data)
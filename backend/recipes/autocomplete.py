@@ -0,0 +1,88 @@
+import threading
+from bisect import bisect_left
+
+from django.db import router
+
+from .cache import get_version
+from .models import Ingredient
+from backend.constants import AUTOCOMPLETE_MAX_SIZE
+
+SEPARATOR = '\n'
+MAX_CHAR = chr(0x10FFFF)
+
+
+class IngredientIndex:
+    """Отсортированный массив названий ингредиентов для автодополнения.
+
+    Поиск ранжирует результаты: точное совпадение, совпадение по началу
+    названия, вхождение подстроки.
+    """
+
+    def __init__(self, rows):
+        rows = sorted(rows, key=lambda row: (row[1].lower(), row[0]))
+        self.items = [
+            {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+            for pk, name, measurement_unit in rows
+        ]
+        self.keys = [item['name'].lower() for item in self.items]
+        self.offsets = []
+        offset = 0
+        for key in self.keys:
+            self.offsets.append(offset)
+            offset += len(key) + len(SEPARATOR)
+        self.text = SEPARATOR.join(self.keys)
+
+    def __len__(self):
+        return len(self.items)
+
+    def search(self, query):
+        query = query.lower().replace(SEPARATOR, '')
+        if not query:
+            return list(self.items)
+        start = bisect_left(self.keys, query)
+        end = bisect_left(self.keys, query + MAX_CHAR, start)
+        found = list(range(start, end))
+        position = self.text.find(query)
+        while position != -1:
+            index = bisect_left(self.offsets, position + 1) - 1
+            if not start <= index < end:
+                found.append(index)
+            position = self.text.find(
+                query, self.offsets[index] + len(self.keys[index]))
+        return [self.items[index] for index in found]
+
+
+class IngredientAutocomplete:
+    """Держит индекс ингредиентов в актуальном состоянии.
+
+    Индекс перестраивается, когда меняется версия справочника
+    ингредиентов (см. recipes.cache). Если каталог больше
+    AUTOCOMPLETE_MAX_SIZE, индекс не строится и поиск идёт через БД.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.index = None
+        self.lock = threading.Lock()
+
+    def get_index(self):
+        version = get_version(Ingredient)
+        if self.version != version:
+            with self.lock:
+                if self.version != version:
+                    self.index = self.build()
+                    self.version = version
+        return self.index
+
+    def build(self):
+        # Индекс привязан к версии, поэтому читается из основной БД, а не
+        # с реплики, которая может ещё не знать о последнем изменении.
+        ingredients = Ingredient.objects.db_manager(
+            router.db_for_write(Ingredient))
+        if ingredients.count() > AUTOCOMPLETE_MAX_SIZE:
+            return None
+        return IngredientIndex(ingredients.values_list(
+            'id', 'name', 'measurement_unit'))
+
+
+ingredient_autocomplete = IngredientAutocomplete()
@@ -0,0 +1,292 @@
+import base64
+import io
+import platform
+import statistics
+import time
+import uuid
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .autocomplete import ingredient_autocomplete
+from .cache import ALL_RECIPES, bump_version
+from .counters import rebuild_counters
+from .coverage import invalidate as invalidate_coverage
+from .feed import rebuild as rebuild_feeds
+from .models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                     ShoppingList, Subscribe, Tag, User)
+from .search import rebuild_index
+from .serializers import IngredientSerializer
+from .shopping import rebuild as rebuild_shopping_lists
+
+PREFIX = 'bench'
+PERCENTILES = (50, 90, 95, 99)
+
+
+class Scale:
+    """Объём синтетических данных для замеров."""
+
+    def __init__(self, users=200, recipes=2000, ingredients=2000,
+                 ingredients_per_recipe=8, tags=6, favorites=50,
+                 subscriptions=20, cart=20):
+        self.users = users
+        self.recipes = recipes
+        self.ingredients = ingredients
+        self.ingredients_per_recipe = ingredients_per_recipe
+        self.tags = tags
+        self.favorites = favorites
+        self.subscriptions = subscriptions
+        self.cart = cart
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+def bulk(model, objects, batch_size=2000):
+    return model.objects.bulk_create(objects, batch_size=batch_size,
+                                     ignore_conflicts=True)
+
+
+@transaction.atomic
+def seed(scale, rng):
+    """Создать пользователей, рецепты, подписки, избранное и корзины.
+
+    Все объекты помечаются префиксом bench, повторный запуск сначала
+    удаляет данные предыдущего. Счётчики, ленты, списки покупок и версии
+    кэша обновляются в конце, так как bulk_create не отправляет сигналы.
+    """
+    clear()
+    password = make_password(PREFIX)
+    bulk(User, [
+        User(username=f'{PREFIX}{number}', email=f'{PREFIX}{number}@bench.io',
+             first_name='Bench', last_name=str(number), password=password)
+        for number in range(scale.users)
+    ])
+    bulk(Tag, [Tag(name=f'{PREFIX}{number}', slug=f'{PREFIX}{number}')
+               for number in range(scale.tags)])
+    bulk(Ingredient, [
+        Ingredient(name=f'{PREFIX} ингредиент {number}',
+                   measurement_unit=rng.choice(('г', 'мл', 'шт')))
+        for number in range(scale.ingredients)
+    ])
+    users = list(User.objects.filter(
+        username__startswith=PREFIX).values_list('id', flat=True))
+    tags = list(Tag.objects.filter(
+        slug__startswith=PREFIX).values_list('id', flat=True))
+    ingredients = list(Ingredient.objects.filter(
+        name__startswith=PREFIX).values_list('id', flat=True))
+    bulk(Recipe, [
+        Recipe(author_id=rng.choice(users), name=f'{PREFIX} рецепт {number}',
+               text='Синтетический рецепт', image=f'recipes/{PREFIX}.png',
+               cooking_time=rng.randint(1, 180))
+        for number in range(scale.recipes)
+    ])
+    recipes = list(Recipe.objects.filter(
+        name__startswith=PREFIX).values_list('id', flat=True))
+    per_recipe = min(scale.ingredients_per_recipe, len(ingredients))
+    bulk(IngredientInRecipe, [
+        IngredientInRecipe(recipe_id=recipe, ingredient_id=ingredient,
+                           amount=rng.randint(1, 500))
+        for recipe in recipes
+        for ingredient in rng.sample(ingredients, per_recipe)
+    ])
+    bulk(Recipe.tags.through, [
+        Recipe.tags.through(recipe_id=recipe, tag_id=tag)
+        for recipe in recipes
+        for tag in rng.sample(tags, rng.randint(1, min(3, len(tags))))
+    ])
+    bulk(Subscribe, [
+        Subscribe(user_id=user, subscriber_id=author)
+        for user in users
+        for author in rng.sample(users, min(scale.subscriptions, len(users)))
+        if author != user
+    ])
+    bulk(Favorite, [
+        Favorite(user_id=user, recipes_id=recipe)
+        for user in users
+        for recipe in rng.sample(recipes, min(scale.favorites, len(recipes)))
+    ])
+    bulk(ShoppingList, [
+        ShoppingList(user_id=user, recipes_id=recipe)
+        for user in users
+        for recipe in rng.sample(recipes, min(scale.cart, len(recipes)))
+    ])
+    rebuild_counters()
+    rebuild_feeds()
+    rebuild_index()
+    rebuild_shopping_lists()
+    invalidate_coverage()
+    for model in (Recipe, Tag, Ingredient):
+        bump_version(model)
+    bump_version(Recipe, scope=ALL_RECIPES)
+
+
+def clear():
+    Recipe.objects.filter(name__startswith=PREFIX).delete()
+    User.objects.filter(username__startswith=PREFIX).delete()
+    Tag.objects.filter(slug__startswith=PREFIX).delete()
+    Ingredient.objects.filter(name__startswith=PREFIX).delete()
+
+
+def png_base64(size=(256, 256)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 120, 40)).save(buffer, 'PNG')
+    return ('data:image/png;base64,'
+            + base64.b64encode(buffer.getvalue()).decode())
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    index = round(percent / 100 * (len(ordered) - 1))
+    return ordered[index]
+
+
+class Benchmark:
+    """Замеры горячих путей API через тестовый клиент DRF.
+
+    Запросы идут в процессе, без сети, поэтому замеры воспроизводимы и
+    не зависят от веб-сервера; для каждого запроса считаются время,
+    процессорное время и количество SQL-запросов. Сценарии
+    ingredient_search_* вызывают поиск ингредиентов напрямую, минуя HTTP
+    и кэш, чтобы сравнить индекс с прежним фильтром.
+    """
+
+    def __init__(self, requests, warmup, rng):
+        self.requests = requests
+        self.warmup = warmup
+        self.rng = rng
+        self.reader = User.objects.filter(
+            username__startswith=PREFIX).order_by('id').first()
+        token, created = Token.objects.get_or_create(user=self.reader)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.tags = dict(Tag.objects.filter(
+            slug__startswith=PREFIX).values_list('slug', 'id'))
+        self.ingredients = list(Ingredient.objects.filter(
+            name__startswith=PREFIX).values_list('id', flat=True))
+        self.image = png_base64()
+
+    @property
+    def scenarios(self):
+        return {
+            'recipe_list': self.recipe_list,
+            'recipe_list_filtered': self.recipe_list_filtered,
+            'subscriptions': self.subscriptions,
+            'download_shopping_cart': self.download_shopping_cart,
+            'ingredient_autocomplete': self.ingredient_autocomplete,
+            'ingredient_search_index': self.ingredient_search_index,
+            'ingredient_search_filter': self.ingredient_search_filter,
+            'recipe_create': self.recipe_create,
+        }
+
+    def recipe_list(self):
+        page = self.rng.randint(1, 20)
+        return self.client.get(f'/api/recipes/?page={page}&limit=6')
+
+    def recipe_list_filtered(self):
+        tags = '&'.join(f'tags={slug}'
+                        for slug in self.rng.sample(sorted(self.tags), 2))
+        return self.client.get(f'/api/recipes/?{tags}&is_favorited=1')
+
+    def subscriptions(self):
+        return self.client.get(
+            '/api/users/subscriptions/?limit=6&recipes_limit=3')
+
+    def download_shopping_cart(self):
+        response = self.client.get('/api/recipes/download_shopping_cart/')
+        b''.join(response.streaming_content)
+        return response
+
+    def ingredient_prefix(self):
+        return f'{PREFIX} ингредиент {self.rng.randint(1, 99)}'
+
+    def ingredient_autocomplete(self):
+        return self.client.get('/api/ingredients/',
+                               {'name': self.ingredient_prefix()})
+
+    def ingredient_search_index(self):
+        # Без HTTP и кэша справочников: только поиск по индексу в памяти.
+        return ingredient_autocomplete.get_index().search(
+            self.ingredient_prefix())
+
+    def ingredient_search_filter(self):
+        # Прежний путь: name__istartswith в БД и сериализация ответа.
+        return IngredientSerializer(Ingredient.objects.filter(
+            name__istartswith=self.ingredient_prefix()), many=True).data
+
+    def recipe_create(self):
+        return self.client.post('/api/recipes/', {
+            'name': f'{PREFIX} рецепт {uuid.uuid4().hex}',
+            'text': 'Рецепт из замера',
+            'cooking_time': 10,
+            'image': self.image,
+            'tags': [self.rng.choice(list(self.tags.values()))],
+            'ingredients': [
+                {'id': ingredient, 'amount': 10}
+                for ingredient in self.rng.sample(self.ingredients, 5)],
+        }, format='json')
+
+    def measure(self, name):
+        scenario = self.scenarios[name]
+        for _ in range(self.warmup):
+            scenario()
+        latencies, cpu_times, queries = [], [], []
+        started = time.perf_counter()
+        for _ in range(self.requests):
+            with CaptureQueriesContext(connection) as captured:
+                request_started = time.perf_counter()
+                cpu_started = time.process_time()
+                response = scenario()
+                cpu_times.append(time.process_time() - cpu_started)
+                latencies.append(time.perf_counter() - request_started)
+            if getattr(response, 'status_code', 0) >= 400:
+                raise RuntimeError(
+                    f'{name}: ответ {response.status_code}')
+            queries.append(len(captured.captured_queries))
+        elapsed = time.perf_counter() - started
+        result = {
+            'requests': self.requests,
+            'throughput_rps': round(self.requests / elapsed, 2),
+            'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+            'max_ms': round(max(latencies) * 1000, 3),
+            'cpu_ms': round(statistics.mean(cpu_times) * 1000, 3),
+            'queries_median': statistics.median(queries),
+            'queries_max': max(queries),
+        }
+        for percent in PERCENTILES:
+            result[f'p{percent}_ms'] = round(
+                percentile(latencies, percent) * 1000, 3)
+        return result
+
+    def run(self, names):
+        return {name: self.measure(name) for name in names}
+
+
+def environment():
+    return {
+        'vendor': connection.vendor,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'platform': platform.platform(),
+    }
+
+
+def compare(results, baseline,
+            keys=('p50_ms', 'p95_ms', 'cpu_ms', 'queries_median')):
+    """Изменение p50/p95, CPU и запросов относительно прошлого прогона."""
+    changes = {}
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        changes[name] = {
+            key: round((current[key] - previous[key]) / previous[key] * 100,
+                       1) if previous.get(key) and key in current else None
+            for key in keys
+        }
+    return changes
@@ -0,0 +1,167 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+from backend.constants import (RECIPE_REVALIDATE_TIMEOUT,
+                               REFERENCE_CACHE_SIZE, REFERENCE_CACHE_TIMEOUT,
+                               REFERENCE_VERSION_TTL)
+
+
+class LocalLRUCache:
+    """Потокобезопасный LRU-кэш в памяти процесса."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+local_cache = LocalLRUCache(REFERENCE_CACHE_SIZE)
+local_versions = {}
+# Версия рецепта со scope=ALL_RECIPES меняется вместе с данными сразу
+# многих рецептов (автор, импорт), со scope=id рецепта — с самим рецептом.
+ALL_RECIPES = 'all'
+
+
+def version_key(model, scope=None):
+    if scope is None:
+        return f'reference:{model._meta.label_lower}:version'
+    return f'reference:{model._meta.label_lower}:{scope}:version'
+
+
+def bump_version(model, scope=None):
+    """Сбросить кэш модели, выдав ей новую версию.
+
+    scope задаёт отдельную версию внутри модели, например данные
+    одного пользователя.
+    """
+    version = time.time_ns()
+    cache.set(version_key(model, scope), version, None)
+    if scope is None:
+        local_versions[model] = (time.monotonic(), version)
+    return version
+
+
+def bump_versions(model, scopes):
+    """Выдать новую версию модели сразу для многих scope."""
+    version = time.time_ns()
+    cache.set_many({version_key(model, scope): version for scope in scopes},
+                   None)
+    return version
+
+
+def get_version(model, scope=None, ttl=REFERENCE_VERSION_TTL):
+    """Текущая версия модели (время последнего изменения в нс).
+
+    Версия хранится в общем кэше, а в процессе запоминается на ttl
+    секунд, чтобы не ходить за ней на каждый запрос. Версии со scope
+    в процессе не запоминаются.
+    """
+    checked = local_versions.get(model) if scope is None else None
+    if checked and time.monotonic() - checked[0] < ttl:
+        return checked[1]
+    key = version_key(model, scope)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    if scope is None:
+        local_versions[model] = (time.monotonic(), version)
+    return version
+
+
+def reference_key(model, version, key):
+    digest = hashlib.md5(key.encode()).hexdigest()
+    return f'reference:{model._meta.label_lower}:{version}:{digest}'
+
+
+def get_or_set(model, version, key, compute):
+    """Достать данные справочника из локального или общего кэша."""
+    full_key = reference_key(model, version, key)
+    value = local_cache.get(full_key)
+    if value is None:
+        value = cache.get(full_key)
+        if value is None:
+            value = compute()
+            cache.set(full_key, value, REFERENCE_CACHE_TIMEOUT)
+        local_cache.set(full_key, value)
+    return value
+
+
+async def aget_or_set(model, version, key, compute):
+    """То же, что get_or_set, для асинхронных представлений.
+
+    compute — корутина; общий кэш читается асинхронным API кэша.
+    """
+    full_key = reference_key(model, version, key)
+    value = local_cache.get(full_key)
+    if value is None:
+        value = await cache.aget(full_key)
+        if value is None:
+            value = await compute()
+            await cache.aset(full_key, value, REFERENCE_CACHE_TIMEOUT)
+        local_cache.set(full_key, value)
+    return value
+
+
+def get_or_revalidate(key, versions, compute, timeout):
+    """Значение для версий versions из общего кэша: (версии, значение).
+
+    Запись хранит версии, по которым посчитана. Устаревшую запись
+    пересчитывает только один запрос, остальные на это время (не дольше
+    RECIPE_REVALIDATE_TIMEOUT) получают прежнее значение с его версиями,
+    так что смена версии не вызывает лавины одинаковых пересчётов.
+    """
+    entry = cache.get(key)
+    if entry is not None and entry[0] == versions:
+        return entry
+    lock = f'{key}:revalidate'
+    if entry is not None and not cache.add(lock, True,
+                                           RECIPE_REVALIDATE_TIMEOUT):
+        return entry
+    try:
+        value = compute()
+        cache.set(key, (versions, value), timeout)
+    finally:
+        if entry is not None:
+            cache.delete(lock)
+    return versions, value
+
+
+async def aget_or_revalidate(key, versions, compute, timeout):
+    """То же, что get_or_revalidate; compute — корутина."""
+    entry = await cache.aget(key)
+    if entry is not None and entry[0] == versions:
+        return entry
+    lock = f'{key}:revalidate'
+    if entry is not None and not await cache.aadd(
+            lock, True, RECIPE_REVALIDATE_TIMEOUT):
+        return entry
+    try:
+        value = await compute()
+        await cache.aset(key, (versions, value), timeout)
+    finally:
+        if entry is not None:
+            await cache.adelete(lock)
+    return versions, value
@@ -0,0 +1,37 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Favorite, Recipe, ShoppingList, Subscribe, User
+
+# Источник -> (поле связи, модель со счётчиком, поле счётчика).
+COUNTERS = {
+    Recipe: ('author', User, 'recipes_count'),
+    Favorite: ('recipes', Recipe, 'favorites_count'),
+    ShoppingList: ('recipes', Recipe, 'shopping_cart_count'),
+    Subscribe: ('subscriber', User, 'subscribers_count'),
+}
+
+
+def update_counter(sender, instance, delta):
+    """Изменить счётчик, связанный с записью instance, на delta."""
+    field = COUNTERS[sender][0]
+    update_counters(sender, [getattr(instance, f'{field}_id')], delta)
+
+
+def update_counters(sender, related_ids, delta):
+    """Изменить на delta счётчики объектов related_ids одним запросом.
+
+    Нужна для массовых операций, которые не отправляют сигналы.
+    """
+    field, model, counter = COUNTERS[sender]
+    model.objects.filter(pk__in=related_ids).update(
+        **{counter: F(counter) + delta})
+
+
+def rebuild_counters():
+    """Пересчитать все счётчики по исходным таблицам."""
+    for sender, (field, model, counter) in COUNTERS.items():
+        total = sender.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(total=Count('pk')).values('total')
+        model.objects.update(**{counter: Coalesce(Subquery(total), 0)})
@@ -0,0 +1,259 @@
+import logging
+import threading
+from array import array
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Count, F, FloatField, Q
+from django.db.models.functions import Cast
+
+from backend.constants import COVERAGE_JOURNAL_SIZE
+
+from .models import CoverageChange, CoverageVersion, IngredientInRecipe, Recipe
+from .relations import supports_returning
+
+logger = logging.getLogger(__name__)
+
+executor = None
+
+
+def get_executor():
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=settings.COVERAGE_WORKERS,
+            thread_name_prefix='coverage-index')
+    return executor
+
+
+class CoverageIndex:
+    """Обратный индекс ингредиент -> позиции рецептов в массивах int64.
+
+    У рецепта есть позиция в массивах ids (id рецепта) и sizes (число его
+    ингредиентов, 0 — рецепт удалён). Совпадения для набора ингредиентов
+    считает numpy.bincount по склеенным спискам позиций, доля покрытия и
+    выбор лучших тоже считаются над массивами numpy. Позиции удалённых
+    рецептов освобождаются только при перестройке индекса.
+    """
+
+    def __init__(self, rows=()):
+        self.postings = {}
+        self.recipes = {}
+        self.positions = {}
+        self.ids = array('q')
+        self.sizes = array('q')
+        for ingredient_id, recipe_id in rows:
+            position = self.position(recipe_id)
+            self.sizes[position] += 1
+            self.recipes.setdefault(
+                recipe_id, array('q')).append(ingredient_id)
+            self.postings.setdefault(
+                ingredient_id, array('q')).append(position)
+
+    def __len__(self):
+        return len(self.recipes)
+
+    def position(self, recipe_id):
+        position = self.positions.get(recipe_id)
+        if position is None:
+            position = self.positions[recipe_id] = len(self.ids)
+            self.ids.append(recipe_id)
+            self.sizes.append(0)
+        return position
+
+    def update(self, recipe_id, ingredient_ids):
+        """Заменить ингредиенты рецепта; пустой список удаляет рецепт."""
+        position = self.positions.get(recipe_id)
+        for ingredient_id in self.recipes.pop(recipe_id, ()):
+            posting = self.postings[ingredient_id]
+            posting.remove(position)
+            if not posting:
+                del self.postings[ingredient_id]
+        ingredient_ids = set(ingredient_ids)
+        if not ingredient_ids:
+            if position is not None:
+                self.sizes[position] = 0
+            return
+        position = self.position(recipe_id)
+        self.sizes[position] = len(ingredient_ids)
+        self.recipes[recipe_id] = array('q', ingredient_ids)
+        for ingredient_id in ingredient_ids:
+            self.postings.setdefault(
+                ingredient_id, array('q')).append(position)
+
+    def top(self, ingredient_ids, limit):
+        """Лучшие рецепты: (id, совпало ингредиентов, всего ингредиентов).
+
+        Порядок: доля покрытия, число совпадений, более новые рецепты.
+        """
+        postings = [self.postings[ingredient_id]
+                    for ingredient_id in set(ingredient_ids)
+                    if ingredient_id in self.postings]
+        if not postings or limit <= 0:
+            return []
+        matched = np.bincount(
+            np.concatenate([np.array(posting, dtype=np.int64)
+                            for posting in postings]),
+            minlength=len(self.sizes))
+        candidates = np.flatnonzero(matched)
+        matched = matched[candidates]
+        totals = np.array(self.sizes, dtype=np.int64)[candidates]
+        ids = np.array(self.ids, dtype=np.int64)[candidates]
+        coverage = matched / totals
+        if len(candidates) > limit:
+            # Сортируются только рецепты не хуже limit-го по покрытию.
+            kept = coverage >= np.partition(coverage, -limit)[-limit]
+            matched, totals, ids, coverage = (
+                matched[kept], totals[kept], ids[kept], coverage[kept])
+        best = np.lexsort((ids, matched, coverage))[::-1][:limit]
+        return [(int(ids[item]), int(matched[item]), int(totals[item]))
+                for item in best]
+
+
+def top_from_db(ingredient_ids, limit):
+    """То же, что CoverageIndex.top, агрегатом в БД."""
+    ingredient_ids = set(ingredient_ids)
+    if not ingredient_ids or limit <= 0:
+        return []
+    return list(Recipe.objects.annotate(
+        matched=Count('recipes_ingredients', filter=Q(
+            recipes_ingredients__ingredient__in=ingredient_ids)),
+        total=Count('recipes_ingredients'),
+    ).filter(matched__gt=0).annotate(
+        coverage=Cast('matched', FloatField()) / Cast('total', FloatField()),
+    ).order_by('-coverage', '-matched', '-id').values_list(
+        'id', 'matched', 'total')[:limit])
+
+
+def record_change(recipe_id):
+    """Записать в журнал, что ингредиенты рецепта изменились.
+
+    Вызывается внутри транзакции изменения. Строка CoverageVersion
+    заблокирована до её конца, поэтому процесс, увидевший номер N,
+    найдёт в журнале все изменения до N. Сами ингредиенты процессы
+    читают из БД при применении журнала.
+    """
+    using = router.db_for_write(CoverageChange)
+    connection = connections[using]
+    with transaction.atomic(using=using, savepoint=False):
+        if supports_returning(connection):
+            table = connection.ops.quote_name(CoverageVersion._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(f'UPDATE {table} SET number = number + 1 '
+                               'RETURNING number')
+                number, = cursor.fetchone()
+        else:
+            versions = CoverageVersion.objects.using(using)
+            versions.update(number=F('number') + 1)
+            number = versions.values_list('number', flat=True).get()
+        CoverageChange.objects.using(using).create(
+            number=number, recipe_id=recipe_id)
+        if number % COVERAGE_JOURNAL_SIZE == 0:
+            CoverageChange.objects.using(using).filter(
+                number__lte=number - COVERAGE_JOURNAL_SIZE).delete()
+
+
+def invalidate():
+    """Заставить все процессы перестроить индекс (после bulk-операций)."""
+    CoverageVersion.objects.using(
+        router.db_for_write(CoverageVersion)).update(
+        number=F('number') + COVERAGE_JOURNAL_SIZE + 1)
+
+
+class RecipeCoverage:
+    """Держит индекс покрытия процесса в актуальном состоянии.
+
+    Номер последнего изменения читается из CoverageVersion на каждый
+    запрос. Отставший индекс дочитывает журнал; если изменений больше
+    COVERAGE_JOURNAL_SIZE, индекс строится заново в фоне, а до конца
+    перестройки запросы обслуживает top_from_db.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Забыть индекс процесса (например, после отката БД в тестах)."""
+        with self.lock:
+            self.index = None
+            self.number = None
+            self.building = False
+
+    @property
+    def using(self):
+        # Номер и журнал читаются из основной БД: отстающая реплика может
+        # не знать о последних изменениях.
+        return router.db_for_write(CoverageChange)
+
+    def current_number(self):
+        return CoverageVersion.objects.using(self.using).values_list(
+            'number', flat=True).get()
+
+    def top(self, ingredient_ids, limit):
+        number = self.current_number()
+        with self.lock:
+            if self.catch_up(number):
+                return self.index.top(ingredient_ids, limit)
+            start = not self.building
+            self.building = True
+        if start and not settings.COVERAGE_WORKERS:
+            self.build()
+            with self.lock:
+                return self.index.top(ingredient_ids, limit)
+        if start:
+            get_executor().submit(self.build_in_worker)
+        return top_from_db(ingredient_ids, limit)
+
+    def catch_up(self, number):
+        """Дочитать журнал до number; False — индекс нужно перестроить."""
+        if self.index is None or number < self.number:
+            return False
+        if number == self.number:
+            return True
+        if number - self.number > COVERAGE_JOURNAL_SIZE:
+            return False
+        changes = CoverageChange.objects.using(self.using).filter(
+            number__gt=self.number, number__lte=number).values_list(
+            'recipe_id', flat=True)
+        recipe_ids = list(changes)
+        if len(recipe_ids) != number - self.number:
+            return False
+        ingredients = defaultdict(list)
+        for recipe_id, ingredient_id in IngredientInRecipe.objects.using(
+                self.using).filter(recipe__in=set(recipe_ids)).values_list(
+                'recipe_id', 'ingredient_id'):
+            ingredients[recipe_id].append(ingredient_id)
+        for recipe_id in set(recipe_ids):
+            self.index.update(recipe_id, ingredients[recipe_id])
+        self.number = number
+        return True
+
+    def build(self):
+        try:
+            # Изменения после этого номера попадут и в индекс, и в журнал;
+            # повторное применение журнала ничего не портит.
+            number = self.current_number()
+            rows = IngredientInRecipe.objects.using(
+                self.using).order_by().values_list(
+                'ingredient_id', 'recipe_id')
+            index = CoverageIndex(rows.iterator(chunk_size=10000))
+            with self.lock:
+                self.index, self.number = index, number
+        finally:
+            with self.lock:
+                self.building = False
+
+    def build_in_worker(self):
+        try:
+            self.build()
+        except Exception:
+            logger.exception('Не удалось построить индекс покрытия')
+        finally:
+            connections.close_all()
+
+
+recipe_coverage = RecipeCoverage()
@@ -0,0 +1,123 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from backend.constants import (FEED_FANOUT_BATCH, FEED_FANOUT_LIMIT,
+                               FEED_LENGTH)
+
+from .models import FeedEntry, Recipe, Subscribe
+
+logger = logging.getLogger(__name__)
+
+executor = None
+
+
+def get_executor():
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=settings.FEED_WORKERS,
+            thread_name_prefix='feed-fan-out')
+    return executor
+
+
+def is_popular(author):
+    """Рецепты популярных авторов не рассылаются, а читаются при запросе."""
+    return author.subscribers_count > FEED_FANOUT_LIMIT
+
+
+def trim(user_ids):
+    """Оставить в лентах пользователей не больше FEED_LENGTH записей."""
+    stale = FeedEntry.objects.filter(user_id__in=user_ids).annotate(
+        position=Window(RowNumber(), partition_by=F('user'),
+                        order_by=(F('pub_date').desc(), F('id').desc()))
+    ).filter(position__gt=FEED_LENGTH).values('pk')
+    FeedEntry.objects.filter(pk__in=stale).delete()
+
+
+def fan_out(recipe_id):
+    """Разослать новый рецепт в ленты подписчиков автора."""
+    recipe = Recipe.objects.select_related('author').filter(
+        pk=recipe_id).first()
+    if recipe is None or is_popular(recipe.author):
+        return
+    user_ids = list(Subscribe.objects.filter(
+        subscriber=recipe.author_id).values_list('user_id', flat=True))
+    for start in range(0, len(user_ids), FEED_FANOUT_BATCH):
+        batch = user_ids[start:start + FEED_FANOUT_BATCH]
+        FeedEntry.objects.bulk_create(
+            [FeedEntry(user_id=user_id, recipe=recipe,
+                       author_id=recipe.author_id, pub_date=recipe.pub_date)
+             for user_id in batch],
+            ignore_conflicts=True,
+        )
+        trim(batch)
+
+
+def fan_out_in_worker(recipe_id):
+    try:
+        fan_out(recipe_id)
+    except Exception:
+        logger.exception('Не удалось разослать рецепт %s в ленты', recipe_id)
+    finally:
+        connections.close_all()
+
+
+def schedule_fan_out(recipe):
+    """Разослать рецепт в ленты после коммита, вне потока запроса."""
+    if settings.FEED_WORKERS:
+        transaction.on_commit(lambda: get_executor().submit(
+            fan_out_in_worker, recipe.pk))
+    else:
+        transaction.on_commit(lambda: fan_out(recipe.pk))
+
+
+def backfill(subscription):
+    """Добавить в ленту подписчика последние рецепты нового автора."""
+    if is_popular(subscription.subscriber):
+        return
+    recipes = Recipe.objects.filter(
+        author=subscription.subscriber_id
+    ).values_list('id', 'pub_date')[:FEED_LENGTH]
+    FeedEntry.objects.bulk_create(
+        [FeedEntry(user_id=subscription.user_id, recipe_id=recipe_id,
+                   author_id=subscription.subscriber_id, pub_date=pub_date)
+         for recipe_id, pub_date in recipes],
+        ignore_conflicts=True,
+    )
+    trim([subscription.user_id])
+
+
+def remove(subscription):
+    """Убрать из ленты подписчика рецепты автора, от которого он отписался."""
+    FeedEntry.objects.filter(user=subscription.user_id,
+                             author=subscription.subscriber_id).delete()
+
+
+def timeline(user):
+    """Пары (id рецепта, дата публикации) ленты пользователя.
+
+    Разосланные записи читаются одним диапазоном по индексу
+    (user, -pub_date); рецепты популярных авторов добавляются запросом
+    к таблице рецептов.
+    """
+    entries = FeedEntry.objects.filter(user=user).order_by().values_list(
+        'recipe_id', 'pub_date')
+    popular = user.subscription_author.filter(
+        subscriber__subscribers_count__gt=FEED_FANOUT_LIMIT
+    ).values('subscriber')
+    if popular.exists():
+        entries = entries.union(Recipe.objects.filter(
+            author__in=popular).order_by().values_list('id', 'pub_date'))
+    return entries.order_by('-pub_date')
+
+
+def rebuild():
+    """Собрать ленты всех пользователей заново по подпискам."""
+    FeedEntry.objects.all().delete()
+    for subscription in Subscribe.objects.select_related('subscriber'):
+        backfill(subscription)
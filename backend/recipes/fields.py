@@ -0,0 +1,59 @@
+import base64
+import binascii
+import io
+import uuid
+
+import filetype
+from django.conf import settings
+from django.core.files.uploadedfile import (InMemoryUploadedFile,
+                                            TemporaryUploadedFile)
+from drf_extra_fields.fields import Base64FieldMixin, Base64ImageField
+from rest_framework.exceptions import ValidationError
+
+from backend.constants import BASE64_CHUNK_SIZE
+
+
+class StreamingBase64ImageField(Base64ImageField):
+    """Base64ImageField, который декодирует данные по частям.
+
+    Большие изображения пишутся сразу во временный файл на диске (как при
+    обычной загрузке файлов), маленькие — в память, без промежуточной
+    копии всего декодированного содержимого.
+    """
+
+    def to_internal_value(self, base64_data):
+        if base64_data in self.EMPTY_VALUES:
+            return None
+        if not isinstance(base64_data, str):
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+        content_type = None
+        header, separator, payload = base64_data.rpartition(';base64,')
+        if not separator:
+            payload = base64_data
+        elif self.trust_provided_content_type:
+            content_type = header.replace('data:', '')
+        if any(char in payload for char in ' \n\r\t'):
+            payload = ''.join(payload.split())
+        size = len(payload) // 4 * 3
+        if size > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+            upload = TemporaryUploadedFile('image', content_type, size, None)
+        else:
+            upload = InMemoryUploadedFile(io.BytesIO(), None, 'image',
+                                          content_type, size, None)
+        try:
+            for start in range(0, len(payload), BASE64_CHUNK_SIZE):
+                upload.file.write(base64.b64decode(
+                    payload[start:start + BASE64_CHUNK_SIZE]))
+        except (TypeError, binascii.Error, ValueError):
+            upload.close()
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+        upload.size = upload.file.tell()
+        upload.file.seek(0)
+        extension = filetype.guess_extension(upload.file.read(261))
+        upload.file.seek(0)
+        extension = 'jpg' if extension == 'jpeg' else extension
+        if extension not in self.ALLOWED_TYPES:
+            upload.close()
+            raise ValidationError(self.INVALID_TYPE_MESSAGE)
+        upload.name = f'{uuid.uuid4()}.{extension}'
+        return super(Base64FieldMixin, self).to_internal_value(upload)
@@ -1,10 +1,18 @@
+from django.db.models import Exists, OuterRef
+from django.db.models.functions import Lower
 from django_filters.rest_framework import CharFilter, FilterSet, NumberFilter
 
 from .models import Favorite, Recipe, ShoppingList
+from .search import search_recipes
 
 
 class IngredientFilter(FilterSet):
-    name = CharFilter(lookup_expr='istartswith')
+    name = CharFilter(method='filter_name')
+
+    def filter_name(self, queryset, name, value):
+        # lower(name) LIKE 'value%' покрывается индексом text_pattern_ops.
+        return queryset.alias(name_lower=Lower('name')).filter(
+            name_lower__startswith=value.lower())
 
 
 class RecipeFilter(FilterSet):
@@ -16,18 +24,21 @@ class RecipeFilter(FilterSet):
     is_favorited = NumberFilter(method='filter_is_favorited')
     is_in_shopping_cart = NumberFilter(
         method='filter_is_in_shopping_cart')
+    search = CharFilter(method='filter_search')
 
     class Meta:
         model = Recipe
-        fields = ['tags', 'author', 'is_favorited', 'is_in_shopping_cart']
+        fields = ['tags', 'author', 'is_favorited', 'is_in_shopping_cart',
+                  'search']
 
     def filter_tags(self, queryset, name, value):
         if not value:
             return queryset
         get_tags = [
             tag_value for tag_value in self.request.GET.getlist('tags')]
-        queryset = queryset.filter(tags__slug__in=get_tags).distinct()
-        return queryset
+        recipe_tags = Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'), tag__slug__in=get_tags)
+        return queryset.filter(Exists(recipe_tags))
 
     def filter_is_favorited(self, queryset, name, value):
         if not self.request.user.is_authenticated:
@@ -44,3 +55,6 @@ class RecipeFilter(FilterSet):
         return queryset.filter(
             id__in=get_shopping_cart.values_list('recipes_id', flat=True)
         )
+
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
@@ -0,0 +1,111 @@
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+
+from backend.constants import IMAGE_VARIANT_QUALITY, IMAGE_VARIANT_SIZES
+
+from .cache import bump_version
+
+logger = logging.getLogger(__name__)
+
+executor = None
+
+
+def get_executor():
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            thread_name_prefix='image-variants')
+    return executor
+
+
+def render_variant(image, size):
+    variant = image.copy()
+    variant.thumbnail(size, Image.LANCZOS)
+    if variant.mode not in ('RGB', 'RGBA'):
+        variant = variant.convert('RGBA' if 'A' in variant.getbands()
+                                  else 'RGB')
+    buffer = io.BytesIO()
+    variant.save(buffer, 'WEBP', quality=IMAGE_VARIANT_QUALITY)
+    return ContentFile(buffer.getvalue())
+
+
+def make_variants(model, pk, field_name, variants_field):
+    """Сохранить уменьшенные WebP-копии изображения и записать их пути.
+
+    Пути записываются только если изображение не сменилось, пока
+    копии готовились; копии предыдущего изображения удаляются.
+    """
+    instance = model.objects.filter(pk=pk).first()
+    file = getattr(instance, field_name, None)
+    if not file:
+        return
+    source = file.name
+    stem = PurePosixPath(source).stem
+    directory = PurePosixPath(source).parent / 'variants'
+    variants = {'source': source}
+    with file.open('rb'), Image.open(file) as image:
+        image = ImageOps.exif_transpose(image)
+        for name, size in IMAGE_VARIANT_SIZES.items():
+            variants[name] = file.storage.save(
+                str(directory / f'{stem}_{name}.webp'),
+                render_variant(image, size))
+    updated = model.objects.filter(
+        pk=pk, **{field_name: source}).update(**{variants_field: variants})
+    if updated:
+        bump_version(model)
+        bump_version(model, scope=pk)
+    stale = getattr(instance, variants_field) if updated else variants
+    for name in IMAGE_VARIANT_SIZES:
+        if stale.get(name):
+            file.storage.delete(stale[name])
+
+
+def make_variants_logged(*args):
+    """make_variants, ошибки которого пишутся в журнал, а не поднимаются.
+
+    Копии необязательны: без них API отдаёт исходное изображение, поэтому
+    битый файл не должен ронять сохранение рецепта.
+    """
+    try:
+        make_variants(*args)
+    except Exception:
+        logger.exception('Не удалось подготовить копии изображения %s',
+                         args[:2])
+
+
+def make_variants_in_worker(*args):
+    try:
+        make_variants_logged(*args)
+    finally:
+        connections.close_all()
+
+
+def schedule_variants(instance, field_name, variants_field):
+    """Поставить подготовку копий изображения в очередь после коммита."""
+    args = (type(instance), instance.pk, field_name, variants_field)
+    if settings.IMAGE_WORKERS:
+        transaction.on_commit(lambda: get_executor().submit(
+            make_variants_in_worker, *args))
+    else:
+        transaction.on_commit(lambda: make_variants_logged(*args))
+
+
+def variant_urls(instance, field_name, variants_field, request=None):
+    """Ссылки на готовые копии изображения для ответа API."""
+    file = getattr(instance, field_name)
+    variants = getattr(instance, variants_field)
+    if not file or variants.get('source') != file.name:
+        return {}
+    urls = {}
+    for name in IMAGE_VARIANT_SIZES:
+        url = file.storage.url(variants[name])
+        urls[name] = request.build_absolute_uri(url) if request else url
+    return urls
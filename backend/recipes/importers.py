@@ -0,0 +1,271 @@
+import csv
+import io
+import json
+from pathlib import Path
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connections, router, transaction
+
+from .cache import ALL_RECIPES, bump_version
+from .counters import COUNTERS, rebuild_counters
+from .models import Ingredient, Recipe, Tag
+from .search import rebuild_index
+
+
+def capitalize_name(values):
+    values['name'] = values['name'].capitalize()
+
+
+class ImportSpec:
+    """Какие поля модели загружаются и по какому полю ищутся дубликаты."""
+
+    def __init__(self, model, fields, unique_field, prepare=None):
+        self.model = model
+        self.fields = fields
+        self.unique_field = unique_field
+        self.update_fields = [
+            name for name in fields if name != unique_field]
+        self.prepare = prepare
+
+    @property
+    def model_fields(self):
+        return [self.model._meta.get_field(name) for name in self.fields]
+
+
+IMPORT_SPECS = {
+    'ingredient': ImportSpec(Ingredient, ('name', 'measurement_unit'),
+                             'name', prepare=capitalize_name),
+    'tag': ImportSpec(Tag, ('name', 'slug'), 'slug'),
+    'recipe': ImportSpec(Recipe, ('author', 'name', 'text', 'cooking_time'),
+                         'name'),
+}
+
+
+def iter_json_array(file, chunk_size=1 << 16):
+    """Потоково читать элементы JSON-массива, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = file.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError('Ожидался JSON-массив.')
+    buffer = buffer[1:]
+    eof = False
+    while True:
+        buffer = buffer.lstrip()
+        if buffer.startswith(','):
+            buffer = buffer[1:].lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+            continue
+        yield item
+        buffer = buffer[end:]
+
+
+def read_rows(path, fields):
+    """Строки файла в виде пар (номер строки, данные).
+
+    CSV читается с заголовком или без него (тогда колонки идут в порядке
+    fields), JSON — как массив объектов, .jsonl — по объекту на строку.
+    """
+    suffix = Path(path).suffix.lower()
+    with open(path, 'r', encoding='utf-8-sig', newline='') as file:
+        if suffix == '.csv':
+            reader = csv.reader(file)
+            header = None
+            for row in reader:
+                if header is None and set(fields) <= set(row):
+                    header = row
+                    continue
+                yield reader.line_num, dict(zip(header or fields, row))
+        elif suffix in ('.jsonl', '.ndjson'):
+            for number, line in enumerate(file, 1):
+                if line.strip():
+                    yield number, line
+        else:
+            yield from enumerate(iter_json_array(file), 1)
+
+
+class BulkImporter:
+    """Пакетная загрузка строк в модель с обновлением существующих записей.
+
+    На PostgreSQL пакет копируется через COPY FROM STDIN во временную
+    таблицу и переносится одним INSERT ... ON CONFLICT DO UPDATE, на
+    остальных СУБД используется bulk_create(update_conflicts=True).
+    Ошибочные строки не прерывают загрузку, а попадают в rejected.
+    """
+
+    def __init__(self, spec, batch_size, progress=None):
+        self.spec = spec
+        self.model = spec.model
+        self.batch_size = batch_size
+        self.progress = progress
+        self.fields = spec.model_fields
+        self.using = router.db_for_write(self.model)
+        self.connection = connections[self.using]
+        self.processed = 0
+        self.created = 0
+        self.updated = 0
+        self.saved = 0
+        self.rejected = []
+
+    def run(self, rows):
+        batch = {}
+        for line, raw in rows:
+            self.processed += 1
+            try:
+                key, values = self.clean(raw)
+            except (ValidationError, ValueError, TypeError) as error:
+                self.reject(line, raw, error)
+                continue
+            batch[key] = (line, values)
+            if len(batch) >= self.batch_size:
+                self.flush(batch)
+                batch = {}
+        if batch:
+            self.flush(batch)
+        bump_version(self.model)
+        if self.model is Recipe:
+            bump_version(Recipe, scope=ALL_RECIPES)
+        if self.model in COUNTERS:
+            rebuild_counters()
+        if self.model is Recipe:
+            rebuild_index()
+        return self
+
+    def clean(self, raw):
+        if isinstance(raw, str):
+            raw = json.loads(raw)
+        if not isinstance(raw, dict):
+            raise ValidationError(
+                f'Ожидался объект, получено: {type(raw).__name__}.')
+        values = {}
+        for field in self.fields:
+            value = raw.get(field.name, raw.get(field.attname))
+            if isinstance(value, str):
+                value = value.strip()
+            if field.is_relation:
+                values[field.attname] = int(value)
+            else:
+                values[field.name] = field.clean(value, None)
+        if self.spec.prepare:
+            self.spec.prepare(values)
+        return values[self.spec.unique_field], values
+
+    def reject(self, line, raw, error):
+        if isinstance(error, ValidationError):
+            error = '; '.join(error.messages)
+        self.rejected.append((line, raw, str(error)))
+
+    def check_relations(self, rows):
+        for field in self.fields:
+            if not field.is_relation:
+                continue
+            ids = {values[field.attname] for line, values in rows}
+            existing = set(field.related_model.objects.using(
+                self.using).filter(pk__in=ids).values_list('pk', flat=True))
+            missing = [(line, values) for line, values in rows
+                       if values[field.attname] not in existing]
+            for line, values in missing:
+                self.reject(line, values,
+                            f'{field.name}: объект не найден.')
+            rows = [(line, values) for line, values in rows
+                    if values[field.attname] in existing]
+        return rows
+
+    def flush(self, batch):
+        rows = self.check_relations(list(batch.values()))
+        try:
+            with transaction.atomic(using=self.using):
+                self.write([values for line, values in rows])
+        except IntegrityError:
+            for line, values in rows:
+                try:
+                    with transaction.atomic(using=self.using):
+                        self.write([values])
+                except IntegrityError as error:
+                    self.reject(line, values, error)
+        if self.progress:
+            self.progress(self)
+
+    def write(self, rows):
+        if not rows:
+            return
+        if self.connection.vendor == 'postgresql':
+            self.copy_upsert(rows)
+        else:
+            self.bulk_upsert(rows)
+        self.saved += len(rows)
+
+    def bulk_upsert(self, rows):
+        # bulk_create не сообщает, какие строки вставлены, поэтому
+        # существующие записи пакета выбираются заранее, в той же
+        # транзакции.
+        unique_field = self.spec.unique_field
+        queryset = self.model.objects.using(self.using)
+        updated = queryset.filter(**{
+            f'{unique_field}__in': [values[unique_field] for values in rows]
+        }).count()
+        queryset.bulk_create(
+            [self.model(**values) for values in rows],
+            update_conflicts=True,
+            unique_fields=[unique_field],
+            update_fields=self.spec.update_fields,
+        )
+        self.created += len(rows) - updated
+        self.updated += updated
+
+    def copy_upsert(self, rows):
+        quote = self.connection.ops.quote_name
+        opts = self.model._meta
+        fields = self.fields
+        columns = [quote(field.column) for field in fields]
+        staging = quote(f'import_{opts.db_table}')
+        table = quote(opts.db_table)
+        extra_columns, extra_values, params = [], [], []
+        for field in opts.concrete_fields:
+            if field.primary_key or field in fields or field.null:
+                continue
+            if getattr(field, 'auto_now_add', False):
+                extra_values.append('now()')
+            elif field.has_default():
+                extra_values.append('%s')
+                params.append(field.get_db_prep_save(
+                    field.get_default(), self.connection))
+            else:
+                continue
+            extra_columns.append(quote(field.column))
+        unique_column = quote(opts.get_field(self.spec.unique_field).column)
+        updates = ', '.join(
+            f'{quote(opts.get_field(name).column)} = '
+            f'EXCLUDED.{quote(opts.get_field(name).column)}'
+            for name in self.spec.update_fields
+        )
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(
+            [values[field.attname] for field in fields] for values in rows)
+        buffer.seek(0)
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMP TABLE IF NOT EXISTS {staging} AS '
+                f'SELECT {", ".join(columns)} FROM {table} WITH NO DATA'
+            )
+            cursor.execute(f'TRUNCATE {staging}')
+            cursor.copy_expert(
+                f'COPY {staging} ({", ".join(columns)}) '
+                'FROM STDIN WITH (FORMAT csv)', buffer)
+            cursor.execute(
+                f'INSERT INTO {table} ({", ".join(columns + extra_columns)}) '
+                f'SELECT {", ".join(columns + extra_values)} FROM {staging} '
+                f'ON CONFLICT ({unique_column}) DO UPDATE SET {updates} '
+                'RETURNING (xmax = 0)', params
+            )
+            created = sum(1 for inserted, in cursor.fetchall() if inserted)
+        self.created += created
+        self.updated += len(rows) - created
@@ -0,0 +1,123 @@
+import http.client
+import json
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+from .benchmark import PERCENTILES, percentile
+
+DEFAULT_PATHS = (
+    '/api/recipes/',
+    '/api/recipes/?page=2',
+    '/api/tags/',
+    '/api/ingredients/?name=%D1%81',
+)
+COMPARED = ('throughput_rps', 'p50_ms', 'p95_ms')
+
+
+def summarize(samples, elapsed):
+    latencies = [latency for status, latency in samples
+                 if status is not None and status < 400]
+    result = {
+        'requests': len(samples),
+        'errors': len(samples) - len(latencies),
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+    }
+    if latencies:
+        result['mean_ms'] = round(statistics.mean(latencies) * 1000, 3)
+        result['max_ms'] = round(max(latencies) * 1000, 3)
+        for percent in PERCENTILES:
+            result[f'p{percent}_ms'] = round(
+                percentile(latencies, percent) * 1000, 3)
+    return result
+
+
+class LoadTest:
+    """Нагрузка по HTTP на запущенный сервер.
+
+    concurrency клиентов одновременно повторяют GET-запросы по кругу
+    duration секунд, каждый на своём keep-alive соединении, так что
+    сервер всё время держит concurrency запросов в работе. Так на одних
+    и тех же данных сравниваются WSGI (gunicorn) и ASGI (uvicorn).
+    """
+
+    def __init__(self, url, concurrency, token=None, timeout=30):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.headers = {'Accept': 'application/json'}
+        if token:
+            self.headers['Authorization'] = f'Token {token}'
+
+    def get(self, path):
+        connection = http.client.HTTPConnection(self.host, self.port,
+                                                timeout=self.timeout)
+        try:
+            connection.request('GET', self.prefix + path,
+                               headers=self.headers)
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            connection.close()
+
+    def default_paths(self):
+        """DEFAULT_PATHS, карточка первого рецепта и подписки (с токеном)."""
+        paths = list(DEFAULT_PATHS)
+        status, body = self.get('/api/recipes/?limit=1')
+        recipes = json.loads(body)['results'] if status == 200 else []
+        if recipes:
+            paths.append(f'/api/recipes/{recipes[0]["id"]}/')
+        if 'Authorization' in self.headers:
+            paths.append('/api/users/subscriptions/?recipes_limit=3')
+        return paths
+
+    def client(self, number, paths, deadline, samples):
+        connection = http.client.HTTPConnection(self.host, self.port,
+                                                timeout=self.timeout)
+        while time.perf_counter() < deadline:
+            path = paths[number % len(paths)]
+            number += 1
+            started = time.perf_counter()
+            try:
+                connection.request('GET', self.prefix + path,
+                                   headers=self.headers)
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                status = None
+            samples.append((path, status, time.perf_counter() - started))
+        connection.close()
+
+    def run(self, paths, duration):
+        samples = []
+        deadline = time.perf_counter() + duration
+        threads = [
+            threading.Thread(target=self.client,
+                             args=(number, paths, deadline, samples))
+            for number in range(self.concurrency)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return samples, time.perf_counter() - started
+
+    def measure(self, paths, duration, warmup=0):
+        if warmup:
+            self.run(paths, warmup)
+        samples, elapsed = self.run(paths, duration)
+        scenarios = {'all': summarize(
+            [(status, latency) for path, status, latency in samples],
+            elapsed)}
+        for path in paths:
+            scenarios[path] = summarize(
+                [(status, latency) for sample_path, status, latency
+                 in samples if sample_path == path], elapsed)
+        return scenarios
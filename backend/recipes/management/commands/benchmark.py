@@ -0,0 +1,74 @@
+import json
+import random
+import tempfile
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from recipes.benchmark import (Benchmark, Scale, clear, compare,
+                               environment, seed)
+
+SCALE_OPTIONS = ('users', 'recipes', 'ingredients', 'ingredients_per_recipe',
+                 'tags', 'favorites', 'subscriptions', 'cart')
+
+
+class Command(BaseCommand):
+    help = ('Замерить задержки, число SQL-запросов и пропускную способность '
+            'основных запросов API на синтетических данных')
+
+    def add_arguments(self, parser):
+        defaults = Scale()
+        for name in SCALE_OPTIONS:
+            parser.add_argument(f'--{name.replace("_", "-")}', type=int,
+                                default=getattr(defaults, name))
+        parser.add_argument('--no-seed', action='store_true',
+                            help='Использовать данные прошлого прогона')
+        parser.add_argument('--clear', action='store_true',
+                            help='Удалить синтетические данные и выйти')
+        parser.add_argument('--requests', type=int, default=100,
+                            help='Запросов на сценарий')
+        parser.add_argument('--warmup', type=int, default=5,
+                            help='Запросов для прогрева')
+        parser.add_argument('--scenario', action='append',
+                            help='Сценарий (можно повторять)')
+        parser.add_argument('--random-seed', type=int, default=0)
+        parser.add_argument('--label', type=str,
+                            help='Метка прогона, например хэш коммита')
+        parser.add_argument('--output', type=str,
+                            help='Файл для результатов в JSON')
+        parser.add_argument('--baseline', type=str,
+                            help='JSON прошлого прогона для сравнения')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            clear()
+            self.stdout.write(self.style.SUCCESS('Данные замеров удалены'))
+            return
+        rng = random.Random(options['random_seed'])
+        scale = Scale(**{name: options[name] for name in SCALE_OPTIONS})
+        if not options['no_seed']:
+            self.stdout.write(self.style.NOTICE('Создание данных...'))
+            seed(scale, rng)
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+                MEDIA_ROOT=media_root, ALLOWED_HOSTS=['testserver']):
+            benchmark = Benchmark(options['requests'], options['warmup'], rng)
+            names = options['scenario'] or list(benchmark.scenarios)
+            unknown = set(names) - set(benchmark.scenarios)
+            if unknown:
+                raise CommandError(
+                    'Неизвестные сценарии: ' + ', '.join(sorted(unknown)))
+            results = {
+                'label': options['label'],
+                'created': datetime.now(timezone.utc).isoformat(),
+                'environment': environment(),
+                'scale': None if options['no_seed'] else scale.as_dict(),
+                'scenarios': benchmark.run(names),
+            }
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as file:
+                results['change_percent'] = compare(results, json.load(file))
+        output = json.dumps(results, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output)
+        self.stdout.write(output)
@@ -1,45 +1,70 @@
+import csv
 import json
+from pathlib import Path
 
-from django.apps import apps
-from django.contrib.auth import get_user_model
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction
-from recipes.models import Ingredient
-
-
-def import_data(model_name, csv_file_path):
-    if model_name == 'User':
-        model_class = get_user_model()
-    else:
-        model_class = apps.get_model(
-            app_label='recipes', model_name=model_name
-        )
-    if model_class is None:
-        raise CommandError('Модель не существует.')
-
-    with transaction.atomic():
-        with open(csv_file_path, 'r', encoding='utf-8-sig') as data:
-            for row in json.load(data):
-                ingredient = Ingredient(
-                    name=row['name'].capitalize(),
-                    measurement_unit=row['measurement_unit']
-                )
-                ingredient.save()
+from recipes.importers import IMPORT_SPECS, BulkImporter, read_rows
+
+from backend.constants import IMPORT_BATCH_SIZE, IMPORT_REJECTS_SHOWN
+
+DATA_DIR = settings.BASE_DIR.parent / 'data'
+
+
+def find_file(path):
+    for candidate in (Path(path), DATA_DIR / path):
+        if candidate.is_file():
+            return candidate
+    raise CommandError(f'Файл {path} не найден.')
 
 
 class Command(BaseCommand):
+    help = ('Загрузить ингредиенты, тэги или рецепты из CSV, JSON или '
+            'JSON Lines файла')
+
     def add_arguments(self, parser):
         parser.add_argument('csv_file', type=str, help='Путь к файлу')
         parser.add_argument('model_name', type=str, help='Имя модели')
+        parser.add_argument('--batch-size', type=int,
+                            default=IMPORT_BATCH_SIZE,
+                            help='Количество строк в одном пакете')
+        parser.add_argument('--rejects', type=str,
+                            help='CSV-файл для отклонённых строк')
 
     def handle(self, *args, **options):
-        file = options['csv_file']
-        model = options['model_name']
+        spec = IMPORT_SPECS.get(options['model_name'].lower())
+        if spec is None:
+            raise CommandError(
+                'Модель не поддерживается. Доступны: '
+                + ', '.join(sorted(IMPORT_SPECS)))
+        file = find_file(options['csv_file'])
         self.stdout.write(self.style.NOTICE(f'Импорт из файла {file}'))
+        importer = BulkImporter(spec, options['batch_size'],
+                                progress=self.report_progress)
         try:
-            import_data(model, file)
-        except Exception as exception:
-            self.stdout.write(
-                self.style.ERROR(f'Ошибка импорта:\n{exception}.'))
-        else:
-            self.stdout.write(self.style.SUCCESS('Импорт произведен'))
+            importer.run(read_rows(file, spec.fields))
+        except (OSError, ValueError, csv.Error) as exception:
+            raise CommandError(f'Ошибка импорта:\n{exception}.')
+        self.report_rejected(importer, options['rejects'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Импорт произведен: обработано {importer.processed}, '
+            f'сохранено {importer.saved} (создано {importer.created}, '
+            f'обновлено {importer.updated}), '
+            f'отклонено {len(importer.rejected)}'))
+
+    def report_progress(self, importer):
+        self.stdout.write(
+            f'Обработано строк: {importer.processed}, '
+            f'сохранено: {importer.saved}')
+
+    def report_rejected(self, importer, path):
+        for line, raw, reason in importer.rejected[:IMPORT_REJECTS_SHOWN]:
+            self.stderr.write(f'Строка {line} отклонена: {reason}')
+        if path:
+            with open(path, 'w', encoding='utf-8', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(['line', 'reason', 'data'])
+                for line, raw, reason in importer.rejected:
+                    if not isinstance(raw, str):
+                        raw = json.dumps(raw, ensure_ascii=False)
+                    writer.writerow([line, reason, raw])
@@ -0,0 +1,55 @@
+import json
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand
+from recipes.benchmark import compare
+from recipes.loadtest import COMPARED, LoadTest
+
+
+class Command(BaseCommand):
+    help = ('Нагрузить запущенный сервер параллельными GET-запросами и '
+            'замерить пропускную способность и задержки')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', type=str,
+                            default='http://127.0.0.1:8000',
+                            help='Адрес сервера')
+        parser.add_argument('--path', action='append',
+                            help='Путь запроса (можно повторять)')
+        parser.add_argument('--token', type=str,
+                            help='Токен пользователя для запросов')
+        parser.add_argument('--concurrency', type=int, default=100,
+                            help='Одновременных клиентов')
+        parser.add_argument('--duration', type=float, default=30,
+                            help='Длительность замера, с')
+        parser.add_argument('--warmup', type=float, default=3,
+                            help='Длительность прогрева, с')
+        parser.add_argument('--label', type=str,
+                            help='Метка прогона, например wsgi или asgi')
+        parser.add_argument('--output', type=str,
+                            help='Файл для результатов в JSON')
+        parser.add_argument('--baseline', type=str,
+                            help='JSON прошлого прогона для сравнения')
+
+    def handle(self, *args, **options):
+        load_test = LoadTest(options['url'], options['concurrency'],
+                             options['token'])
+        paths = options['path'] or load_test.default_paths()
+        results = {
+            'label': options['label'],
+            'created': datetime.now(timezone.utc).isoformat(),
+            'url': options['url'],
+            'concurrency': options['concurrency'],
+            'duration': options['duration'],
+            'scenarios': load_test.measure(paths, options['duration'],
+                                           options['warmup']),
+        }
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as file:
+                results['change_percent'] = compare(
+                    results, json.load(file), COMPARED)
+        output = json.dumps(results, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output)
+        self.stdout.write(output)
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.counters import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитать счётчики рецептов, избранного, корзин и подписчиков'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild_counters()
+        self.stdout.write(self.style.SUCCESS('Счётчики пересчитаны'))
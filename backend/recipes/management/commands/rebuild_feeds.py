@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.feed import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Пересобрать ленты рецептов по подпискам'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild()
+        self.stdout.write(self.style.SUCCESS('Ленты пересобраны'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.shopping import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Пересчитать списки покупок по корзинам пользователей'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild()
+        self.stdout.write(self.style.SUCCESS('Списки покупок пересчитаны'))
@@ -0,0 +1,53 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+COUNTERS = (
+    ('Recipe', 'author', 'User', 'recipes_count'),
+    ('Favorite', 'recipes', 'Recipe', 'favorites_count'),
+    ('ShoppingList', 'recipes', 'Recipe', 'shopping_cart_count'),
+    ('Subscribe', 'subscriber', 'User', 'subscribers_count'),
+)
+
+
+def fill_counters(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    for source, field, target, counter in COUNTERS:
+        source_model = apps.get_model('recipes', source)
+        target_model = apps.get_model('recipes', target)
+        total = source_model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(total=Count('pk')).values('total')
+        target_model.objects.using(db_alias).update(
+            **{counter: Coalesce(Subquery(total), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_ingredient_name_lower_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В корзинах'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество рецептов'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='subscribers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество подписчиков'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicate_favorites(apps, schema_editor):
+    Favorite = apps.get_model('recipes', 'Favorite')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    db_alias = schema_editor.connection.alias
+    duplicates = Favorite.objects.using(db_alias).values(
+        'user', 'recipes'
+    ).annotate(first=Min('id'), total=Count('id')).filter(total__gt=1)
+    recipe_ids = set()
+    for duplicate in duplicates:
+        Favorite.objects.using(db_alias).filter(
+            user=duplicate['user'], recipes=duplicate['recipes']
+        ).exclude(pk=duplicate['first']).delete()
+        recipe_ids.add(duplicate['recipes'])
+    total = Favorite.objects.filter(
+        recipes=OuterRef('pk')
+    ).order_by().values('recipes').annotate(total=Count('pk')).values('total')
+    Recipe.objects.using(db_alias).filter(pk__in=recipe_ids).update(
+        favorites_count=Coalesce(Subquery(total), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_feedentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_favorites,
+                             migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='favorite',
+            name='favorite_user_recipe_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='favorite',
+            constraint=models.UniqueConstraint(fields=('user', 'recipes'), name='unique_favorite'),
+        ),
+    ]
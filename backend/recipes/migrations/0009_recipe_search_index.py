@@ -0,0 +1,71 @@
+from django.db import migrations
+
+from backend.constants import SEARCH_CONFIG
+
+
+def fold_yo(sql):
+    return f"replace(replace({sql}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def ingredient_names(aggregate):
+    return fold_yo(
+        f"coalesce((SELECT {aggregate}(i.name, ' ') "
+        'FROM recipes_ingredientinrecipe ri '
+        'JOIN recipes_ingredient i ON i.id = ri.ingredient_id '
+        "WHERE ri.recipe_id = r.id), '')"
+    )
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE TABLE recipes_recipe_search ('
+            'recipe_id bigint PRIMARY KEY '
+            'REFERENCES recipes_recipe (id) ON DELETE CASCADE, '
+            'document tsvector NOT NULL)'
+        )
+        schema_editor.execute(
+            'CREATE INDEX recipes_recipe_search_document_idx '
+            'ON recipes_recipe_search USING GIN (document)'
+        )
+        schema_editor.execute(
+            'INSERT INTO recipes_recipe_search (recipe_id, document) '
+            'SELECT r.id, '
+            f"setweight(to_tsvector(%s::regconfig, {fold_yo('r.name')}), 'A')"
+            ' || setweight(to_tsvector(%s::regconfig, '
+            f"{ingredient_names('string_agg')}), 'B') || "
+            f"setweight(to_tsvector(%s::regconfig, {fold_yo('r.text')}), 'C')"
+            ' FROM recipes_recipe r',
+            [SEARCH_CONFIG] * 3,
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE recipes_recipe_fts USING fts5('
+            "name, ingredients, text, tokenize='unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            'INSERT INTO recipes_recipe_fts (rowid, name, ingredients, text) '
+            f"SELECT r.id, {fold_yo('r.name')}, "
+            f"{ingredient_names('group_concat')}, {fold_yo('r.text')} "
+            'FROM recipes_recipe r'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP TABLE IF EXISTS recipes_recipe_search')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS recipes_recipe_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_favorite_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
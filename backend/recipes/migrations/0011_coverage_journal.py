@@ -0,0 +1,42 @@
+# Generated by Django 4.2.13 on 2026-10-18 04:22
+
+from django.db import migrations, models
+
+
+def create_version(apps, schema_editor):
+    CoverageVersion = apps.get_model('recipes', 'CoverageVersion')
+    CoverageVersion.objects.using(schema_editor.connection.alias).create()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoverageChange',
+            fields=[
+                ('number', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='Номер изменения')),
+                ('recipe_id', models.BigIntegerField(verbose_name='id рецепта')),
+            ],
+            options={
+                'verbose_name': 'Изменение индекса покрытия',
+                'verbose_name_plural': 'Изменения индекса покрытия',
+                'ordering': ('number',),
+            },
+        ),
+        migrations.CreateModel(
+            name='CoverageVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.BigIntegerField(default=0, verbose_name='Номер изменения')),
+            ],
+            options={
+                'verbose_name': 'Версия индекса покрытия',
+                'verbose_name_plural': 'Версии индекса покрытия',
+            },
+        ),
+        migrations.RunPython(create_version, migrations.RunPython.noop),
+    ]
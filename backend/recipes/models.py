@@ -20,8 +20,33 @@ def user_validator(value):
         raise ValidationError('Неверный логин')
 
 
-class User(AbstractUser):
+class CounterFieldsMixin:
+    """Не записывает поля-счётчики при обычном сохранении записи.
+
+    Счётчики меняются только запросами UPDATE с F() (см. counters), а
+    save() изменённой записи записал бы их устаревшее значение из памяти
+    поверх параллельного изменения.
+    """
+
+    counter_fields = ()
+
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        if update_fields is None and not force_insert and not (
+                self._state.adding):
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred
+                and field.name not in self.counter_fields
+            ]
+        super().save(force_insert=force_insert, force_update=force_update,
+                     using=using, update_fields=update_fields)
+
+
+class User(CounterFieldsMixin, AbstractUser):
     USERNAME_FIELD = 'email'
+    counter_fields = ('recipes_count', 'subscribers_count')
     REQUIRED_FIELDS = [
         'first_name',
         'last_name',
@@ -65,6 +90,16 @@ class User(AbstractUser):
         default=Roles.USER,
         choices=Roles.choices,
     )
+    recipes_count = models.PositiveIntegerField(
+        'Количество рецептов',
+        default=0,
+        editable=False,
+    )
+    subscribers_count = models.PositiveIntegerField(
+        'Количество подписчиков',
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         ordering = ['username', 'email']
@@ -167,7 +202,7 @@ class Tag(models.Model):
         return self.name
 
 
-class Recipe(models.Model):
+class Recipe(CounterFieldsMixin, models.Model):
     author = models.ForeignKey(
         User,
         related_name='recipe',
@@ -188,6 +223,12 @@ class Recipe(models.Model):
         null=True,
         blank=True
     )
+    image_variants = models.JSONField(
+        verbose_name='Уменьшенные копии изображения',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
     cooking_time = models.PositiveSmallIntegerField(
         verbose_name='Время приготовления',
         validators=[MinValueValidator(MIN_COOKING_TIME,
@@ -213,9 +254,25 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
         auto_now_add=True
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False,
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        verbose_name='В корзинах',
+        default=0,
+        editable=False,
+    )
+
+    counter_fields = ('favorites_count', 'shopping_cart_count')
 
     class Meta:
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(fields=['-pub_date', 'id'],
+                         name='recipe_pub_date_id_idx'),
+        ]
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
 
@@ -274,6 +331,10 @@ class Favorite(models.Model):
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
         ordering = ['user']
+        constraints = [
+            UniqueConstraint(fields=['user', 'recipes'],
+                             name='unique_favorite')
+        ]
 
 
 class ShoppingList(models.Model):
@@ -301,3 +362,115 @@ class ShoppingList(models.Model):
 
     def __str__(self):
         return f'{self.user} добавил рецепт "{self.recipes}" в Корзину'
+
+
+class FeedEntry(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Подписчик',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор',
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации',
+    )
+
+    class Meta:
+        ordering = ('-pub_date',)
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            UniqueConstraint(fields=['user', 'recipe'],
+                             name='unique_feed_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date'],
+                         name='feed_user_pub_date_idx'),
+            models.Index(fields=['user', 'author'],
+                         name='feed_user_author_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe} в ленте {self.user}'
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Ингредиент',
+    )
+    amount = models.IntegerField(
+        verbose_name='Количество',
+        default=0,
+    )
+
+    class Meta:
+        ordering = ('user',)
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Позиции списков покупок'
+        constraints = [
+            UniqueConstraint(fields=['user', 'ingredient'],
+                             name='unique_shopping_list_item'),
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient} в списке покупок {self.user}'
+
+
+class CoverageVersion(models.Model):
+    """Номер последнего изменения индекса покрытия, одна строка.
+
+    Запись в журнал обновляет строку, и она остаётся заблокированной до
+    конца транзакции, поэтому номера фиксируются по порядку и без
+    пропусков.
+    """
+
+    number = models.BigIntegerField(
+        verbose_name='Номер изменения',
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = 'Версия индекса покрытия'
+        verbose_name_plural = 'Версии индекса покрытия'
+
+    def __str__(self):
+        return str(self.number)
+
+
+class CoverageChange(models.Model):
+    number = models.BigIntegerField(
+        verbose_name='Номер изменения',
+        primary_key=True,
+    )
+    recipe_id = models.BigIntegerField(
+        verbose_name='id рецепта',
+    )
+
+    class Meta:
+        ordering = ('number',)
+        verbose_name = 'Изменение индекса покрытия'
+        verbose_name_plural = 'Изменения индекса покрытия'
+
+    def __str__(self):
+        return f'{self.number}: рецепт {self.recipe_id}'
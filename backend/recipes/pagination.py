@@ -0,0 +1,174 @@
+import base64
+import binascii
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.paginator import InvalidPage
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from backend.constants import MAX_PAGE_SIZE, PAGE_SIZE
+
+
+def estimate_count(queryset):
+    """Оценка числа строк по плану запроса PostgreSQL (без COUNT(*))."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+class PageNumberPagination(pagination.PageNumberPagination):
+    """PageNumberPagination с асинхронным вариантом paginate_queryset."""
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        paginator = self.django_paginator_class(queryset, page_size)
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message=str(exc)))
+        self.page.object_list = [
+            item async for item in self.page.object_list]
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        return list(self.page)
+
+
+class LimitOffsetPagination(pagination.LimitOffsetPagination):
+    """LimitOffsetPagination с асинхронным вариантом paginate_queryset."""
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.count = await queryset.acount()
+        self.offset = self.get_offset(request)
+        if self.count > self.limit and self.template is not None:
+            self.display_page_controls = True
+        if self.count == 0 or self.offset > self.count:
+            return []
+        return [item async for item in
+                queryset[self.offset:self.offset + self.limit]]
+
+
+class RecipeCursorPagination(pagination.BasePagination):
+    """Keyset-пагинация ленты рецептов по (-pub_date, id).
+
+    Курсор хранит позицию последнего (или первого) рецепта страницы,
+    поэтому глубокие страницы не требуют OFFSET и COUNT(*).
+    Приблизительное количество отдаётся по запросу count=approx.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    count_query_param = 'count'
+    page_size = PAGE_SIZE
+    max_page_size = MAX_PAGE_SIZE
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page = self.get_page_queryset(queryset, request)
+        if self.count_requested:
+            self.count = estimate_count(queryset)
+        return self.get_page(list(page))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        page = self.get_page_queryset(queryset, request)
+        if self.count_requested:
+            self.count = await sync_to_async(estimate_count)(queryset)
+        return self.get_page([item async for item in page])
+
+    def get_page_queryset(self, queryset, request):
+        """Запрос страницы: page_size + 1 рецептов после курсора."""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.count = None
+        self.count_requested = (
+            request.query_params.get(self.count_query_param) == 'approx')
+        self.limit = self.get_page_size(request)
+        self.position, self.reverse = self.decode_cursor(request)
+        if self.position is not None:
+            pub_date, pk = self.position
+            if self.reverse:
+                queryset = queryset.filter(
+                    Q(pub_date__gt=pub_date) | Q(pub_date=pub_date, id__lt=pk))
+            else:
+                queryset = queryset.filter(
+                    Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, id__gt=pk))
+        ordering = (('pub_date', '-id') if self.reverse
+                    else ('-pub_date', 'id'))
+        return queryset.order_by(*ordering)[:self.limit + 1]
+
+    def get_page(self, results):
+        """Обрезать лишний рецепт и посчитать ссылки next/previous."""
+        has_more = len(results) > self.limit
+        results = results[:self.limit]
+        if self.reverse:
+            results.reverse()
+        self.next = self.previous = None
+        if results:
+            if has_more or self.reverse:
+                self.next = self.encode_cursor(results[-1], False)
+            if ((has_more and self.reverse)
+                    or (self.position and not self.reverse)):
+                self.previous = self.encode_cursor(results[0], True)
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            pub_date = parse_datetime(data['p'])
+            position = (pub_date, int(data['i']))
+            reverse = bool(data.get('r'))
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if pub_date is None:
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def encode_cursor(self, recipe, reverse):
+        data = {'p': recipe.pub_date.isoformat(), 'i': recipe.pk}
+        if reverse:
+            data['r'] = 1
+        encoded = base64.urlsafe_b64encode(
+            json.dumps(data, separators=(',', ':')).encode()).decode()
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, encoded)
+
+    def get_paginated_response(self, data):
+        response = {'next': self.next, 'previous': self.previous,
+                    'results': data}
+        if self.count is not None:
+            response = {'count': self.count, **response}
+        return Response(response)
@@ -0,0 +1,113 @@
+from django.db import IntegrityError, connections, router, transaction
+
+from . import shopping
+from .cache import bump_version
+from .counters import update_counters
+from .models import Recipe, ShoppingList, User
+
+
+def supports_returning(connection):
+    """Поддерживает ли СУБД RETURNING в INSERT и DELETE.
+
+    features.can_return_columns_from_insert говорит только про INSERT,
+    поэтому поддержка определяется по СУБД: PostgreSQL и SQLite с 3.35.
+    """
+    if connection.vendor == 'postgresql':
+        return True
+    return (connection.vendor == 'sqlite'
+            and connection.Database.sqlite_version_info >= (3, 35))
+
+
+def relation_sql(model, connection):
+    """Таблица и колонки пользователя и рецепта для model, в кавычках."""
+    quote = connection.ops.quote_name
+    opts = model._meta
+    return (quote(opts.db_table), quote(opts.get_field('user').column),
+            quote(opts.get_field('recipes').column))
+
+
+def insert_relations(model, user, recipe_ids):
+    """Вставить записи model пользователя; вернуть id вставленных рецептов.
+
+    Записи, уже существующие (в том числе вставленные параллельным
+    запросом), пропускаются и в результат не попадают.
+    """
+    using = router.db_for_write(model)
+    connection = connections[using]
+    if not supports_returning(connection):
+        created = []
+        for pk in recipe_ids:
+            try:
+                with transaction.atomic(using=using):
+                    model.objects.using(using).bulk_create(
+                        [model(user=user, recipes_id=pk)])
+            except IntegrityError:
+                continue
+            created.append(pk)
+        return created
+    table, user_column, recipe_column = relation_sql(model, connection)
+    values = ', '.join(['(%s, %s)'] * len(recipe_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({user_column}, {recipe_column}) '
+            f'VALUES {values} ON CONFLICT DO NOTHING '
+            f'RETURNING {recipe_column}',
+            [value for pk in recipe_ids for value in (user.pk, pk)])
+        return [pk for pk, in cursor.fetchall()]
+
+
+@transaction.atomic
+def add_recipes(model, user, recipe_ids):
+    """Добавить рецепты в избранное или корзину (model) пользователя.
+
+    Возвращает статус для каждого id: created, exists или not_found.
+    Наличие рецептов проверяется одним запросом, новые записи вставляются
+    одним INSERT ... ON CONFLICT DO NOTHING RETURNING, поэтому счётчики и
+    список покупок учитывают только действительно вставленные записи.
+    """
+    found = list(Recipe.objects.filter(pk__in=recipe_ids).values_list(
+        'pk', flat=True))
+    created = insert_relations(model, user, found) if found else []
+    if created:
+        update_counters(model, created, 1)
+        if model is ShoppingList:
+            shopping.add(user.pk, created)
+        transaction.on_commit(lambda: bump_version(User, scope=user.pk))
+    statuses = dict.fromkeys(recipe_ids, 'not_found')
+    statuses.update((pk, 'exists') for pk in found)
+    statuses.update((pk, 'created') for pk in created)
+    return statuses
+
+
+@transaction.atomic
+def remove_recipes(model, user, recipe_ids):
+    """Убрать рецепты из избранного или корзины (model) пользователя.
+
+    Возвращает статус для каждого id: deleted или not_found. Где СУБД
+    поддерживает DELETE ... RETURNING, удаление делается одним запросом.
+    """
+    using = router.db_for_write(model)
+    connection = connections[using]
+    table, user_column, recipe_column = relation_sql(model, connection)
+    sql = (
+        f'DELETE FROM {table} WHERE {user_column} = %s '
+        f'AND {recipe_column} IN ({", ".join(["%s"] * len(recipe_ids))})'
+    )
+    params = [user.pk, *recipe_ids]
+    with connection.cursor() as cursor:
+        if supports_returning(connection):
+            cursor.execute(f'{sql} RETURNING {recipe_column}', params)
+            deleted = [pk for pk, in cursor.fetchall()]
+        else:
+            deleted = list(model.objects.using(using).select_for_update(
+            ).filter(user=user, recipes__in=recipe_ids).values_list(
+                'recipes_id', flat=True))
+            cursor.execute(sql, params)
+    if deleted:
+        update_counters(model, deleted, -1)
+        if model is ShoppingList:
+            shopping.remove(user.pk, deleted)
+        transaction.on_commit(lambda: bump_version(User, scope=user.pk))
+    statuses = dict.fromkeys(recipe_ids, 'not_found')
+    statuses.update((pk, 'deleted') for pk in deleted)
+    return statuses
@@ -0,0 +1,49 @@
+import orjson
+from rest_framework import renderers
+from rest_framework.renderers import BaseRenderer
+
+ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+                  | orjson.OPT_PASSTHROUGH_DATACLASS)
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """JSON через orjson, байт в байт как у JSONRenderer из DRF.
+
+    Даты, Decimal, ленивые строки и прочие нестандартные типы кодирует
+    encoder_class из DRF. С отступами, ensure_ascii или при ошибке orjson
+    (например, целое больше 64 бит) работает исходный рендерер. В API нет
+    дробных чисел: orjson записывает 1e16 без «+», в отличие от json.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (self.ensure_ascii or not self.compact or self.get_indent(
+                accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        try:
+            rendered = orjson.dumps(data, default=self.encoder_class().default,
+                                    option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        # Как и DRF, экранируем разделители строк для вставки в JavaScript.
+        return rendered.replace(b'\xe2\x80\xa8', b'\\u2028').replace(
+            b'\xe2\x80\xa9', b'\\u2029')
+
+
+class PlainTextRenderer(BaseRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            return '\n'.join(f'{key}: {value}' for key, value in data.items())
+        return str(data)
+
+
+class CSVRenderer(PlainTextRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
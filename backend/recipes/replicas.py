@@ -0,0 +1,66 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+
+from backend.db.routers import read_replica
+
+
+def primary_key(user_id):
+    return f'replica:primary:{user_id}'
+
+
+def stick_to_primary(user):
+    """Читать данные пользователя из основной БД в ближайшие секунды.
+
+    Метка хранится в общем кэше, поэтому действует во всех процессах:
+    пользователь сразу видит свои изменения, даже пока реплики отстают.
+    """
+    cache.set(primary_key(user.pk), True,
+              settings.REPLICA_STICKY_SECONDS)
+
+
+def read_primary_if_changed(versions):
+    """Вернуть чтение в основную БД, если данные только что менялись.
+
+    versions — версии из recipes.cache (время изменения в нс). Ответ,
+    прочитанный с отстающей реплики, закэшировался бы под новым ETag.
+    """
+    window = settings.REPLICA_STICKY_SECONDS * 10 ** 9
+    if (read_replica.get() is not None and versions
+            and time.time_ns() - max(versions) < window):
+        read_replica.set(None)
+
+
+class ReplicaReadMixin:
+    """Чтение с реплик для безопасных запросов действий replica_actions.
+
+    Реплика выбирается на весь запрос после аутентификации. Пользователь,
+    недавно что-то изменивший (см. stick_to_primary), читает из основной
+    БД. Успешный изменяющий запрос ставит такую метку.
+    """
+
+    replica_actions = ()
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if (settings.REPLICA_DATABASES
+                and request.method in SAFE_METHODS
+                and self.action in self.replica_actions
+                and not (request.user.is_authenticated
+                         and cache.get(primary_key(request.user.pk)))):
+            self.replica_token = read_replica.set(
+                random.choice(settings.REPLICA_DATABASES))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, 'replica_token', None)
+        if token is not None:
+            read_replica.reset(token)
+            self.replica_token = None
+        if (request.method not in SAFE_METHODS
+                and response.status_code < 400
+                and request.user.is_authenticated):
+            stick_to_primary(request.user)
+        return super().finalize_response(request, response, *args, **kwargs)
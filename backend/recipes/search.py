@@ -0,0 +1,177 @@
+from django.db import connections, router
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.expressions import RawSQL
+
+from backend.constants import SEARCH_CONFIG
+
+from .models import IngredientInRecipe, Recipe
+
+# Буква ё и в индексе, и в запросе заменяется на е: ни FTS5, ни словари
+# PostgreSQL их не отождествляют, а пишут названия по-разному.
+YO = str.maketrans('ёЁ', 'еЕ')
+
+
+def fold_yo(sql):
+    return f"replace(replace({sql}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def ingredient_names(aggregate):
+    """Названия ингредиентов рецепта r одной строкой."""
+    return fold_yo(
+        f"coalesce((SELECT {aggregate}(i.name, ' ') "
+        'FROM recipes_ingredientinrecipe ri '
+        'JOIN recipes_ingredient i ON i.id = ri.ingredient_id '
+        "WHERE ri.recipe_id = r.id), '')"
+    )
+
+
+class PostgresSearch:
+    """tsvector в таблице recipes_recipe_search с GIN-индексом.
+
+    Название весит больше ингредиентов, ингредиенты — больше описания.
+    """
+
+    table = 'recipes_recipe_search'
+
+    def filter(self, queryset, query):
+        params = (SEARCH_CONFIG, query.translate(YO))
+        matched = RawSQL(
+            f'SELECT recipe_id FROM {self.table} '
+            'WHERE document @@ websearch_to_tsquery(%s::regconfig, %s)',
+            params)
+        rank = RawSQL(
+            'SELECT ts_rank(s.document, '
+            'websearch_to_tsquery(%s::regconfig, %s)) '
+            f'FROM {self.table} s WHERE s.recipe_id = recipes_recipe.id',
+            params)
+        return queryset.filter(id__in=matched).annotate(
+            search_rank=rank).order_by('-search_rank', '-pub_date', '-id')
+
+    def index(self, cursor, recipe_ids):
+        cursor.execute(
+            f'INSERT INTO {self.table} (recipe_id, document) '
+            'SELECT r.id, '
+            f"setweight(to_tsvector(%s::regconfig, {fold_yo('r.name')}), 'A')"
+            ' || setweight(to_tsvector(%s::regconfig, '
+            f"{ingredient_names('string_agg')}), 'B') || "
+            f"setweight(to_tsvector(%s::regconfig, {fold_yo('r.text')}), 'C')"
+            ' FROM recipes_recipe r WHERE r.id = ANY(%s) '
+            'ON CONFLICT (recipe_id) '
+            'DO UPDATE SET document = EXCLUDED.document',
+            [SEARCH_CONFIG] * 3 + [list(recipe_ids)])
+
+    def unindex(self, cursor, recipe_ids):
+        cursor.execute(f'DELETE FROM {self.table} WHERE recipe_id = ANY(%s)',
+                       [list(recipe_ids)])
+
+    def clear(self, cursor):
+        cursor.execute(f'TRUNCATE {self.table}')
+
+
+class SQLiteSearch:
+    """Теневая таблица FTS5 recipes_recipe_fts, rowid совпадает с id.
+
+    Каждое слово запроса ищется как префикс, порядок — по bm25.
+    """
+
+    table = 'recipes_recipe_fts'
+    weights = (10.0, 5.0, 1.0)
+
+    def match(self, query):
+        words = [word.translate(YO).replace('"', '""')
+                 for word in query.split()]
+        return ' '.join(f'"{word}"*' for word in words)
+
+    def filter(self, queryset, query):
+        match = self.match(query)
+        matched = RawSQL(
+            f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s',
+            (match,))
+        weights = ', '.join(map(str, self.weights))
+        rank = RawSQL(
+            f'SELECT bm25({self.table}, {weights}) FROM {self.table} '
+            f'WHERE {self.table} MATCH %s AND rowid = recipes_recipe.id',
+            (match,))
+        return queryset.filter(id__in=matched).annotate(
+            search_rank=rank).order_by('search_rank', '-pub_date', '-id')
+
+    def index(self, cursor, recipe_ids):
+        self.unindex(cursor, recipe_ids)
+        placeholders = ', '.join(['%s'] * len(recipe_ids))
+        cursor.execute(
+            f'INSERT INTO {self.table} (rowid, name, ingredients, text) '
+            f"SELECT r.id, {fold_yo('r.name')}, "
+            f"{ingredient_names('group_concat')}, {fold_yo('r.text')} "
+            f'FROM recipes_recipe r WHERE r.id IN ({placeholders})',
+            list(recipe_ids))
+
+    def unindex(self, cursor, recipe_ids):
+        placeholders = ', '.join(['%s'] * len(recipe_ids))
+        cursor.execute(
+            f'DELETE FROM {self.table} WHERE rowid IN ({placeholders})',
+            list(recipe_ids))
+
+    def clear(self, cursor):
+        cursor.execute(f'DELETE FROM {self.table}')
+
+
+class FallbackSearch:
+    """Поиск без индекса для остальных СУБД."""
+
+    def filter(self, queryset, query):
+        ingredients = IngredientInRecipe.objects.filter(
+            recipe=OuterRef('pk'), ingredient__name__icontains=query)
+        return queryset.filter(
+            Q(name__icontains=query) | Q(text__icontains=query)
+            | Exists(ingredients))
+
+    def index(self, cursor, recipe_ids):
+        pass
+
+    def unindex(self, cursor, recipe_ids):
+        pass
+
+    def clear(self, cursor):
+        pass
+
+
+BACKENDS = {
+    'postgresql': PostgresSearch(),
+    'sqlite': SQLiteSearch(),
+}
+
+
+def get_backend(using):
+    return BACKENDS.get(connections[using].vendor, FallbackSearch())
+
+
+def search_recipes(queryset, query):
+    """Рецепты, подходящие под запрос, от более релевантных к менее."""
+    query = query.strip()
+    if not query:
+        return queryset
+    return get_backend(queryset.db).filter(queryset, query)
+
+
+def index_recipes(recipe_ids, unindex=False):
+    """Обновить (или удалить) записи поискового индекса рецептов."""
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    using = router.db_for_write(Recipe)
+    backend = get_backend(using)
+    with connections[using].cursor() as cursor:
+        if unindex:
+            backend.unindex(cursor, recipe_ids)
+        else:
+            backend.index(cursor, recipe_ids)
+
+
+def rebuild_index(batch_size=2000):
+    """Пересобрать поисковый индекс по всем рецептам."""
+    using = router.db_for_write(Recipe)
+    with connections[using].cursor() as cursor:
+        get_backend(using).clear(cursor)
+    recipe_ids = list(Recipe.objects.order_by().values_list('id', flat=True))
+    for start in range(0, len(recipe_ids), batch_size):
+        index_recipes(recipe_ids[start:start + batch_size])
@@ -1,15 +1,123 @@
-from django.core.files.base import ContentFile
-from django.db import transaction
-from django.shortcuts import get_object_or_404
+import copy
+
+from django.core.files.uploadedfile import UploadedFile
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from djoser.serializers import UserCreateSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
 from rest_framework.serializers import ModelSerializer
 
+from . import shopping
+from .fields import StreamingBase64ImageField
+from .images import variant_urls
 from .models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
                      ShoppingList, Subscribe, Tag, User)
-from backend.constants import (MAX_COOKING_TIME, MAX_INGREDIENTS,
-                               MIN_COOKING_TIME, MIN_INGREDIENTS, )
+from backend.constants import (BULK_RECIPES_LIMIT, MAX_COOKING_TIME,
+                               MAX_INGREDIENTS, MIN_COOKING_TIME,
+                               MIN_INGREDIENTS, )
+
+
+class UniqueCreateMixin:
+    """Создаёт запись одним INSERT, полагаясь на ограничения БД.
+
+    Повторная запись, в том числе от параллельного запроса, превращается
+    в ошибку валидации duplicate_error вместо проверки .exists() заранее.
+    """
+
+    duplicate_error = None
+
+    def create(self, validated_data):
+        try:
+            with transaction.atomic():
+                return super().create(validated_data)
+        except IntegrityError:
+            raise serializers.ValidationError(self.duplicate_error)
+
+
+class CloseUploadsMixin:
+    """Закрывает загруженные файлы после сохранения.
+
+    Временный файл большого изображения перемещается хранилищем в MEDIA,
+    поэтому закрыть его нужно явно, пока он не удалён сборщиком мусора.
+    """
+
+    def save(self, **kwargs):
+        instance = super().save(**kwargs)
+        for value in self.validated_data.values():
+            if isinstance(value, UploadedFile):
+                value.close()
+        return instance
+
+
+class FieldPlanMixin:
+    """Чтение по плану полей, составленному заранее.
+
+    Поля ModelSerializer строятся по модели один раз на класс, каждому
+    экземпляру достаётся их копия. Serializer.to_representation из DRF
+    повторяется без обхода _readable_fields на каждый объект: строковые
+    и целые поля модели читаются прямо из атрибута, а to_representation
+    поля вызывается, только если тип значения не тот. План строится для
+    класса первого объекта, дочерний сериализатор many=True использует
+    его для всей страницы.
+    """
+
+    plan_types = ((serializers.CharField, str),
+                  (serializers.IntegerField, int))
+
+    def get_fields(self):
+        fields = type(self).__dict__.get('field_template')
+        if fields is None:
+            fields = super().get_fields()
+            type(self).field_template = fields
+        return copy.deepcopy(fields)
+
+    def field_plan(self, instance):
+        model = type(instance)
+        plans = self.__dict__.setdefault('field_plans', {})
+        plan = plans.get(model)
+        if plan is None:
+            plan = plans[model] = [
+                (field.field_name, field, *self.direct_attribute(field, model))
+                for field in self._readable_fields
+            ]
+        return plan
+
+    def direct_attribute(self, field, model):
+        """Атрибут и тип значения поля модели или (None, None)."""
+        meta = getattr(model, '_meta', None)
+        if meta is None or len(field.source_attrs) != 1:
+            return None, None
+        attnames = {model_field.attname
+                    for model_field in meta.concrete_fields}
+        if field.source_attrs[0] not in attnames:
+            return None, None
+        for field_class, value_type in self.plan_types:
+            if (type(field).to_representation
+                    is field_class.to_representation):
+                return field.source_attrs[0], value_type
+        return None, None
+
+    def to_representation(self, instance):
+        representation = {}
+        for name, field, attname, value_type in self.field_plan(instance):
+            if attname is not None:
+                value = getattr(instance, attname)
+                if value is not None and type(value) is not value_type:
+                    value = field.to_representation(value)
+                representation[name] = value
+                continue
+            try:
+                attribute = field.get_attribute(instance)
+            except SkipField:
+                continue
+            check_for_none = (attribute.pk if isinstance(
+                attribute, PKOnlyObject) else attribute)
+            representation[name] = (None if check_for_none is None
+                                    else field.to_representation(attribute))
+        return representation
 
 
 class CustomUserCreateSerializer(UserCreateSerializer):
@@ -20,13 +128,15 @@ class CustomUserCreateSerializer(UserCreateSerializer):
         required_fields = ('username', 'first_name', 'last_name')
 
 
-class UserSerializer(UserCreateSerializer):
+class UserSerializer(FieldPlanMixin, UserCreateSerializer):
     is_subscribed = serializers.SerializerMethodField()
 
     def get_is_subscribed(self, obj):
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         return user.subscription_author.filter(subscriber=obj).exists()
 
     class Meta:
@@ -36,19 +146,19 @@ class UserSerializer(UserCreateSerializer):
         required_fields = ('username', 'first_name', 'last_name')
 
 
-class TagSerializer(ModelSerializer):
+class TagSerializer(FieldPlanMixin, ModelSerializer):
     class Meta:
         model = Tag
         fields = ('id', 'name', 'slug')
 
 
-class IngredientSerializer(ModelSerializer):
+class IngredientSerializer(FieldPlanMixin, ModelSerializer):
     class Meta:
         model = Ingredient
         fields = ('id', 'name', 'measurement_unit')
 
 
-class IngredientInRecipeSerializer(ModelSerializer):
+class IngredientInRecipeSerializer(FieldPlanMixin, ModelSerializer):
     amount = serializers.IntegerField(
         required=True,
         min_value=MIN_INGREDIENTS,
@@ -64,46 +174,59 @@ class IngredientInRecipeSerializer(ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
-class RecipeGetSerializer(serializers.ModelSerializer):
+class RecipeGetSerializer(FieldPlanMixin, serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     tags = TagSerializer(many=True)
     ingredients = IngredientInRecipeSerializer(many=True,
                                                source='recipes_ingredients')
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
 
     def to_representation(self, instance):
-        data = super().to_representation(instance)
-        ingredients = instance.recipes_ingredients.all()
-        data['ingredients'] = IngredientInRecipeSerializer(ingredients,
-                                                           many=True).data
-        return data
+        if hasattr(instance, 'is_subscribed'):
+            instance.author.is_subscribed = instance.is_subscribed
+        return super().to_representation(instance)
 
     def get_is_favorited(self, obj):
         request = self.context['request']
-        if request.user.is_authenticated:
-            return request.user.favorite_users.filter(
-                recipes=obj).exists()
-        return False
+        if not request.user.is_authenticated:
+            return False
+        if hasattr(obj, 'is_favorite'):
+            return obj.is_favorite
+        return request.user.favorite_users.filter(recipes=obj).exists()
 
     def get_is_in_shopping_cart(self, obj):
         request = self.context['request']
-        if request.user.is_authenticated:
-            return request.user.shoppinglist_users.filter(
-                recipes=obj).exists()
-        return False
+        if not request.user.is_authenticated:
+            return False
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+        return request.user.shoppinglist_users.filter(recipes=obj).exists()
+
+    def get_image_variants(self, obj):
+        return variant_urls(obj, 'image', 'image_variants',
+                            self.context.get('request'))
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author',
                   'ingredients',
                   'is_favorited',
-                  'is_in_shopping_cart', 'name', 'image', 'text',
-                  'cooking_time')
+                  'is_in_shopping_cart', 'name', 'image', 'image_variants',
+                  'text', 'cooking_time')
 
 
-class RecipeWriteSerializer(RecipeGetSerializer):
-    image = Base64ImageField(required=True)
+class IngredientAmountSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    amount = serializers.IntegerField(
+        min_value=MIN_INGREDIENTS,
+        max_value=MAX_INGREDIENTS
+    )
+
+
+class RecipeWriteSerializer(CloseUploadsMixin, RecipeGetSerializer):
+    image = StreamingBase64ImageField(required=True)
     is_favorited = serializers.BooleanField(default=False)
     is_in_shopping_cart = serializers.BooleanField(default=False)
     cooking_time = serializers.IntegerField(
@@ -111,44 +234,34 @@ class RecipeWriteSerializer(RecipeGetSerializer):
         min_value=MIN_COOKING_TIME,
         max_value=MAX_COOKING_TIME
     )
-    ingredients = IngredientInRecipeSerializer(many=True,
-                                               source='recipes_ingredients')
-    tags = serializers.PrimaryKeyRelatedField(queryset=Tag.objects.all(),
-                                              many=True)
+    ingredients = IngredientAmountSerializer(many=True, write_only=True)
+    tags = serializers.ListField(child=serializers.IntegerField(),
+                                 write_only=True)
 
     def validate(self, data):
         data = super().validate(data)
-        request = self.context['request']
-        get_tags = request.data.get('tags')
-        if not get_tags:
+        tags = data.get('tags')
+        if not tags:
             raise serializers.ValidationError(
                 {'tags': ['Обязательное поле.']})
-        tags_data = set()
-        for tag_data in get_tags:
-            try:
-                tag = Tag.objects.get(pk=tag_data)
-                if tag in tags_data:
-                    raise serializers.ValidationError(
-                        {'tags': ['Такой тэг уже есть.']})
-                tags_data.add(tag)
-            except Tag.DoesNotExist:
-                raise serializers.ValidationError(
-                    {'Tag': ['Такого тэга нет.']})
-        get_ingredients = request.data.get('ingredients')
-        if not get_ingredients:
+        if len(set(tags)) != len(tags):
+            raise serializers.ValidationError(
+                {'tags': ['Такой тэг уже есть.']})
+        if Tag.objects.filter(id__in=tags).count() != len(tags):
+            raise serializers.ValidationError(
+                {'tags': ['Такого тэга нет.']})
+        ingredients = data.get('ingredients')
+        if not ingredients:
             raise serializers.ValidationError(
                 {'ingredients': ['Обязательное поле.']})
-        ingredients_set = set()
-        for ingredient in get_ingredients:
-            if ingredient['id'] in ingredients_set:
-                raise serializers.ValidationError(
-                    {'ingredients': ['Такой id занят.']})
-            ingredients_set.add(ingredient['id'])
-            try:
-                Ingredient.objects.get(id=ingredient['id'])
-            except Ingredient.DoesNotExist:
-                raise serializers.ValidationError(
-                    {'ingredients': ['Такого ингредиента нет.']})
+        ingredient_ids = [ingredient['id'] for ingredient in ingredients]
+        if len(set(ingredient_ids)) != len(ingredient_ids):
+            raise serializers.ValidationError(
+                {'ingredients': ['Такой id занят.']})
+        if (Ingredient.objects.filter(id__in=ingredient_ids).count()
+                != len(ingredient_ids)):
+            raise serializers.ValidationError(
+                {'ingredients': ['Такого ингредиента нет.']})
         return data
 
     def validate_image(self, value):
@@ -157,26 +270,60 @@ class RecipeWriteSerializer(RecipeGetSerializer):
         return value
 
     def create_ingredients(self, ingredients_data, recipe):
-        for ingredient_data in ingredients_data:
-            ingredient_id = ingredient_data['id']
-            ingredient = Ingredient.objects.get(pk=ingredient_id)
-            amount = ingredient_data['amount']
-            IngredientInRecipe.objects.create(
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(
                 recipe=recipe,
-                ingredient=ingredient,
-                amount=amount
+                ingredient_id=ingredient_data['id'],
+                amount=ingredient_data['amount']
             )
+            for ingredient_data in ingredients_data
+        )
+        return recipe
+
+    def update_ingredients(self, ingredients_data, recipe):
+        """Записать только изменившиеся ингредиенты рецепта.
+
+        Разница количеств переносится в списки покупок корзин с рецептом;
+        удалённые строки учитывает сигнал post_delete.
+        """
+        amounts = {item['id']: item['amount'] for item in ingredients_data}
+        current = {
+            item.ingredient_id: item
+            for item in recipe.recipes_ingredients.all()
+        }
+        deltas = {
+            ingredient_id: amount - getattr(current.get(ingredient_id),
+                                            'amount', 0)
+            for ingredient_id, amount in amounts.items()
+        }
+        removed = current.keys() - amounts.keys()
+        if removed:
+            recipe.recipes_ingredients.filter(
+                ingredient_id__in=removed).delete()
+        changed = []
+        for ingredient_id, item in current.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and item.amount != amount:
+                item.amount = amount
+                changed.append(item)
+        if changed:
+            IngredientInRecipe.objects.bulk_update(changed, ['amount'])
+        self.create_ingredients(
+            [item for item in ingredients_data
+             if item['id'] not in current],
+            recipe
+        )
+        shopping.change_recipe(
+            recipe.pk, {key: value for key, value in deltas.items() if value})
         return recipe
 
     @transaction.atomic
     def update(self, instance, validated_data):
-        validated_data.pop('recipes_ingredients')
+        ingredients = validated_data.pop('ingredients')
         tags_data = validated_data.pop('tags')
         super().update(instance, validated_data)
         instance.tags.set(tags_data)
-        instance.ingredients.clear()
-        ingredients = self.initial_data.get('ingredients')
-        self.create_ingredients(ingredients, instance)
+        self.update_ingredients(ingredients, instance)
         return instance
 
     @transaction.atomic
@@ -184,21 +331,23 @@ class RecipeWriteSerializer(RecipeGetSerializer):
         validated_data.pop('is_favorited', None)
         validated_data.pop('is_in_shopping_cart', None)
         tags_data = validated_data.pop('tags')
-        validated_data.pop('recipes_ingredients')
+        ingredients = validated_data.pop('ingredients')
         recipe = Recipe.objects.create(**validated_data)
-        ingredients = self.initial_data.get('ingredients')
         self.create_ingredients(ingredients, recipe)
         recipe.tags.set(tags_data)
         return recipe
 
     def to_representation(self, instance):
-        data = super().to_representation(instance)
-        data['tags'] = TagSerializer(instance.tags.all(), many=True).data
-        data['is_favorited'] = self.get_is_favorited(instance)
-        return data
+        prefetch_related_objects(
+            [instance], 'tags',
+            Prefetch('recipes_ingredients',
+                     queryset=IngredientInRecipe.objects.select_related(
+                         'ingredient'))
+        )
+        return RecipeGetSerializer(instance, context=self.context).data
 
 
-class UserWithRecipeSerializer(serializers.Serializer):
+class UserWithRecipeSerializer(FieldPlanMixin, serializers.Serializer):
     id = serializers.IntegerField()
     email = serializers.EmailField()
     username = serializers.CharField()
@@ -207,18 +356,19 @@ class UserWithRecipeSerializer(serializers.Serializer):
     avatar = Base64ImageField()
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.IntegerField(read_only=True)
 
     def get_is_subscribed(self, obj):
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         return user.subscription_author.filter(subscriber=obj).exists()
 
-    def get_recipes_count(self, obj):
-        return obj.recipe.all().count()
-
     def get_recipes(self, obj):
+        if hasattr(obj, 'page_recipes'):
+            return ShortRecipeSerializer(obj.page_recipes, many=True).data
         recipes_limit = self.context['request'].query_params.get(
             'recipes_limit', None)
         if recipes_limit:
@@ -233,25 +383,22 @@ class UserWithRecipeSerializer(serializers.Serializer):
                   'avatar', 'is_subscribed', 'recipes', 'recipes_count')
 
 
-class SubscribeSerializer(serializers.ModelSerializer):
+class SubscribeSerializer(UniqueCreateMixin, serializers.ModelSerializer):
     subscriber = UserSerializer(read_only=True)
 
     def to_representation(self, instance):
         return UserWithRecipeSerializer(
             instance.subscriber, context=self.context).data
 
+    duplicate_error = {
+        'non_field_errors': ['Вы подписались на пользователя ранее.']}
+
     def validate(self, data):
         request = self.context['request']
         user_id = self.context['view'].kwargs.get('id')
-        user = get_object_or_404(User, pk=user_id)
-        if request.user == user:
+        if str(request.user.pk) == str(user_id):
             raise serializers.ValidationError(
                 {'subscriber': ['На себя не подписаться.']})
-        if (request.method == 'POST' and request.user.subscription_author
-                .filter(subscriber=user).exists()):
-            raise serializers.ValidationError(
-                {'non_field_errors': [
-                    'Вы подписались на пользователя ранее.']})
         return data
 
     class Meta:
@@ -259,24 +406,29 @@ class SubscribeSerializer(serializers.ModelSerializer):
         fields = ('subscriber',)
 
 
-class ShortRecipeSerializer(serializers.ModelSerializer):
+class ShortRecipeSerializer(FieldPlanMixin,
+                            serializers.ModelSerializer):
     id = serializers.IntegerField()
     name = serializers.CharField()
     image = Base64ImageField()
+    image_variants = serializers.SerializerMethodField()
     cooking_time = serializers.IntegerField()
 
+    def get_image_variants(self, obj):
+        return variant_urls(obj, 'image', 'image_variants',
+                            self.context.get('request'))
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
 
-class AvatarSerializer(serializers.ModelSerializer):
-    avatar = Base64ImageField(required=True)
+class AvatarSerializer(CloseUploadsMixin, serializers.ModelSerializer):
+    avatar = StreamingBase64ImageField(required=True)
 
     def update(self, instance, validated_data):
         avatar_data = validated_data.get('avatar', None)
-        file_avatar = ContentFile(avatar_data.read())
-        instance.avatar.save('image.png', file_avatar, save=True)
+        instance.avatar.save(avatar_data.name, avatar_data, save=True)
         return instance
 
     def validate_avatar(self, avatar_data):
@@ -289,42 +441,33 @@ class AvatarSerializer(serializers.ModelSerializer):
         fields = ('avatar',)
 
 
-class ShoppingListSerializer(serializers.ModelSerializer):
+class ShoppingListSerializer(UniqueCreateMixin, serializers.ModelSerializer):
     recipes = RecipeGetSerializer(read_only=True)
+    duplicate_error = {'recipes': ['Рецепт уже в корзине.']}
 
     def to_representation(self, instance):
         return ShortRecipeSerializer(
             instance.recipes, context=self.context).data
 
-    def validate(self, data):
-        request = self.context['request']
-        recipe_id = self.context['view'].kwargs.get('pk')
-        recipe = get_object_or_404(Recipe, pk=recipe_id)
-        if request.method == 'POST' and request.user.shoppinglist_users.filter(
-                recipes=recipe).exists():
-            raise serializers.ValidationError(
-                {'recipes': ['Рецепт уже в корзине.']})
-        return data
-
     class Meta:
         model = ShoppingList
         fields = ('recipes',)
         read_only_fields = ('user', 'recipes')
 
 
-class FavoriteSerializer(ShoppingListSerializer):
-    def validate(self, data):
-        request = self.context['request']
-        recipe_id = self.context['view'].kwargs.get('pk')
-        if not Recipe.objects.filter(pk=recipe_id).exists():
-            raise serializers.ValidationError(
-                {'recipes': ['Такого рецепта нет.']})
-        if request.method == 'POST' and request.user.favorite_users.filter(
-                recipes__id=recipe_id).exists():
-            raise serializers.ValidationError(
-                {'recipes': ['Рецепт уже в избранном.']})
+class RecipeIdsSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BULK_RECIPES_LIMIT,
+    )
 
-        return data
+    def validate_recipes(self, value):
+        return list(dict.fromkeys(value))
+
+
+class FavoriteSerializer(ShoppingListSerializer):
+    duplicate_error = {'recipes': ['Рецепт уже в избранном.']}
 
     class Meta:
         model = Favorite
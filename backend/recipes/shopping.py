@@ -0,0 +1,113 @@
+from collections import Counter, defaultdict
+
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+
+from backend.constants import SHOP_LIST_CHUNK_SIZE
+
+from .models import IngredientInRecipe, ShoppingList, ShoppingListItem
+
+
+def recipe_amounts(recipe_ids, sign=1):
+    """Суммарное количество каждого ингредиента в рецептах recipe_ids."""
+    return {
+        ingredient_id: sign * total
+        for ingredient_id, total in IngredientInRecipe.objects.filter(
+            recipe__in=recipe_ids
+        ).order_by().values('ingredient').annotate(
+            total=Sum('amount')).values_list('ingredient', 'total')
+    }
+
+
+def apply(user_ids, deltas):
+    """Изменить количества в списках покупок пользователей на deltas.
+
+    deltas — {id ингредиента: изменение}. Недостающие строки сначала
+    вставляются с нулём (ignore_conflicts), затем все количества меняются
+    одним UPDATE, поэтому параллельные изменения не теряются и не
+    упираются в ограничение уникальности. Обнулившиеся строки удаляются.
+    """
+    deltas = {key: value for key, value in deltas.items() if value}
+    if not user_ids or not deltas:
+        return
+    ShoppingListItem.objects.bulk_create(
+        [ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id)
+         for user_id in user_ids
+         for ingredient_id, delta in deltas.items() if delta > 0],
+        ignore_conflicts=True,
+    )
+    items = ShoppingListItem.objects.filter(user__in=user_ids,
+                                            ingredient__in=deltas)
+    items.update(amount=F('amount') + Case(
+        *[When(ingredient=ingredient_id, then=Value(delta))
+          for ingredient_id, delta in deltas.items()],
+        output_field=IntegerField(),
+    ))
+    items.filter(amount__lte=0).delete()
+
+
+def add(user_id, recipe_ids):
+    """Учесть рецепты, добавленные в корзину пользователя."""
+    apply([user_id], recipe_amounts(recipe_ids))
+
+
+def remove(user_id, recipe_ids):
+    """Учесть рецепты, убранные из корзины пользователя."""
+    apply([user_id], recipe_amounts(recipe_ids, sign=-1))
+
+
+def change_recipe(recipe_id, deltas):
+    """Учесть изменение ингредиентов рецепта во всех корзинах с ним."""
+    if not deltas:
+        return
+    apply(list(ShoppingList.objects.filter(
+        recipes=recipe_id).values_list('user_id', flat=True)), deltas)
+
+
+def change_row(before=None, after=None):
+    """Учесть изменение одной строки ингредиента рецепта во всех корзинах.
+
+    before и after — (id рецепта, id ингредиента, количество) до и после
+    изменения; None для созданной или удалённой строки.
+    """
+    deltas = defaultdict(Counter)
+    if before:
+        recipe_id, ingredient_id, amount = before
+        deltas[recipe_id][ingredient_id] -= amount
+    if after:
+        recipe_id, ingredient_id, amount = after
+        deltas[recipe_id][ingredient_id] += amount
+    for recipe_id, recipe_deltas in deltas.items():
+        change_recipe(recipe_id, {key: value for key, value
+                                  in recipe_deltas.items() if value})
+
+
+def items(user):
+    """Строки (название, единица измерения, количество) списка покупок."""
+    return ShoppingListItem.objects.filter(user=user).values_list(
+        'ingredient__name', 'ingredient__measurement_unit', 'amount'
+    ).order_by(
+        'ingredient__name', 'ingredient__measurement_unit'
+    ).iterator(chunk_size=SHOP_LIST_CHUNK_SIZE)
+
+
+def rebuild(user_ids=None, batch_size=2000):
+    """Пересчитать списки покупок по корзинам (всех или user_ids)."""
+    stale = ShoppingListItem.objects.all()
+    carts = ShoppingList.objects.all()
+    if user_ids is not None:
+        stale = stale.filter(user__in=user_ids)
+        carts = carts.filter(user__in=user_ids)
+    stale.delete()
+    rows = carts.order_by().values(
+        'user', 'recipes__recipes_ingredients__ingredient'
+    ).annotate(
+        total=Sum('recipes__recipes_ingredients__amount')
+    ).filter(total__gt=0).values_list(
+        'user', 'recipes__recipes_ingredients__ingredient', 'total')
+    ShoppingListItem.objects.bulk_create(
+        (ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                          amount=total)
+         for user_id, ingredient_id, total in rows.iterator(
+             chunk_size=batch_size)),
+        batch_size=batch_size,
+    )
@@ -0,0 +1,175 @@
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from backend.constants import RECIPE_AUTHOR_FIELDS
+
+from . import feed, shopping
+from .cache import bump_version, bump_versions
+from .counters import update_counter
+from .coverage import record_change
+from .images import schedule_variants
+from .search import index_recipes
+from .models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                     ShoppingList, Subscribe, Tag, User)
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_reference_cache(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version(sender))
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def invalidate_recipes(sender, instance, **kwargs):
+    recipe_id = instance.pk
+    transaction.on_commit(lambda: bump_version(Recipe))
+    transaction.on_commit(lambda: bump_version(Recipe, scope=recipe_id))
+    transaction.on_commit(lambda: bump_version(IngredientInRecipe))
+
+
+def author_data(values):
+    # Пустой аватар в БД — '', а в ещё не перечитанном объекте — None.
+    return tuple(value or '' for value in values)
+
+
+@receiver(pre_save, sender=User)
+def remember_author_data(sender, instance, raw=False, update_fields=None,
+                         **kwargs):
+    instance.author_data_before = None
+    if (raw or instance.pk is None
+            or (update_fields is not None
+                and not set(update_fields) & set(RECIPE_AUTHOR_FIELDS))):
+        return
+    before = User.objects.filter(pk=instance.pk).values_list(
+        *RECIPE_AUTHOR_FIELDS).first()
+    instance.author_data_before = before and author_data(before)
+
+
+@receiver(post_save, sender=User)
+def invalidate_author(sender, instance, **kwargs):
+    # Пароль, last_login и прочие поля в рецептах не выводятся: сбрасываются
+    # только рецепты автора, и только если изменились его данные в них.
+    before = getattr(instance, 'author_data_before', None)
+    if before is None or before == author_data(
+            getattr(instance, field) for field in RECIPE_AUTHOR_FIELDS):
+        return
+    recipe_ids = list(Recipe.objects.filter(author=instance).values_list(
+        'pk', flat=True))
+    if recipe_ids:
+        transaction.on_commit(lambda: bump_version(Recipe))
+        transaction.on_commit(lambda: bump_versions(Recipe, recipe_ids))
+
+
+@receiver([post_save, post_delete], sender=Favorite)
+@receiver([post_save, post_delete], sender=ShoppingList)
+@receiver([post_save, post_delete], sender=Subscribe)
+def invalidate_user_relations(sender, instance, **kwargs):
+    transaction.on_commit(
+        lambda: bump_version(User, scope=instance.user_id))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingList)
+@receiver(post_save, sender=Subscribe)
+def increment_counter(sender, instance, created, **kwargs):
+    if created:
+        update_counter(sender, instance, 1)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingList)
+@receiver(post_delete, sender=Subscribe)
+def decrement_counter(sender, instance, **kwargs):
+    update_counter(sender, instance, -1)
+
+
+@receiver(post_save, sender=ShoppingList)
+def add_to_shopping_list(sender, instance, created, **kwargs):
+    if created:
+        shopping.add(instance.user_id, [instance.recipes_id])
+
+
+@receiver(pre_delete, sender=ShoppingList)
+def remove_from_shopping_list(sender, instance, **kwargs):
+    # pre_delete: при удалении рецепта его ингредиенты удаляются раньше,
+    # чем отправляется post_delete для записей корзины.
+    shopping.remove(instance.user_id, [instance.recipes_id])
+
+
+@receiver(pre_save, sender=IngredientInRecipe)
+def remember_ingredient_row(sender, instance, raw=False, **kwargs):
+    instance.shopping_before = None if raw or instance.pk is None else (
+        IngredientInRecipe.objects.filter(pk=instance.pk).values_list(
+            'recipe_id', 'ingredient_id', 'amount').first())
+
+
+@receiver(post_save, sender=IngredientInRecipe)
+def change_shopping_lists(sender, instance, raw=False, **kwargs):
+    # Сериализатор пишет строки через bulk_create и bulk_update и сам
+    # переносит разницу в списки покупок; сюда попадают админка и shell.
+    if raw:
+        return
+    shopping.change_row(
+        getattr(instance, 'shopping_before', None),
+        (instance.recipe_id, instance.ingredient_id, instance.amount))
+
+
+@receiver(post_delete, sender=IngredientInRecipe)
+def remove_from_shopping_lists(sender, instance, origin=None, **kwargs):
+    # Если удаляется сам рецепт (или его автор), его записи корзин удаляются
+    # вместе с ним и списки покупок уже поправил remove_from_shopping_list.
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if model in (IngredientInRecipe, Ingredient):
+        shopping.change_row(
+            (instance.recipe_id, instance.ingredient_id, instance.amount))
+
+
+@receiver(post_save, sender=Recipe)
+def prepare_image_variants(sender, instance, **kwargs):
+    if (instance.image
+            and instance.image_variants.get('source') != instance.image.name):
+        schedule_variants(instance, 'image', 'image_variants')
+
+
+@receiver(post_save, sender=Subscribe)
+def backfill_feed(sender, instance, created, **kwargs):
+    if created:
+        feed.backfill(instance)
+
+
+@receiver(post_delete, sender=Subscribe)
+def clear_feed(sender, instance, **kwargs):
+    feed.remove(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def index_recipe(sender, instance, **kwargs):
+    transaction.on_commit(lambda: index_recipes([instance.pk]))
+
+
+@receiver(post_delete, sender=Recipe)
+def unindex_recipe(sender, instance, **kwargs):
+    index_recipes([instance.pk], unindex=True)
+
+
+@receiver(post_save, sender=Ingredient)
+def reindex_ingredient_recipes(sender, instance, created, **kwargs):
+    if created:
+        return
+    recipe_ids = list(IngredientInRecipe.objects.filter(
+        ingredient=instance).values_list('recipe_id', flat=True))
+    transaction.on_commit(lambda: index_recipes(recipe_ids))
+
+
+@receiver([post_save, post_delete], sender=IngredientInRecipe)
+@receiver([post_save, post_delete], sender=Recipe)
+def update_coverage(sender, instance, **kwargs):
+    # Запись в той же транзакции: номер журнала фиксируется вместе
+    # с изменением (см. coverage.record_change).
+    record_change(instance.recipe_id if sender is IngredientInRecipe
+                  else instance.pk)
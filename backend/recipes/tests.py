@@ -0,0 +1,1192 @@
+import base64
+import datetime
+import decimal
+import json
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+from itertools import count, product
+from inspect import iscoroutinefunction
+from pathlib import Path
+from types import ModuleType
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import (AsyncClient, Client, RequestFactory, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, resolve
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from PIL import Image
+from rest_framework import renderers
+from rest_framework.authtoken.models import Token
+from rest_framework.routers import DefaultRouter
+from rest_framework.serializers import BaseSerializer
+from rest_framework.test import APIClient
+
+from backend.constants import IMAGE_VARIANT_SIZES
+
+from . import coverage, feed, images, relations, replicas, shopping
+from . import cache as cache_module
+from .cache import local_cache, local_versions
+from .filters import RecipeFilter
+from .models import (Favorite, FeedEntry, Ingredient, IngredientInRecipe,
+                     Recipe, ShoppingList, ShoppingListItem, Subscribe, Tag,
+                     User)
+from .renderers import JSONRenderer
+from .search import rebuild_index, search_recipes
+from .serializers import FieldPlanMixin
+from .views import IngredientViewSet, RecipeViewSet, TagViewSet, UserViewSet
+
+recipe_numbers = count()
+
+
+def png_bytes(size=(1200, 800)):
+    buffer = BytesIO()
+    Image.new('RGB', size, 'orange').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class FoodgramTestMixin:
+    """Пользователи, рецепты, чистый кэш и MEDIA_ROOT для каждого теста."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        local_cache.clear()
+        local_versions.clear()
+        coverage.recipe_coverage.clear()
+        self.addCleanup(cache.clear)
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        default_storage.save('recipes/test.png', BytesIO(png_bytes()))
+
+    def create_user(self, username):
+        return User.objects.create(
+            username=username, email=f'{username}@foodgram.io',
+            first_name=username, last_name=username)
+
+    def create_recipes(self, author, number, tags=(), ingredients=()):
+        recipes = []
+        for _ in range(number):
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {next(recipe_numbers)}',
+                text='Текст', image='recipes/test.png', cooking_time=10)
+            recipe.tags.set(tags)
+            IngredientInRecipe.objects.bulk_create(
+                IngredientInRecipe(recipe=recipe, ingredient=ingredient,
+                                   amount=10)
+                for ingredient in ingredients)
+            recipes.append(recipe)
+        return recipes
+
+    def client_for(self, user=None):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        return client
+
+
+class RecipeQueriesTest(FoodgramTestMixin, TestCase):
+    """Число запросов к БД не зависит от числа рецептов на странице."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.reader = self.create_user('reader')
+        self.tags = [Tag.objects.create(name=f'tag{number}',
+                                        slug=f'tag{number}')
+                     for number in range(3)]
+        self.ingredients = [
+            Ingredient.objects.create(name=f'ingredient{number}',
+                                      measurement_unit='г')
+            for number in range(4)]
+        self.recipe, = self.create_recipes(
+            self.author, 1, self.tags, self.ingredients)
+
+    def assert_constant_queries(self, client, url, count):
+        with self.assertNumQueries(count):
+            self.assertEqual(client.get(url).status_code, 200)
+        self.create_recipes(self.author, 5, self.tags, self.ingredients)
+        cache.clear()
+        with self.assertNumQueries(count):
+            self.assertEqual(client.get(url).status_code, 200)
+
+    def test_list_anonymous(self):
+        self.assert_constant_queries(
+            self.client_for(), '/api/recipes/', 4)
+
+    def test_list_authenticated(self):
+        self.assert_constant_queries(
+            self.client_for(self.reader), '/api/recipes/', 4)
+
+    def test_detail_anonymous(self):
+        self.assert_constant_queries(
+            self.client_for(), f'/api/recipes/{self.recipe.pk}/', 3)
+
+    def test_detail_authenticated(self):
+        self.assert_constant_queries(
+            self.client_for(self.reader),
+            f'/api/recipes/{self.recipe.pk}/', 3)
+
+
+class RecipeUpdateTest(FoodgramTestMixin, TestCase):
+    """PATCH рецепта пишет только изменившиеся ингредиенты."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.tag = Tag.objects.create(name='Обед', slug='lunch')
+        self.kept, self.changed, self.removed, self.added = [
+            Ingredient.objects.create(name=f'ingredient{number}',
+                                      measurement_unit='г')
+            for number in range(4)]
+        self.recipe, = self.create_recipes(
+            self.author, 1, [self.tag],
+            [self.kept, self.changed, self.removed])
+
+    def test_patch_writes_difference(self):
+        kept_row = IngredientInRecipe.objects.get(ingredient=self.kept)
+        # Включая выборку удаляемых строк для сигналов, две записи в журнал
+        # покрытия и поиск корзин с рецептом для удалённого ингредиента.
+        with self.assertNumQueries(21):
+            response = self.client_for(self.author).patch(
+                f'/api/recipes/{self.recipe.pk}/', {
+                    'tags': [self.tag.pk],
+                    'ingredients': [
+                        {'id': self.kept.pk, 'amount': 10},
+                        {'id': self.changed.pk, 'amount': 20},
+                        {'id': self.added.pk, 'amount': 5},
+                    ],
+                }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            dict(self.recipe.recipes_ingredients.values_list(
+                'ingredient_id', 'amount')),
+            {self.kept.pk: 10, self.changed.pk: 20, self.added.pk: 5})
+        self.assertTrue(IngredientInRecipe.objects.filter(
+            pk=kept_row.pk, amount=10).exists())
+        self.assertEqual(
+            {item['id']: item['amount']
+             for item in response.json()['ingredients']},
+            {self.kept.pk: 10, self.changed.pk: 20, self.added.pk: 5})
+
+
+def async_urlconf():
+    """URL API, собранные с включённым ASYNC_READ_VIEWS.
+
+    AsyncReadMixin.as_view читает настройку при сборке URL, поэтому
+    модуль recipes.urls собран без неё.
+    """
+    with override_settings(ASYNC_READ_VIEWS=True):
+        router = DefaultRouter()
+        router.register('users', UserViewSet)
+        router.register('recipes', RecipeViewSet)
+        router.register('tags', TagViewSet)
+        router.register('ingredients', IngredientViewSet)
+        urlconf = ModuleType('async_urls')
+        urlconf.urlpatterns = [path('api/', include(router.urls))]
+    return urlconf
+
+
+class AsyncReadViewsTest(FoodgramTestMixin, TestCase):
+    """Асинхронные представления отвечают так же, как синхронные."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.reader = self.create_user('reader')
+        self.tag = Tag.objects.create(name='Обед', slug='lunch')
+        ingredients = [Ingredient.objects.create(name=name,
+                                                 measurement_unit='г')
+                       for name in ('соль', 'сахар', 'мука')]
+        self.recipes = self.create_recipes(
+            self.author, 3, [self.tag], ingredients)
+        Favorite.objects.create(user=self.reader, recipes=self.recipes[0])
+        ShoppingList.objects.create(user=self.reader, recipes=self.recipes[1])
+        Subscribe.objects.create(user=self.reader, subscriber=self.author)
+        self.token = Token.objects.create(user=self.reader).key
+        self.urlconf = async_urlconf()
+        patcher = mock.patch.object(
+            cache_module, 'time',
+            mock.Mock(time_ns=lambda: 10 ** 18, monotonic=time.monotonic))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, url, user=None, asynchronous=False):
+        # Чистый кэш, чтобы ответ строило само представление; версии
+        # после очистки те же, поэтому совпадают и ETag.
+        cache.clear()
+        local_cache.clear()
+        local_versions.clear()
+        headers = {'Authorization': f'Token {self.token}'} if user else {}
+        if not asynchronous:
+            return Client().get(url, headers=headers)
+        with override_settings(ROOT_URLCONF=self.urlconf):
+            self.assertTrue(iscoroutinefunction(resolve(
+                url.split('?')[0]).func))
+
+            async def get():
+                return await AsyncClient().get(url, headers=headers)
+
+            return async_to_sync(get)()
+
+    def assert_same(self, url, user=None):
+        expected = self.get(url, user)
+        response = self.get(url, user, asynchronous=True)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response['Content-Type'], expected['Content-Type'])
+        self.assertEqual(response.get('ETag'), expected.get('ETag'))
+        self.assertEqual(response.content, expected.content)
+
+    def test_recipe_list(self):
+        for user in (None, self.reader):
+            with self.subTest(user=user):
+                self.assert_same('/api/recipes/', user)
+                self.assert_same('/api/recipes/?limit=2', user)
+                self.assert_same(
+                    f'/api/recipes/?tags={self.tag.slug}&is_favorited=1',
+                    user)
+
+    def test_recipe_detail(self):
+        for user in (None, self.reader):
+            with self.subTest(user=user):
+                self.assert_same(f'/api/recipes/{self.recipes[0].pk}/', user)
+                self.assert_same(f'/api/recipes/{self.recipes[1].pk}/', user)
+                self.assert_same('/api/recipes/999999/', user)
+
+    def test_references_and_subscriptions(self):
+        self.assert_same('/api/tags/')
+        self.assert_same(f'/api/tags/{self.tag.pk}/')
+        self.assert_same('/api/ingredients/?name=са')
+        self.assert_same('/api/users/subscriptions/', self.reader)
+        self.assert_same('/api/users/subscriptions/')
+
+
+class DownloadShoppingCartTest(FoodgramTestMixin, TestCase):
+    """Формат списка покупок выбирается по Accept и ?format=.
+
+    Фронтенд не передаёт Accept, поэтому по умолчанию должен остаться CSV.
+    """
+
+    url = '/api/recipes/download_shopping_cart/'
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('user')
+        ingredients = [
+            Ingredient.objects.create(name='Соль', measurement_unit='г'),
+            Ingredient.objects.create(name='Мука', measurement_unit='кг')]
+        recipe, = self.create_recipes(self.user, 1, ingredients=ingredients)
+        ShoppingList.objects.create(user=self.user, recipes=recipe)
+
+    def download(self, *args, **kwargs):
+        response = self.client_for(self.user).get(self.url, *args, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return (response['Content-Type'], response['Content-Disposition'],
+                b''.join(response.streaming_content).decode())
+
+    def assert_csv(self, *args, **kwargs):
+        content_type, disposition, body = self.download(*args, **kwargs)
+        self.assertEqual(content_type, 'text/csv; charset=utf-8')
+        self.assertEqual(disposition,
+                         'attachment; filename="shopping_cart.csv"')
+        self.assertEqual(body.splitlines(), [
+            'Ингредиент,Единица измерения,Количество',
+            'Мука,кг,10', 'Соль,г,10'])
+
+    def test_csv_by_default(self):
+        self.assert_csv()
+        self.assert_csv(HTTP_ACCEPT='*/*')
+        self.assert_csv({'format': 'csv'})
+
+    def test_txt(self):
+        for args, kwargs in ((({'format': 'txt'},), {}),
+                             ((), {'HTTP_ACCEPT': 'text/plain'})):
+            content_type, disposition, body = self.download(*args, **kwargs)
+            self.assertEqual(content_type, 'text/plain; charset=utf-8')
+            self.assertIn('shopping_cart.txt', disposition)
+            self.assertEqual(body, 'Мука (кг) — 10\nСоль (г) — 10\n')
+
+    def test_json(self):
+        for args, kwargs in ((({'format': 'json'},), {}),
+                             ((), {'HTTP_ACCEPT': 'application/json'})):
+            content_type, disposition, body = self.download(*args, **kwargs)
+            self.assertEqual(content_type, 'application/json; charset=utf-8')
+            self.assertIn('shopping_cart.json', disposition)
+            self.assertEqual(json.loads(body), [
+                {'name': 'Мука', 'measurement_unit': 'кг', 'amount': 10},
+                {'name': 'Соль', 'measurement_unit': 'г', 'amount': 10}])
+
+    def test_unknown_format(self):
+        response = self.client_for(self.user).get(
+            self.url, {'format': 'xml'})
+        self.assertEqual(response.status_code, 404)
+
+
+class CursorPaginationTest(FoodgramTestMixin, TestCase):
+    """Keyset-пагинация: ссылки next/previous, порядок и ошибки курсора."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipes = self.create_recipes(self.create_user('author'), 5)
+        # Одинаковое время публикации: порядок держится на id.
+        Recipe.objects.update(pub_date=self.recipes[0].pub_date)
+        self.anonymous = self.client_for()
+
+    def get(self, url, params=None):
+        response = self.anonymous.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def ids(self, page):
+        return [recipe['id'] for recipe in page['results']]
+
+    def test_next_and_previous(self):
+        expected = sorted(recipe.pk for recipe in self.recipes)
+        first = self.get('/api/recipes/', {'cursor': '', 'limit': 2})
+        self.assertIsNone(first['previous'])
+        second = self.get(first['next'])
+        third = self.get(second['next'])
+        self.assertIsNone(third['next'])
+        self.assertEqual(
+            self.ids(first) + self.ids(second) + self.ids(third), expected)
+        self.assertEqual(self.ids(self.get(third['previous'])),
+                         self.ids(second))
+        self.assertEqual(self.ids(self.get(second['previous'])),
+                         self.ids(first))
+
+    def test_invalid_cursor(self):
+        for cursor in ('garbage', 'eyJwIjoieCIsImkiOjF9'):
+            response = self.anonymous.get('/api/recipes/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404)
+
+    def test_count(self):
+        page = self.get('/api/recipes/', {'cursor': ''})
+        self.assertNotIn('count', page)
+        # Оценка берётся из плана PostgreSQL, на SQLite её нет.
+        page = self.get('/api/recipes/', {'cursor': '', 'count': 'approx'})
+        if connection.vendor == 'postgresql':
+            self.assertIsInstance(page['count'], int)
+        else:
+            self.assertNotIn('count', page)
+
+
+class ImageVariantsTest(FoodgramTestMixin, TestCase):
+    """Уменьшенные копии изображения готовятся после коммита."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.tag = Tag.objects.create(name='Обед', slug='lunch')
+        self.ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г')
+
+    def create_recipe(self, image):
+        encoded = base64.b64encode(image).decode()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client_for(self.author).post('/api/recipes/', {
+                'name': 'Рецепт', 'text': 'Текст', 'cooking_time': 10,
+                'tags': [self.tag.pk],
+                'ingredients': [{'id': self.ingredient.pk, 'amount': 5}],
+                'image': f'data:image/png;base64,{encoded}',
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return self.client_for().get(
+            f'/api/recipes/{response.json()["id"]}/').json()
+
+    def test_variants_in_response(self):
+        recipe = self.create_recipe(png_bytes())
+        variants = Recipe.objects.get(pk=recipe['id']).image_variants
+        self.assertEqual(set(recipe['image_variants']),
+                         set(IMAGE_VARIANT_SIZES))
+        for name, size in IMAGE_VARIANT_SIZES.items():
+            self.assertTrue(recipe['image_variants'][name].endswith(
+                default_storage.url(variants[name])))
+            with default_storage.open(variants[name]) as file, \
+                    Image.open(file) as image:
+                self.assertEqual(image.format, 'WEBP')
+                self.assertLessEqual(image.width, size[0])
+                self.assertLessEqual(image.height, size[1])
+
+    def test_broken_image_is_logged(self):
+        recipe, = self.create_recipes(self.author, 1)
+        default_storage.delete(recipe.image.name)
+        default_storage.save(recipe.image.name, BytesIO(b'not an image'))
+        with mock.patch.object(images, 'logger') as logger, \
+                self.captureOnCommitCallbacks(execute=True):
+            recipe.name = 'Новое название'
+            recipe.save()
+        logger.exception.assert_called_once()
+        response = self.client_for().get(f'/api/recipes/{recipe.pk}/')
+        self.assertEqual(response.json()['image_variants'], {})
+
+
+class ByIngredientsTest(FoodgramTestMixin, TestCase):
+    """Подбор рецептов по имеющимся ингредиентам и обновление индекса."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.tag = Tag.objects.create(name='Обед', slug='lunch')
+        self.salt, self.flour, self.egg, self.milk = [
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('Соль', 'Мука', 'Яйцо', 'Молоко')]
+        # Покрытие для (соль, мука): 1, 2/3, 1/2 и 0.
+        self.bread, = self.create_recipes(
+            self.author, 1, ingredients=[self.salt, self.flour])
+        self.pancake, = self.create_recipes(
+            self.author, 1, ingredients=[self.salt, self.flour, self.egg])
+        self.omelette, = self.create_recipes(
+            self.author, 1, ingredients=[self.salt, self.egg])
+        self.create_recipes(self.author, 1, ingredients=[self.milk])
+
+    def top(self, *ingredients, **params):
+        response = self.client_for().get('/api/recipes/by_ingredients/', {
+            'have': ','.join(str(item.pk) for item in ingredients),
+            **params})
+        self.assertEqual(response.status_code, 200)
+        return [(recipe['id'], recipe['matched_ingredients'],
+                 recipe['total_ingredients'])
+                for recipe in response.json()['results']]
+
+    def test_ranking(self):
+        expected = [(self.bread.pk, 2, 2), (self.pancake.pk, 2, 3),
+                    (self.omelette.pk, 1, 2)]
+        self.assertEqual(self.top(self.salt, self.flour), expected)
+        self.assertEqual(self.top(self.salt, self.flour, limit=2),
+                         expected[:2])
+        self.assertEqual(coverage.top_from_db(
+            [self.salt.pk, self.flour.pk], 10), expected)
+
+    def test_ties_prefer_newer_recipes(self):
+        self.assertEqual(
+            [recipe_id for recipe_id, matched, total in self.top(self.egg)],
+            [self.omelette.pk, self.pancake.pk])
+
+    def test_invalid_have(self):
+        for have in ('1,x', 'соль'):
+            response = self.client_for().get(
+                '/api/recipes/by_ingredients/', {'have': have})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('have', response.json())
+        self.assertEqual(self.top(), [])
+
+    def test_recipe_create_edit_delete(self):
+        self.top(self.salt)
+        author = self.client_for(self.author)
+        ingredients = [{'id': self.milk.pk, 'amount': 1},
+                       {'id': self.salt.pk, 'amount': 1}]
+        response = author.post('/api/recipes/', {
+            'name': 'Каша', 'text': 'Текст', 'cooking_time': 10,
+            'tags': [self.tag.pk], 'ingredients': ingredients,
+            'image': 'data:image/png;base64,'
+                     + base64.b64encode(png_bytes((10, 10))).decode(),
+        }, format='json')
+        porridge = response.json()['id']
+        self.assertIn((porridge, 2, 2), self.top(self.milk, self.salt))
+        response = author.patch(f'/api/recipes/{porridge}/', {
+            'tags': [self.tag.pk], 'ingredients': ingredients[:1]},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn((porridge, 1, 1), self.top(self.milk, self.salt))
+        self.assertNotIn(porridge, dict(
+            (recipe_id, matched) for recipe_id, matched, total
+            in self.top(self.salt)))
+        author.delete(f'/api/recipes/{porridge}/')
+        self.assertNotIn(porridge, [
+            recipe_id for recipe_id, matched, total in self.top(self.milk)])
+
+    def test_ingredient_rows_edited_directly(self):
+        self.top(self.salt)
+        # Как в админке: строки рецепта меняются без сохранения рецепта.
+        IngredientInRecipe.objects.create(
+            recipe=self.omelette, ingredient=self.flour, amount=10)
+        self.assertIn((self.omelette.pk, 2, 3),
+                      self.top(self.salt, self.flour))
+        IngredientInRecipe.objects.get(
+            recipe=self.bread, ingredient=self.flour).delete()
+        self.assertIn((self.bread.pk, 1, 1), self.top(self.salt, self.flour))
+        self.flour.delete()
+        self.assertEqual(self.top(self.salt), [
+            (self.bread.pk, 1, 1), (self.omelette.pk, 1, 2),
+            (self.pancake.pk, 1, 2)])
+
+    def test_rebuild_after_invalidate(self):
+        self.top(self.salt)
+        IngredientInRecipe.objects.bulk_create([IngredientInRecipe(
+            recipe=self.omelette, ingredient=self.flour, amount=10)])
+        coverage.invalidate()
+        self.assertIn((self.omelette.pk, 2, 3),
+                      self.top(self.salt, self.flour))
+
+    @override_settings(COVERAGE_WORKERS=1)
+    def test_database_while_building(self):
+        with mock.patch.object(coverage, 'get_executor') as get_executor:
+            results = self.top(self.salt, self.flour)
+            self.top(self.salt)
+        get_executor.return_value.submit.assert_called_once_with(
+            coverage.recipe_coverage.build_in_worker)
+        self.assertEqual(results[0], (self.bread.pk, 2, 2))
+
+
+class CounterFieldsTest(FoodgramTestMixin, TestCase):
+    """save() устаревшей записи не затирает счётчики."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.reader = self.create_user('reader')
+        self.recipe, = self.create_recipes(self.author, 1)
+
+    def test_recipe_save_keeps_counters(self):
+        stale = Recipe.objects.get(pk=self.recipe.pk)
+        Favorite.objects.create(user=self.reader, recipes=self.recipe)
+        stale.name = 'Новое название'
+        stale.save()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.name, 'Новое название')
+        self.assertEqual(self.recipe.favorites_count, 1)
+
+    def test_user_save_keeps_counters(self):
+        stale = User.objects.get(pk=self.author.pk)
+        Subscribe.objects.create(user=self.reader, subscriber=self.author)
+        stale.set_password('new-password')
+        stale.save()
+        self.author.refresh_from_db()
+        self.assertTrue(self.author.check_password('new-password'))
+        self.assertEqual(self.author.subscribers_count, 1)
+        self.assertEqual(self.author.recipes_count, 1)
+
+
+class ConditionalGetTest(FoodgramTestMixin, TestCase):
+    """ETag отвечает 304 без изменений и меняется после правки рецепта."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe, = self.create_recipes(self.create_user('author'), 1)
+        self.reader = self.create_user('reader')
+
+    def assert_revalidates(self, client, url):
+        etag = client.get(url)['ETag']
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.name = 'Новое название'
+            self.recipe.save()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_list(self):
+        self.assert_revalidates(self.client_for(), '/api/recipes/')
+
+    def test_detail(self):
+        self.assert_revalidates(
+            self.client_for(), f'/api/recipes/{self.recipe.pk}/')
+
+    def test_list_authenticated(self):
+        self.assert_revalidates(
+            self.client_for(self.reader), '/api/recipes/')
+
+    def test_detail_authenticated(self):
+        self.assert_revalidates(
+            self.client_for(self.reader), f'/api/recipes/{self.recipe.pk}/')
+
+
+class AuthorInvalidationTest(FoodgramTestMixin, TestCase):
+    """Рецепты сбрасываются только при изменении выводимых данных автора."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.other = self.create_user('other')
+        self.recipe, = self.create_recipes(self.author, 1)
+        self.other_recipe, = self.create_recipes(self.other, 1)
+        self.client = self.client_for()
+
+    def etags(self):
+        return [self.client.get(url)['ETag'] for url in (
+            '/api/recipes/', f'/api/recipes/{self.recipe.pk}/',
+            f'/api/recipes/{self.other_recipe.pk}/')]
+
+    def save_author(self, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            for name, value in fields.items():
+                setattr(self.author, name, value)
+            self.author.save()
+
+    def test_hidden_fields_keep_etags(self):
+        etags = self.etags()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.set_password('new-password')
+            self.author.save()
+            self.author.last_login = timezone.now()
+            self.author.save(update_fields=['last_login'])
+            self.create_user('newcomer')
+        self.assertEqual(self.etags(), etags)
+
+    def test_rendered_fields_reset_author_recipes(self):
+        for fields in ({'first_name': 'Иван'}, {'username': 'chef'},
+                       {'avatar': 'recipes/test.png'}):
+            with self.subTest(fields=fields):
+                list_etag, detail_etag, other_etag = self.etags()
+                self.save_author(**fields)
+                new_list, new_detail, new_other = self.etags()
+                self.assertNotEqual(new_list, list_etag)
+                self.assertNotEqual(new_detail, detail_etag)
+                self.assertEqual(new_other, other_etag)
+        author = self.client.get(
+            f'/api/recipes/{self.recipe.pk}/').json()['author']
+        self.assertEqual((author['first_name'], author['username']),
+                         ('Иван', 'chef'))
+
+    def test_author_without_recipes(self):
+        etags = self.etags()
+        with self.captureOnCommitCallbacks(execute=True):
+            reader = self.create_user('reader')
+            reader.first_name = 'Пётр'
+            reader.save()
+        self.assertEqual(self.etags(), etags)
+
+
+class RendererCompatibilityTest(FoodgramTestMixin, TestCase):
+    """orjson и план полей дают те же байты, что DRF без них."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.reader = self.create_user('reader')
+        self.author.avatar = 'recipes/test.png'
+        self.author.save()
+        tags = [Tag.objects.create(name='Обед', slug='lunch'),
+                Tag.objects.create(name='Ужин', slug='dinner')]
+        ingredients = [Ingredient.objects.create(name=name,
+                                                 measurement_unit='г')
+                       for name in ('соль', 'мука "высший сорт"')]
+        self.recipes = self.create_recipes(self.author, 3, tags, ingredients)
+        Recipe.objects.filter(pk=self.recipes[0].pk).update(
+            name='Рецепт\u2028с разделителем', text='<script>"\\"</script>',
+            image_variants={'source': 'recipes/test.png', **{
+                name: f'recipes/variants/test-{name}.webp'
+                for name in IMAGE_VARIANT_SIZES}})
+        Favorite.objects.create(user=self.reader, recipes=self.recipes[0])
+        ShoppingList.objects.create(user=self.reader, recipes=self.recipes[1])
+        Subscribe.objects.create(user=self.reader, subscriber=self.author)
+
+    def get(self, url, user):
+        cache.clear()
+        local_cache.clear()
+        local_versions.clear()
+        response = self.client_for(user).get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.content
+
+    def test_api_responses(self):
+        def stock_get_fields(serializer):
+            return super(FieldPlanMixin, serializer).get_fields()
+
+        def stock_to_representation(serializer, instance):
+            return super(FieldPlanMixin, serializer).to_representation(
+                instance)
+
+        urls = ('/api/recipes/', '/api/recipes/?limit=2',
+                f'/api/recipes/{self.recipes[0].pk}/', '/api/tags/',
+                '/api/ingredients/', '/api/users/', '/api/users/me/',
+                '/api/users/subscriptions/?recipes_limit=1')
+        for url, user in product(urls, (None, self.reader)):
+            if url.startswith(('/api/users/me/', '/api/users/subs')) and (
+                    user is None):
+                continue
+            with self.subTest(url=url, user=user):
+                expected = self.get(url, user)
+                with mock.patch.object(
+                        FieldPlanMixin, 'get_fields', stock_get_fields), \
+                        mock.patch.object(
+                            FieldPlanMixin, 'to_representation',
+                            stock_to_representation), \
+                        mock.patch.object(
+                            JSONRenderer, 'render',
+                            renderers.JSONRenderer.render):
+                    self.assertEqual(self.get(url, user), expected)
+
+    def test_renderer_data(self):
+        data = {
+            'text': 'кириллица "кавычки" \\ \u2028 \u2029 \U0001f600 \x00',
+            'lazy': gettext_lazy('Not found.'),
+            'numbers': [0, -1, 2 ** 63 - 1, 2 ** 64, True, None],
+            'date': datetime.date(2024, 2, 29),
+            'moment': datetime.datetime(2024, 2, 29, 12, 30, 15, 123456,
+                                        tzinfo=datetime.timezone.utc),
+            'decimal': decimal.Decimal('1.50'),
+            'uuid': uuid.UUID(int=1),
+            1: 'целый ключ',
+            'nested': OrderedDict(b=[{}], a=()),
+        }
+        for value in (data, [data], {}, [], 'строка', 0):
+            with self.subTest(value=value):
+                self.assertEqual(
+                    JSONRenderer().render(value),
+                    renderers.JSONRenderer().render(value))
+        self.assertEqual(JSONRenderer().render(None), b'')
+        context = {'indent': 2}
+        self.assertEqual(
+            JSONRenderer().render(data, 'application/json',
+                                  context),
+            renderers.JSONRenderer().render(data, 'application/json',
+                                            context))
+
+
+class RequestKeyTest(FoodgramTestMixin, TestCase):
+    """Ключ кэша не зависит от записи id и посторонних параметров."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe, = self.create_recipes(self.create_user('author'), 1)
+
+    def test_padded_id_sees_update(self):
+        url = f'/api/recipes/0{self.recipe.pk}/'
+        client = self.client_for()
+        self.assertEqual(client.get(url).json()['name'], self.recipe.name)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.name = 'Новое название'
+            self.recipe.save()
+        self.assertEqual(client.get(url).json()['name'], 'Новое название')
+
+    def test_unknown_params_share_etag(self):
+        client = self.client_for()
+        etag = client.get('/api/recipes/', {'limit': 6})['ETag']
+        response = client.get('/api/recipes/', {'limit': 6, 'utm': 'mail'})
+        self.assertEqual(response['ETag'], etag)
+        response = client.get('/api/recipes/', {'limit': 5})
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class TagFilterTest(FoodgramTestMixin, TestCase):
+    """Фильтр по тэгам — полусоединение EXISTS без DISTINCT."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.lunch = Tag.objects.create(name='Обед', slug='lunch')
+        self.dinner = Tag.objects.create(name='Ужин', slug='dinner')
+        self.breakfast = Tag.objects.create(name='Завтрак', slug='breakfast')
+        self.both, = self.create_recipes(
+            self.author, 1, [self.lunch, self.dinner])
+        self.lunch_only, = self.create_recipes(self.author, 1, [self.lunch])
+        self.create_recipes(self.author, 1, [self.breakfast])
+
+    def filter_recipes(self, *slugs, **params):
+        request = RequestFactory().get(
+            '/api/recipes/', {'tags': list(slugs), **params})
+        request.user = self.author
+        return RecipeFilter(request.GET, queryset=Recipe.objects.all(),
+                            request=request).qs
+
+    def test_recipes_match_any_tag_once(self):
+        queryset = self.filter_recipes('lunch', 'dinner')
+        self.assertCountEqual(queryset, [self.both, self.lunch_only])
+        sql = str(queryset.query).upper()
+        self.assertIn('EXISTS', sql)
+        self.assertNotIn('DISTINCT', sql)
+
+    @skipUnless(connection.vendor == 'postgresql', 'EXPLAIN для PostgreSQL')
+    def test_plan_uses_indexes(self):
+        Favorite.objects.create(user=self.author, recipes=self.both)
+        with connection.cursor() as cursor:
+            # На маленьких таблицах планировщик и так выбрал бы полный
+            # просмотр; без него видно, что индекс для запроса есть.
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = self.filter_recipes(
+            'lunch', 'dinner', is_favorited=1).explain()
+        self.assertNotIn('Seq Scan on recipes_recipe_tags', plan)
+        self.assertNotIn('Seq Scan on recipes_favorite', plan)
+
+
+class RelationsTest(FoodgramTestMixin, TestCase):
+    """Счётчики и статусы учитывают только вставленные этим вызовом записи."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.reader = self.create_user('reader')
+        self.recipes = self.create_recipes(self.author, 2)
+        self.ids = [recipe.pk for recipe in self.recipes]
+        # Запись, появившаяся до вставки, например от параллельного запроса.
+        ShoppingList.objects.bulk_create(
+            [ShoppingList(user=self.reader, recipes=self.recipes[0])])
+
+    def assert_added_once(self):
+        missing = max(self.ids) + 1
+        statuses = relations.add_recipes(
+            ShoppingList, self.reader, [*self.ids, missing])
+        self.assertEqual(statuses, {self.ids[0]: 'exists',
+                                    self.ids[1]: 'created',
+                                    missing: 'not_found'})
+        self.assertEqual(
+            list(Recipe.objects.filter(pk__in=self.ids).order_by(
+                'pk').values_list('shopping_cart_count', flat=True)),
+            [0, 1])
+        statuses = relations.remove_recipes(
+            ShoppingList, self.reader, [self.ids[1], missing])
+        self.assertEqual(statuses, {self.ids[1]: 'deleted',
+                                    missing: 'not_found'})
+        self.assertFalse(ShoppingList.objects.filter(
+            recipes=self.recipes[1]).exists())
+
+    def test_insert_returning(self):
+        self.assertTrue(relations.supports_returning(connection))
+        self.assert_added_once()
+
+    @mock.patch.object(relations, 'supports_returning', return_value=False)
+    def test_insert_without_returning(self, supports_returning):
+        self.assert_added_once()
+
+
+class ShoppingListTest(FoodgramTestMixin, TestCase):
+    """Пошаговые изменения списков покупок совпадают с rebuild()."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.buyers = [self.create_user(f'buyer{number}')
+                       for number in range(2)]
+        self.salt, self.flour, self.milk = [
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('соль', 'мука', 'молоко')]
+        self.bread, self.pancakes = self.create_recipes(
+            self.author, 2, ingredients=[self.salt, self.flour])
+        for buyer in self.buyers:
+            relations.add_recipes(
+                ShoppingList, buyer, [self.bread.pk, self.pancakes.pk])
+
+    def assert_matches_rebuild(self):
+        items = ShoppingListItem.objects.order_by(
+            'user', 'ingredient').values_list('user', 'ingredient', 'amount')
+        incremental = list(items)
+        shopping.rebuild()
+        self.assertEqual(incremental, list(items))
+
+    def test_add_and_remove(self):
+        self.assertEqual(
+            list(shopping.items(self.buyers[0])),
+            [('мука', 'г', 20), ('соль', 'г', 20)])
+        relations.remove_recipes(ShoppingList, self.buyers[0],
+                                 [self.bread.pk])
+        self.assert_matches_rebuild()
+        ShoppingList.objects.filter(user=self.buyers[1]).delete()
+        self.assert_matches_rebuild()
+        ShoppingList.objects.create(user=self.buyers[1], recipes=self.bread)
+        self.assert_matches_rebuild()
+
+    def test_recipe_patch(self):
+        response = self.client_for(self.author).patch(
+            f'/api/recipes/{self.bread.pk}/', {
+                'tags': [Tag.objects.create(name='Обед', slug='lunch').pk],
+                'ingredients': [{'id': self.flour.pk, 'amount': 25},
+                                {'id': self.milk.pk, 'amount': 5}],
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(shopping.items(self.buyers[0])),
+            [('молоко', 'г', 5), ('мука', 'г', 35), ('соль', 'г', 10)])
+        self.assert_matches_rebuild()
+
+    def test_ingredient_rows_outside_serializer(self):
+        row = self.bread.recipes_ingredients.get(ingredient=self.salt)
+        row.amount = 15
+        row.save()
+        self.assert_matches_rebuild()
+        row.ingredient = self.milk
+        row.save()
+        self.assert_matches_rebuild()
+        row.recipe = self.create_recipes(self.author, 1)[0]
+        row.save()
+        self.assert_matches_rebuild()
+        IngredientInRecipe.objects.create(
+            recipe=self.pancakes, ingredient=self.milk, amount=7)
+        self.assert_matches_rebuild()
+        self.pancakes.recipes_ingredients.filter(
+            ingredient=self.salt).delete()
+        self.assert_matches_rebuild()
+        self.flour.delete()
+        self.assert_matches_rebuild()
+
+    def test_recipe_and_author_delete(self):
+        self.bread.delete()
+        self.assert_matches_rebuild()
+        self.assertEqual(list(shopping.items(self.buyers[0])),
+                         [('мука', 'г', 10), ('соль', 'г', 10)])
+        self.author.delete()
+        self.assert_matches_rebuild()
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+
+@override_settings(REPLICA_DATABASES=['replica'], REPLICA_STICKY_SECONDS=10)
+class ReplicaReadTest(FoodgramTestMixin, TestCase):
+    """Чтение с реплики, запись и чтение сразу после записи — с основной БД.
+
+    Реплика в тестах — отдельная пустая БД, поэтому прочитанное с неё
+    видно по пустому ответу.
+    """
+
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.reader = self.create_user('reader')
+        self.recipe, = self.create_recipes(self.author, 1)
+        # Данные изменились давно, read_primary_if_changed не вмешивается.
+        patcher = mock.patch.object(replicas, 'time', mock.Mock(
+            time_ns=lambda: time.time_ns() + 60 * 10 ** 9))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def recipe_ids(self, user=None):
+        with CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client_for(user).get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        ids = [recipe['id'] for recipe in response.json()['results']]
+        self.assertEqual(bool(replica.captured_queries), not ids)
+        return ids
+
+    def test_safe_requests_read_replica(self):
+        self.assertEqual(self.recipe_ids(), [])
+        self.assertEqual(self.recipe_ids(self.reader), [])
+        self.assertEqual(
+            self.client_for().get(
+                f'/api/recipes/{self.recipe.pk}/').status_code, 404)
+
+    def test_write_goes_to_primary_and_sticks(self):
+        for action, model in (('favorite', Favorite),
+                              ('shopping_cart', ShoppingList)):
+            with self.subTest(action=action):
+                cache.delete(replicas.primary_key(self.reader.pk))
+                response = self.client_for(self.reader).post(
+                    f'/api/recipes/{self.recipe.pk}/{action}/')
+                self.assertEqual(response.status_code, 201)
+                self.assertTrue(model.objects.using('default').filter(
+                    user=self.reader).exists())
+                self.assertFalse(model.objects.using('replica').exists())
+                self.assertEqual(self.recipe_ids(self.reader),
+                                 [self.recipe.pk])
+                self.assertEqual(self.recipe_ids(self.author), [])
+
+    def test_recipe_write_sticks(self):
+        response = self.client_for(self.author).patch(
+            f'/api/recipes/{self.recipe.pk}/', {
+                'name': 'Суп',
+                'tags': [Tag.objects.create(name='Обед', slug='lunch').pk],
+                'ingredients': [{'id': Ingredient.objects.create(
+                    name='соль', measurement_unit='г').pk, 'amount': 5}],
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.recipe_ids(self.author), [self.recipe.pk])
+        cache.delete(replicas.primary_key(self.author.pk))
+        self.assertEqual(self.recipe_ids(self.author), [])
+
+    def test_failed_write_does_not_stick(self):
+        response = self.client_for(self.reader).post(
+            f'/api/recipes/{self.recipe.pk + 1}/favorite/')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.recipe_ids(self.reader), [])
+
+    def test_recent_change_reads_primary(self):
+        with mock.patch.object(replicas, 'time', time):
+            self.assertEqual(self.recipe_ids(), [self.recipe.pk])
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'SQLite не пускает параллельных писателей')
+class ParallelCreateTest(FoodgramTestMixin, TransactionTestCase):
+    """Параллельные одинаковые POST дают одну запись и 400 вместо 500."""
+
+    threads = 8
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.reader = self.create_user('reader')
+        self.recipe, = self.create_recipes(self.author, 1)
+
+    def post_in_parallel(self, url):
+        barrier = threading.Barrier(self.threads)
+
+        def post(_):
+            try:
+                client = self.client_for(self.reader)
+                barrier.wait()
+                return client.post(url).status_code
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(self.threads) as executor:
+            statuses = sorted(executor.map(post, range(self.threads)))
+        self.assertEqual(statuses, [201] + [400] * (self.threads - 1))
+
+    def test_subscribe(self):
+        self.post_in_parallel(f'/api/users/{self.author.pk}/subscribe/')
+        self.assertEqual(Subscribe.objects.filter(
+            user=self.reader, subscriber=self.author).count(), 1)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.subscribers_count, 1)
+
+    def test_favorite(self):
+        self.post_in_parallel(f'/api/recipes/{self.recipe.pk}/favorite/')
+        self.assertEqual(Favorite.objects.filter(
+            user=self.reader, recipes=self.recipe).count(), 1)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+
+    def test_shopping_cart(self):
+        self.post_in_parallel(
+            f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+        self.assertEqual(ShoppingList.objects.filter(
+            user=self.reader, recipes=self.recipe).count(), 1)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.shopping_cart_count, 1)
+
+
+class SearchTest(FoodgramTestMixin, TestCase):
+    """Полнотекстовый поиск: релевантность, ё и пагинация."""
+
+    def setUp(self):
+        super().setUp()
+        author = self.create_user('author')
+        beet = Ingredient.objects.create(name='Свёкла', measurement_unit='г')
+        self.borsch, self.soup = self.create_recipes(author, 2)
+        self.salad, = self.create_recipes(author, 1, ingredients=[beet])
+        Recipe.objects.filter(pk=self.borsch.pk).update(name='Борщ')
+        Recipe.objects.filter(pk=self.soup.pk).update(
+            name='Суп', text='Почти как борщ')
+        Recipe.objects.filter(pk=self.salad.pk).update(name='Салат')
+        rebuild_index()
+
+    def search(self, query, **params):
+        response = self.client_for().get(
+            '/api/recipes/', {'search': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_name_ranks_above_text(self):
+        # Борщ старше супа, но совпадение в названии весит больше.
+        self.assertEqual(self.search('борщ'), [self.borsch.pk, self.soup.pk])
+
+    def test_yo_in_ingredient(self):
+        self.assertEqual(self.search('свекла'), [self.salad.pk])
+
+    def test_cursor_keeps_relevance(self):
+        self.assertEqual(self.search('борщ', cursor=''),
+                         [self.borsch.pk, self.soup.pk])
+
+    @skipUnless(connection.vendor == 'postgresql', 'EXPLAIN для PostgreSQL')
+    def test_plan_uses_gin_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = search_recipes(Recipe.objects.all(), 'борщ').explain()
+        self.assertIn('recipes_recipe_search_document_idx', plan)
+
+
+class ImportCommandTest(FoodgramTestMixin, TestCase):
+    """csv_load_data считает созданные и обновлённые записи."""
+
+    def test_counts_and_rejects(self):
+        Tag.objects.create(name='Обед', slug='lunch')
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'tags.json'
+            path.write_text(json.dumps([
+                {'name': 'Второй обед', 'slug': 'lunch'},
+                {'name': 'Ужин', 'slug': 'dinner'},
+                ['Завтрак', 'breakfast'],
+                'snack',
+            ]), encoding='utf-8')
+            stdout, stderr = StringIO(), StringIO()
+            call_command('csv_load_data', str(path), 'tag',
+                         stdout=stdout, stderr=stderr)
+        self.assertIn('создано 1, обновлено 1', stdout.getvalue())
+        self.assertIn('отклонено 2', stdout.getvalue())
+        self.assertIn('Строка 3 отклонена: Ожидался объект',
+                      stderr.getvalue())
+        self.assertIn('Строка 4 отклонена', stderr.getvalue())
+        self.assertEqual(Tag.objects.get(slug='lunch').name, 'Второй обед')
+        self.assertTrue(Tag.objects.filter(slug='dinner').exists())
+
+
+class FeedFanOutTest(FoodgramTestMixin, TestCase):
+    """Рассылка рецепта в ленты идёт после коммита и вне запроса."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.readers = [self.create_user(f'reader{number}')
+                        for number in range(3)]
+        for reader in self.readers:
+            Subscribe.objects.create(user=reader, subscriber=self.author)
+        self.recipe, = self.create_recipes(self.author, 1)
+
+    def feed_ids(self, user):
+        return [recipe_id for recipe_id, pub_date in feed.timeline(user)]
+
+    @override_settings(FEED_WORKERS=0)
+    def test_fan_out_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            feed.schedule_fan_out(self.recipe)
+            self.assertFalse(FeedEntry.objects.exists())
+        for reader in self.readers:
+            self.assertEqual(self.feed_ids(reader), [self.recipe.pk])
+
+    @override_settings(FEED_WORKERS=1)
+    def test_fan_out_in_worker(self):
+        with mock.patch.object(feed, 'get_executor') as get_executor:
+            with self.captureOnCommitCallbacks(execute=True):
+                feed.schedule_fan_out(self.recipe)
+        get_executor.return_value.submit.assert_called_once_with(
+            feed.fan_out_in_worker, self.recipe.pk)
+
+    @mock.patch.object(feed, 'FEED_FANOUT_BATCH', 2)
+    def test_fan_out_in_batches(self):
+        feed.fan_out(self.recipe.pk)
+        for reader in self.readers:
+            self.assertEqual(self.feed_ids(reader), [self.recipe.pk])
+
+    @mock.patch.object(feed, 'FEED_FANOUT_LIMIT', 2)
+    def test_popular_author_read_on_request(self):
+        feed.fan_out(self.recipe.pk)
+        self.assertFalse(FeedEntry.objects.filter(
+            recipe=self.recipe).exists())
+        self.assertEqual(self.feed_ids(self.readers[0]), [self.recipe.pk])
+
+
+@override_settings(INSTRUMENTATION_SAMPLE_RATE=1)
+class InstrumentationTest(FoodgramTestMixin, TestCase):
+    """Метрики запроса без подмены классов DRF."""
+
+    def test_server_timing(self):
+        author = self.create_user('author')
+        self.create_recipes(author, 3)
+        with mock.patch('backend.middleware.logger') as logger:
+            response = self.client_for().get('/api/recipes/')
+        timings = {}
+        for item in response['Server-Timing'].split(','):
+            name, _, duration = item.strip().partition(';dur=')
+            timings[name] = float(duration.split(';')[0])
+        serializer_ms = timings['serializer']
+        self.assertGreater(serializer_ms, 0)
+        self.assertEqual(logger.info.call_args.args[0]['serializer_ms'],
+                         serializer_ms)
+        self.assertEqual(BaseSerializer.data.fget.__module__,
+                         'rest_framework.serializers')
@@ -1,32 +1,54 @@
 import csv
-import io
-
-from django.db.models import Exists, OuterRef, Sum
-from django.http import FileResponse
+import hashlib
+import json
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch
+from django.http import StreamingHttpResponse
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.serializers import SetPasswordSerializer
 from djoser.views import UserViewSet as DjoserUserViewSet
 from rest_framework import filters, status
 from rest_framework.decorators import action
-from rest_framework.pagination import (LimitOffsetPagination,
-                                       PageNumberPagination)
 from rest_framework.permissions import (IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
+from . import shopping
+from .async_views import AsyncReadMixin
+from .autocomplete import ingredient_autocomplete
+from .cache import (ALL_RECIPES, aget_or_revalidate, aget_or_set,
+                    get_or_revalidate, get_or_set, get_version)
+from .feed import schedule_fan_out, timeline
+from .coverage import recipe_coverage
 from .filters import IngredientFilter, RecipeFilter
 from .models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
-                     ShoppingList, Subscribe, Tag, User)
+                     ShoppingList, Tag, User)
+from .pagination import (LimitOffsetPagination, PageNumberPagination,
+                         RecipeCursorPagination)
 from .permissions import CustomPermission
+from .relations import add_recipes, remove_recipes
+from .replicas import ReplicaReadMixin, read_primary_if_changed
+from .renderers import CSVRenderer, JSONRenderer, PlainTextRenderer
 from .serializers import (AvatarSerializer, CustomUserCreateSerializer,
                           FavoriteSerializer, IngredientSerializer,
-                          RecipeGetSerializer, RecipeWriteSerializer,
-                          ShoppingListSerializer, SubscribeSerializer,
+                          RecipeGetSerializer, RecipeIdsSerializer,
+                          RecipeWriteSerializer, ShoppingListSerializer,
+                          SubscribeSerializer,
                           TagSerializer, UserSerializer,
                           IngredientInRecipeSerializer)
-from backend.constants import PAGE_SIZE
+from backend.constants import (MAX_PAGE_SIZE, PAGE_SIZE, RECIPE_CACHE_TIMEOUT,
+                               RECIPE_MAX_AGE, REFERENCE_MAX_AGE,
+                               REFERENCE_VERSION_TTL)
+from backend.middleware import SerializerTimingMixin
 
 
 class PaginationNone(PageNumberPagination):
@@ -38,31 +60,319 @@ class CustomPagination(PageNumberPagination):
     page_size_query_param = 'limit'
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class ConditionalGetMixin:
+    """Отдаёт ETag/Last-Modified и отвечает 304 до запуска сериализатора.
+
+    ETag собирается из версий моделей version_models (см. cache.get_version)
+    и параметров запроса, поэтому тело ответа не хэшируется. В ключ входят
+    только параметры request_key_params, которые читает представление,
+    а id из адреса приводится к числу: /01/ и /1/ — один ключ. Если ответ
+    зависит от пользователя (user_dependent), в ETag входит и версия его
+    избранного, корзины и подписок, а кэшировать ответ может только клиент.
+    Остальные ответы nginx может держать public_max_age секунд.
+    """
+
+    version_models = ()
+    version_ttl = REFERENCE_VERSION_TTL
+    user_dependent = False
+    public_max_age = 0
+    request_key_params = ()
+
+    def get_versions(self, request):
+        versions = [get_version(model, ttl=self.version_ttl)
+                    for model in self.version_models]
+        if self.user_dependent and request.user.is_authenticated:
+            versions.append(get_version(User, scope=request.user.pk))
+        return versions
+
+    def get_lookup_value(self):
+        value = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        return int(value) if value.isdigit() else value
+
+    def get_request_key(self, request, **kwargs):
+        if self.action == 'retrieve':
+            key = f'detail:{self.get_lookup_value()}'
+        else:
+            params = (*self.request_key_params,
+                      api_settings.URL_FORMAT_OVERRIDE)
+            key = f'{self.action}:' + urlencode(
+                sorted((name, sorted(values)) for name, values
+                       in request.query_params.lists() if name in params),
+                doseq=True)
+        if self.user_dependent and request.user.is_authenticated:
+            key += f':user:{request.user.pk}'
+        return key
+
+    def get_validators(self, key, versions):
+        digest = hashlib.md5(f'{key}:{versions}'.encode()).hexdigest()[:16]
+        return f'"{self.basename}-{digest}"', max(versions) // 10 ** 9
+
+    def conditional_response(self, request, key, get_response):
+        versions = self.get_versions(request)
+        read_primary_if_changed(versions)
+        etag, last_modified = self.get_validators(key, versions)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = get_response(versions)
+        return self.patch_validators(request, response, etag, last_modified)
+
+    async def aconditional_response(self, request, key, get_response):
+        versions = await sync_to_async(self.get_versions)(request)
+        read_primary_if_changed(versions)
+        etag, last_modified = self.get_validators(key, versions)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = await get_response(versions)
+        return self.patch_validators(request, response, etag, last_modified)
+
+    def patch_validators(self, request, response, etag, last_modified):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        if self.user_dependent:
+            patch_vary_headers(response, ('Authorization',))
+        if self.user_dependent and request.user.is_authenticated:
+            patch_cache_control(response, private=True, no_cache=True)
+        else:
+            patch_cache_control(response, public=True,
+                                max_age=self.public_max_age)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        get_list = super().list
+        return self.conditional_response(
+            request, self.get_request_key(request, **kwargs),
+            lambda versions: get_list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        get_detail = super().retrieve
+        return self.conditional_response(
+            request, self.get_request_key(request, **kwargs),
+            lambda versions: get_detail(request, *args, **kwargs))
+
+    async def alist(self, request, *args, **kwargs):
+        get_list = super().alist
+        return await self.aconditional_response(
+            request, self.get_request_key(request, **kwargs),
+            lambda versions: get_list(request, *args, **kwargs))
+
+    async def aretrieve(self, request, *args, **kwargs):
+        get_detail = super().aretrieve
+        return await self.aconditional_response(
+            request, self.get_request_key(request, **kwargs),
+            lambda versions: get_detail(request, *args, **kwargs))
+
+
+class AnonymousCacheMixin(ConditionalGetMixin):
+    """Кэширует ответы list/retrieve анонимным пользователям в общем кэше.
+
+    Анонимы с одинаковым запросом получают одинаковый ответ, поэтому он
+    хранится по ключу ETag (без версий) вместе с версиями, по которым
+    посчитан. Смена версии делает запись устаревшей; пересчитывает её
+    один запрос, остальные до его окончания получают прежний ответ с
+    прежними ETag и Last-Modified (см. cache.get_or_revalidate).
+    """
+
+    anonymous_cache_timeout = RECIPE_CACHE_TIMEOUT
+
+    def get_anonymous_key(self, request, key):
+        # Ссылки в ответе абсолютные, поэтому адрес сайта входит в ключ.
+        digest = hashlib.md5(
+            f'{request.scheme}://{request.get_host()}:{key}'.encode()
+        ).hexdigest()
+        return f'anonymous:{self.basename}:{digest}'
+
+    def anonymous_response(self, request, key, compute):
+        versions = self.get_versions(request)
+        read_primary_if_changed(versions)
+        etag, last_modified = self.get_validators(key, versions)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            served, data = get_or_revalidate(
+                self.get_anonymous_key(request, key), versions, compute,
+                self.anonymous_cache_timeout)
+            if served != versions:
+                etag, last_modified = self.get_validators(key, served)
+            response = Response(data)
+        return self.patch_validators(request, response, etag, last_modified)
+
+    async def aanonymous_response(self, request, key, compute):
+        versions = await sync_to_async(self.get_versions)(request)
+        read_primary_if_changed(versions)
+        etag, last_modified = self.get_validators(key, versions)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            served, data = await aget_or_revalidate(
+                self.get_anonymous_key(request, key), versions, compute,
+                self.anonymous_cache_timeout)
+            if served != versions:
+                etag, last_modified = self.get_validators(key, served)
+            response = Response(data)
+        return self.patch_validators(request, response, etag, last_modified)
+
+    def list(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().list(request, *args, **kwargs)
+        get_list = super(ConditionalGetMixin, self).list
+        return self.anonymous_response(
+            request, self.get_request_key(request, **kwargs),
+            lambda: get_list(request, *args, **kwargs).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().retrieve(request, *args, **kwargs)
+        get_detail = super(ConditionalGetMixin, self).retrieve
+        return self.anonymous_response(
+            request, self.get_request_key(request, **kwargs),
+            lambda: get_detail(request, *args, **kwargs).data)
+
+    async def alist(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return await super().alist(request, *args, **kwargs)
+        get_list = super(ConditionalGetMixin, self).alist
+
+        async def compute():
+            return (await get_list(request, *args, **kwargs)).data
+
+        return await self.aanonymous_response(
+            request, self.get_request_key(request, **kwargs), compute)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return await super().aretrieve(request, *args, **kwargs)
+        get_detail = super(ConditionalGetMixin, self).aretrieve
+
+        async def compute():
+            return (await get_detail(request, *args, **kwargs)).data
+
+        return await self.aanonymous_response(
+            request, self.get_request_key(request, **kwargs), compute)
+
+
+class ReferenceCacheMixin(ConditionalGetMixin):
+    """Кэширует ответы справочников в памяти процесса и в общем кэше."""
+
+    public_max_age = REFERENCE_MAX_AGE
+
+    @property
+    def version_models(self):
+        return (self.queryset.model,)
+
+    def cached_response(self, request, key, compute):
+        model = self.queryset.model
+        return self.conditional_response(
+            request, key,
+            lambda versions: Response(
+                get_or_set(model, versions[0], key, compute)))
+
+    def list(self, request, *args, **kwargs):
+        get_list = super(ConditionalGetMixin, self).list
+        return self.cached_response(
+            request, self.get_request_key(request, **kwargs),
+            lambda: get_list(request, *args, **kwargs).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        get_detail = super(ConditionalGetMixin, self).retrieve
+        return self.cached_response(
+            request, self.get_request_key(request, **kwargs),
+            lambda: get_detail(request, *args, **kwargs).data)
+
+    async def acached_response(self, request, key, compute):
+        model = self.queryset.model
+
+        async def get_response(versions):
+            return Response(
+                await aget_or_set(model, versions[0], key, compute))
+
+        return await self.aconditional_response(request, key, get_response)
+
+    async def alist(self, request, *args, **kwargs):
+        get_list = super(ConditionalGetMixin, self).alist
+
+        async def compute():
+            return (await get_list(request, *args, **kwargs)).data
+
+        return await self.acached_response(
+            request, self.get_request_key(request, **kwargs), compute)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        get_detail = super(ConditionalGetMixin, self).aretrieve
+
+        async def compute():
+            return (await get_detail(request, *args, **kwargs)).data
+
+        return await self.acached_response(
+            request, self.get_request_key(request, **kwargs), compute)
+
+
+class IngredientViewSet(ReferenceCacheMixin, AsyncReadMixin,
+                        ReplicaReadMixin, SerializerTimingMixin,
+                        ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = PaginationNone
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
-
-
-class IngredientInRecipeViewSet(ReadOnlyModelViewSet):
-    queryset = IngredientInRecipe.objects.all()
+    request_key_params = ('name',)
+    async_actions = ('list', 'retrieve')
+    replica_actions = ('list', 'retrieve')
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        index = ingredient_autocomplete.get_index() if name else None
+        if index is None:
+            return super().list(request, *args, **kwargs)
+        return self.cached_response(
+            request, f'autocomplete:{name.lower()}',
+            lambda: index.search(name))
+
+    async def alist(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        index = None
+        if name:
+            index = await sync_to_async(ingredient_autocomplete.get_index)()
+        if index is None:
+            return await super().alist(request, *args, **kwargs)
+
+        async def compute():
+            return index.search(name)
+
+        return await self.acached_response(
+            request, f'autocomplete:{name.lower()}', compute)
+
+
+class IngredientInRecipeViewSet(ConditionalGetMixin, SerializerTimingMixin,
+                                ReadOnlyModelViewSet):
+    queryset = IngredientInRecipe.objects.select_related('ingredient')
+    version_models = (IngredientInRecipe, Ingredient)
+    public_max_age = REFERENCE_MAX_AGE
     serializer_class = IngredientInRecipeSerializer
     pagination_class = PaginationNone
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
+    request_key_params = ('name',)
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+class TagViewSet(ReferenceCacheMixin, AsyncReadMixin, ReplicaReadMixin,
+                 SerializerTimingMixin, ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = PaginationNone
-
-
-class RecipeViewSet(ModelViewSet):
-    queryset = Recipe.objects.prefetch_related('author', 'ingredients',
-                                               'tags')
+    async_actions = ('list', 'retrieve')
+    replica_actions = ('list', 'retrieve')
+
+
+class RecipeViewSet(AnonymousCacheMixin, AsyncReadMixin, ReplicaReadMixin,
+                    SerializerTimingMixin, ModelViewSet):
+    queryset = Recipe.objects.select_related('author').prefetch_related(
+        'tags',
+        Prefetch('recipes_ingredients',
+                 queryset=IngredientInRecipe.objects.select_related(
+                     'ingredient')),
+    )
     permission_classes = [IsAuthenticatedOrReadOnly, CustomPermission]
     pagination_class = CustomPagination
     filter_backends = (DjangoFilterBackend,)
@@ -70,6 +380,28 @@ class RecipeViewSet(ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete']
     serializer_class = RecipeWriteSerializer
     pk_url_kwarg = 'pk'
+    lookup_value_regex = r'\d+'
+    version_models = (Recipe, Tag, Ingredient)
+    version_ttl = 0
+    user_dependent = True
+    public_max_age = RECIPE_MAX_AGE
+    request_key_params = ('author', 'count', 'cursor', 'is_favorited',
+                          'is_in_shopping_cart', 'limit', 'page', 'search',
+                          'tags')
+    async_actions = ('list', 'retrieve')
+    replica_actions = ('list', 'retrieve', 'feed')
+
+    def get_versions(self, request):
+        # Рецепт сбрасывается своей версией, а не версией всех рецептов.
+        if self.action != 'retrieve':
+            return super().get_versions(request)
+        versions = [get_version(Recipe, scope=self.get_lookup_value()),
+                    get_version(Recipe, scope=ALL_RECIPES),
+                    get_version(Tag, ttl=self.version_ttl),
+                    get_version(Ingredient, ttl=self.version_ttl)]
+        if request.user.is_authenticated:
+            versions.append(get_version(User, scope=request.user.pk))
+        return versions
 
     def get_queryset(self):
         user = self.request.user
@@ -87,6 +419,17 @@ class RecipeViewSet(ModelViewSet):
             )
         return super().get_queryset()
 
+    @property
+    def paginator(self):
+        # Курсор задаёт порядок (-pub_date, id), а поиск упорядочен по
+        # релевантности, поэтому с search выдача идёт постранично.
+        cursor_param = RecipeCursorPagination.cursor_query_param
+        if (not hasattr(self, '_paginator') and self.action == 'list'
+                and cursor_param in self.request.query_params
+                and not self.request.query_params.get('search')):
+            self._paginator = RecipeCursorPagination()
+        return super().paginator
+
     def get_serializer_class(self):
         if self.action in ['shopping_cart', 'download_shopping_cart']:
             return ShoppingListSerializer
@@ -99,8 +442,10 @@ class RecipeViewSet(ModelViewSet):
         return super().get_serializer_class()
 
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        recipe = serializer.save(author=self.request.user)
+        schedule_fan_out(recipe)
 
+    @transaction.atomic
     def recipe_post(self):
         request_user = self.request.user
         get_recipe = get_object_or_404(Recipe,
@@ -112,40 +457,97 @@ class RecipeViewSet(ModelViewSet):
         return Response(serializer.data, status=status.HTTP_201_CREATED,
                         headers=get_headers)
 
-    def recipe_delete(self, manager):
-        request_user = self.request.user
-        get_recipe = get_object_or_404(Recipe,
-                                       pk=self.kwargs[self.pk_url_kwarg])
-        recipe = manager.filter(user=request_user, recipes=get_recipe)
-        if recipe.exists():
-            recipe.delete()
+    def recipe_delete(self, model):
+        recipe_id = int(self.kwargs[self.pk_url_kwarg])
+        statuses = remove_recipes(model, self.request.user, [recipe_id])
+        if statuses[recipe_id] == 'deleted':
             return Response(status=status.HTTP_204_NO_CONTENT)
+        get_object_or_404(Recipe, pk=recipe_id)
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
+    def recipes_bulk(self, model):
+        serializer = RecipeIdsSerializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        if self.request.method == 'POST':
+            statuses = add_recipes(model, self.request.user, recipe_ids)
+        else:
+            statuses = remove_recipes(model, self.request.user, recipe_ids)
+        return Response({'results': [
+            {'id': pk, 'status': statuses[pk]} for pk in recipe_ids]})
+
+    @action(methods=['get'], detail=False)
+    def by_ingredients(self, request):
+        try:
+            have = [int(value) for values in request.query_params.getlist(
+                'have') for value in values.split(',') if value.strip()]
+            limit = min(int(request.query_params.get('limit', PAGE_SIZE)),
+                        MAX_PAGE_SIZE)
+        except ValueError:
+            return Response({'have': ['Ожидается список id ингредиентов.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        top = recipe_coverage.top(have, max(limit, 0))
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, matched, total in top])
+        results = []
+        for recipe_id, matched, total in top:
+            if recipe_id not in recipes:
+                continue
+            data = self.get_serializer(recipes[recipe_id]).data
+            data['matched_ingredients'] = matched
+            data['total_ingredients'] = total
+            results.append(data)
+        return Response({'results': results})
+
+    @action(methods=['post', 'delete'], detail=False,
+            url_path='shopping_cart', permission_classes=[IsAuthenticated])
+    def bulk_shopping_cart(self, request):
+        return self.recipes_bulk(ShoppingList)
+
+    @action(methods=['post', 'delete'], detail=False, url_path='favorite',
+            permission_classes=[IsAuthenticated])
+    def bulk_favorite(self, request):
+        return self.recipes_bulk(Favorite)
+
     @action(methods=['post'], detail=True, )
     def shopping_cart(self, request, pk=None):
         return self.recipe_post()
 
     @shopping_cart.mapping.delete
     def delete_shopping_cart(self, request, pk=None):
-        return self.recipe_delete(ShoppingList.objects)
+        return self.recipe_delete(ShoppingList)
 
-    @action(methods=['get'], detail=False, )
+    @action(methods=['get'], detail=False,
+            permission_classes=[IsAuthenticated],
+            renderer_classes=[CSVRenderer, PlainTextRenderer, JSONRenderer])
     def download_shopping_cart(self, request, pk=None):
-        shop_list = get_shop_list(self.request.user)
-        response = FileResponse(iter([shop_list.getvalue()]),
-                                content_type='text/csv')
-        response[
-            'Content-Disposition'] = 'attachment; filename="shopping_cart.csv"'
+        renderer = request.accepted_renderer
+        writer = SHOP_LIST_WRITERS[renderer.format]
+        response = StreamingHttpResponse(
+            writer(shopping.items(request.user)),
+            content_type=f'{renderer.media_type}; charset=utf-8'
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_cart.{renderer.format}"')
         return response
 
+    @action(methods=['get'], detail=False,
+            permission_classes=[IsAuthenticated])
+    def feed(self, request):
+        page = self.paginate_queryset(timeline(request.user))
+        recipe_ids = [recipe_id for recipe_id, pub_date in page]
+        recipes = self.get_queryset().in_bulk(recipe_ids)
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in recipe_ids if pk in recipes], many=True)
+        return self.get_paginated_response(serializer.data)
+
     @action(methods=['post'], detail=True, )
     def favorite(self, request, pk=None):
         return self.recipe_post()
 
     @favorite.mapping.delete
     def delete_favorite(self, request, pk=None):
-        return self.recipe_delete(Favorite.objects)
+        return self.recipe_delete(Favorite)
 
     @action(methods=['GET'], detail=True, url_path='get-link')
     def get_link(self, request, pk):
@@ -154,22 +556,22 @@ class RecipeViewSet(ModelViewSet):
         return Response({'short-link': url}, status=status.HTTP_200_OK)
 
 
-class UserViewSet(DjoserUserViewSet):
+class UserViewSet(AsyncReadMixin, ReplicaReadMixin, SerializerTimingMixin,
+                  DjoserUserViewSet):
     pagination_class = LimitOffsetPagination
     filter_backends = [filters.SearchFilter]
     pk_url_kwarg = 'id'
     search_fields = ['username']
     http_method_names = ['get', 'post', 'put', 'delete']
+    async_actions = ('subscriptions',)
+    replica_actions = ('list', 'subscriptions')
 
     def get_queryset(self):
         user = self.request.user
         queryset = User.objects.all()
         if user.is_authenticated:
-            subscribers_all = user.subscribers.all()
-            subscribers = subscribers_all.values_list('user', flat=True)
             queryset = queryset.annotate(
-                is_subscribed=Exists(Subscribe.objects.filter(
-                    user__in=subscribers,
+                is_subscribed=Exists(user.subscription_author.filter(
                     subscriber=OuterRef('pk')
                 ))
             )
@@ -182,6 +584,7 @@ class UserViewSet(DjoserUserViewSet):
 
     @action(detail=True, methods=['post'],
             permission_classes=[IsAuthenticated])
+    @transaction.atomic
     def subscribe(self, request, *args, **kwargs):
         request_user = self.request.user
         get_user = get_object_or_404(User, pk=kwargs[self.pk_url_kwarg])
@@ -195,11 +598,32 @@ class UserViewSet(DjoserUserViewSet):
     @action(detail=False, methods=['get'],
             permission_classes=[IsAuthenticated])
     def subscriptions(self, request, *args, **kwargs):
-        request_users = self.request.user.subscription_author.all()
-        paginate = self.paginate_queryset(request_users)
-        serializer = self.get_serializer(paginate, many=True)
-        serializer = self.get_paginated_response(serializer.data)
-        return Response(serializer.data)
+        return self.subscriptions_response(
+            self.paginate_queryset(self.get_subscriptions()))
+
+    async def asubscriptions(self, request, *args, **kwargs):
+        return self.subscriptions_response(
+            await self.apaginate_queryset(self.get_subscriptions()))
+
+    def get_subscriptions(self):
+        # Срез в Prefetch превращается в ROW_NUMBER() OVER (PARTITION BY
+        # author_id): рецепты всех авторов страницы берутся одним запросом.
+        recipes = Recipe.objects.only('id', 'author', 'name', 'image',
+                                      'image_variants', 'cooking_time',
+                                      'pub_date')
+        recipes_limit = self.request.query_params.get('recipes_limit')
+        if recipes_limit:
+            recipes = recipes[:int(recipes_limit)]
+        return self.request.user.subscription_author.select_related(
+            'subscriber').prefetch_related(
+            Prefetch('subscriber__recipe', queryset=recipes,
+                     to_attr='page_recipes'))
+
+    def subscriptions_response(self, page):
+        for subscription in page:
+            subscription.subscriber.is_subscribed = True
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
     @action(detail=False, methods=['put'],
             permission_classes=[IsAuthenticated],
@@ -218,14 +642,14 @@ class UserViewSet(DjoserUserViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @subscribe.mapping.delete
+    @transaction.atomic
     def unsubscribe(self, request, *args, **kwargs):
-        request_user = self.request.user
-        get_user = get_object_or_404(User, pk=kwargs[self.pk_url_kwarg])
-        subscription = request_user.subscription_author.filter(
-            subscriber=get_user).first()
-        if subscription:
-            subscription.delete()
+        user_id = kwargs[self.pk_url_kwarg]
+        deleted, _ = self.request.user.subscription_author.filter(
+            subscriber=user_id).delete()
+        if deleted:
             return Response(status=status.HTTP_204_NO_CONTENT)
+        get_object_or_404(User, pk=user_id)
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
     def get_serializer_class(self):
@@ -238,20 +662,37 @@ class UserViewSet(DjoserUserViewSet):
         return UserSerializer
 
 
-def get_shop_list(user):
-    """Получить список покупок"""
-    count_ingredients = {}
-    shop_list = io.StringIO()
-    writer = csv.writer(shop_list)
-    writer.writerow(['Ингредиент', 'Количество'])
-    user_shopping_list = user.shoppinglist_users.all()
-    ingredients = (IngredientInRecipe.objects.filter(
-        recipe__in=user_shopping_list.values_list('recipes',
-                                                  flat=True)).values(
-        'ingredient__name').annotate(total_amount=Sum('amount')))
-    for item in ingredients:
-        count_ingredients[item['ingredient__name']] = item['total_amount']
-    for key, value in count_ingredients.items():
-        writer.writerow([key, value])
-    shop_list.seek(0)
-    return shop_list
+class Echo:
+    """Псевдо-буфер для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def shop_list_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(['Ингредиент', 'Единица измерения', 'Количество'])
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def shop_list_txt(rows):
+    for name, measurement_unit, amount in rows:
+        yield f'{name} ({measurement_unit}) — {amount}\n'
+
+
+def shop_list_json(rows):
+    yield '['
+    for index, (name, measurement_unit, amount) in enumerate(rows):
+        item = json.dumps({'name': name,
+                           'measurement_unit': measurement_unit,
+                           'amount': amount}, ensure_ascii=False)
+        yield f',{item}' if index else item
+    yield ']'
+
+
+SHOP_LIST_WRITERS = {
+    'csv': shop_list_csv,
+    'txt': shop_list_txt,
+    'json': shop_list_json,
+}